@@ -3,6 +3,8 @@
 from os import listdir
 from re import compile as reCompile
 
+from UICompiler import compileUiFile, compiledFileName
+
 PROCESSOR = reCompile('(?is)([\t ]*(?:<hints>.*?</hints>|<property name="sizeHint">.*?</property>|<property name="geometry">.*?</property>)[\n\r]*)')
 
 def main():
@@ -17,12 +19,13 @@ def main():
         print("%d bytes read" % len(content), end = '', flush = True)
         (processed, n) = PROCESSOR.subn('', content)
         if not n:
-            print(", no matches found, not changing")
-            continue
-        print(", %d matches found" % n, end = '', flush = True)
-        with open(fileName, 'w') as f:
-            f.write(processed)
-        print(", %d bytes written, %d bytes saved" % (len(processed), len(content) - len(processed)))
+            print(", no matches found, not changing", end = '', flush = True)
+        else:
+            print(", %d matches found" % n, end = '', flush = True)
+            with open(fileName, 'w') as f:
+                f.write(processed)
+            print(", %d bytes written, %d bytes saved" % (len(processed), len(content) - len(processed)), end = '', flush = True)
+        print(", %s: %d bytes compiled" % (compiledFileName(fileName), compileUiFile(fileName)))
 
 if __name__ == '__main__':
     main()
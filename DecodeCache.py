@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+#
+# Morse Control persistent cache of decoded telegrams
+#
+# Maps a hash of received bits and Morse.version (that covers the code table,
+# Morse.DECODER_VERSION and the decoder tuning) to the triples decoded from these bits, so the messages
+# that were displayed once are not decoded again, even after restart.
+# The least recently used entries are dropped when the cache grows over its size limit.
+# A cache file written by a different code table or decoder is ignored as a whole.
+# With adaptive, messages are decoded with the speed-tracking decoder, seeded from the timing profile
+# of the line when given, or from the message itself. The first decoding of the bits is kept,
+# so the triples of a displayed message match its text decoded when it was received,
+# however the profile has changed since then.
+#
+from collections import OrderedDict
+from hashlib import sha1
+from json import dumps, loads
+from os import replace
+from unittest import main, TestCase
+
+from Morse import Morse, Triples, TimingProfile
+
+CACHE_FILE_NAME = 'MorseControl.cache'
+CACHE_FILE_HEADER = '# MorseControl decode cache'
+CACHE_MAX_SIZE = 4 * 1024 * 1024 # bytes of serialized triples
+
+class DecodeCache(object):
+    def __init__(self, morse, fileName = CACHE_FILE_NAME, maxSize = CACHE_MAX_SIZE, adaptive = False): # with no fileName, the cache is not persisted
+        self.morse = morse
+        self.fileName = fileName
+        self.maxSize = maxSize
+        self.adaptive = adaptive
+        self.header = '%s %s%s\n' % (CACHE_FILE_HEADER, morse.version, ' adaptive' if adaptive else '')
+        self.entries = OrderedDict() # key: serialized triples, least recently used first
+        self.size = 0
+        self.changed = False
+        if not fileName:
+            return
+        try:
+            with open(fileName, encoding = 'utf-8') as f:
+                if f.readline() != self.header:
+                    return
+                for line in f:
+                    (key, data) = line.rstrip('\n').split(' ', 1)
+                    self.entries[key] = data
+                    self.size += len(data)
+        except (OSError, ValueError):
+            self.entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, bits):
+        return sha1(('%s %s' % (self.morse.version, bits)).encode('utf-8')).hexdigest()
+
+    def bitsToTriples(self, bits, profile = None): # same as Morse.bitsToTriples(bits), with profile or a new TimingProfile if adaptive
+        key = self.key(bits)
+        data = self.entries.get(key)
+        if data is not None:
+            self.entries.move_to_end(key)
+            return Triples(loads(data))
+        triples = self.morse.bitsToTriples(bits, profile = (profile or TimingProfile()) if self.adaptive else None)
+        data = dumps(tuple(triples), ensure_ascii = False, separators = (',', ':'))
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.maxSize and len(self.entries) > 1:
+            self.size -= len(self.entries.popitem(False)[1])
+        self.changed = True
+        return triples
+
+    def save(self):
+        if not self.fileName or not self.changed:
+            return
+        with open(self.fileName + '.tmp', 'w', encoding = 'utf-8') as f:
+            f.write(self.header)
+            for (key, data) in self.entries.items():
+                f.write('%s %s\n' % (key, data))
+        replace(self.fileName + '.tmp', self.fileName)
+        self.changed = False
+
+class DecodeCacheTest(TestCase):
+    def setUp(self):
+        self.morse = Morse()
+        self.bits = tuple(self.morse.charsToBits(chars, 1, True) for chars in ('ПРИВЕТ', 'ТЕЛЕГРАФ', 'ПРИЕМ'))
+
+    def testCache(self):
+        from tempfile import TemporaryDirectory
+        with TemporaryDirectory() as dirName:
+            fileName = dirName + '/test.cache'
+            cache = DecodeCache(self.morse, fileName)
+            for bits in self.bits:
+                self.assertEqual(cache.bitsToTriples(bits), self.morse.bitsToTriples(bits))
+            cache.save()
+            cache = DecodeCache(self.morse, fileName)
+            self.assertEqual(len(cache), 3)
+            self.assertFalse(cache.changed)
+            for bits in self.bits:
+                self.assertEqual(cache.bitsToTriples(bits), self.morse.bitsToTriples(bits))
+            self.assertFalse(cache.changed)
+            cache = DecodeCache(Morse(defaultChar = ''), fileName) # different version
+            self.assertEqual(len(cache), 0)
+            cache = DecodeCache(self.morse, fileName, adaptive = True) # different decoder
+            self.assertEqual(len(cache), 0)
+            for bits in self.bits:
+                self.assertEqual(cache.bitsToTriples(bits), self.morse.bitsToTriples(bits, profile = TimingProfile()))
+
+    def testProfile(self):
+        cache = DecodeCache(self.morse, None, adaptive = True)
+        bits = self.morse.charsToBits('ТЕЛЕГРАФ', 3)
+        profile = TimingProfile(3.0, 10)
+        self.assertEqual(cache.bitsToTriples(bits, profile), self.morse.bitsToTriples(bits, profile = TimingProfile(3.0, 10)))
+        self.assertGreater(profile.count, 10) # learned from the message
+        triples = cache.bitsToTriples(bits, TimingProfile(1.0, 10))
+        self.assertEqual(triples, self.morse.bitsToTriples(bits, profile = TimingProfile(3.0, 10))) # the first decoding is kept
+        self.assertEqual(cache.bitsToTriples(bits), triples)
+
+    def testSize(self):
+        cache = DecodeCache(self.morse, None, 2 * len(dumps(tuple(self.morse.bitsToTriples(self.bits[1])), ensure_ascii = False, separators = (',', ':'))))
+        for bits in self.bits:
+            cache.bitsToTriples(bits)
+        self.assertLessEqual(cache.size, cache.maxSize)
+        self.assertNotIn(cache.key(self.bits[0]), cache.entries)
+        self.assertIn(cache.key(self.bits[2]), cache.entries)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+#
+# Emulated telegraph device for running without hardware
+#
+from collections import deque
+from time import sleep, time
+
+from UARTTextProtocol import Command
+from UARTTextCommands import ackResponse, morseRxResponse
+from SerialPort import DT, TIMEOUT
+
+class EmulatedSerial(object):
+    def __init__(self):
+        self.name = 'EMUL'
+        self.interval = 20 # emulate receiving message every 20 seconds
+        self.timeout = TIMEOUT
+        self.buffer = deque()
+        self.ready = False
+        self.nextMessage = time() + self.interval
+
+    def readline(self): # returns empty line after timeout, like Serial.readline()
+        timeout = time() + self.timeout
+        while time() < timeout:
+            if self.buffer:
+                return self.buffer.popleft()
+            now = time()
+            if self.ready and (self.nextMessage is None or now > self.nextMessage):
+                self.nextMessage = now + self.interval
+                return morseRxResponse.encode('000000000000010101010101010101010101010100000001110101110101110000000101110111010001110111011100010111010100010101110001110111011101000100011101000111010001011100010111010111000001110001000101110101000100011101110100010111010001010101110100011101110001110111000101110001011101011101011100000111000101110100010101110001011101010001110101011101110001110111011101011100010101010101010101010001110001011101000101011100010111010100010111010111000101110101000101110101110001110101010101110001110001011101000101110001011101010001011101011100010111010100010111010111000111011101010111011100000001010111010111000000')
+            sleep(DT)
+        return ''
+
+    def write(self, data):
+        ret = ''
+        try:
+            (tag, _args) = Command.decodeCommand(data)
+            if tag:
+                ret = ackResponse.encode(0)
+            else:
+                raise ValueError("Неизвестная команда")
+        except ValueError as e:
+            ret = str(e)
+        self.buffer.append(ret)
+        self.ready = True
+        return len(data)
+
+    def close(self):
+        pass
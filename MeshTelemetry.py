@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+#
+# Mesh node telemetry aggregator
+#
+# Keeps recent node reports in fixed size per node ring buffers
+# and writes downsampled buckets to a rolling on-disk store.
+#
+from array import array
+from datetime import datetime
+from logging import getLogger
+from os import listdir, makedirs, remove
+from os.path import join
+from threading import Lock
+from time import time
+from unittest import main, TestCase
+
+NUM_COLUMNS = 6 # node report is node number followed by meshNodeInfoResponse value1 to value6
+RING_SIZE = 1024
+MIN_VALUE = -2 ** 63 # values are kept in array('q')
+MAX_VALUE = 2 ** 63 - 1
+BUCKET_SECONDS = 60
+
+STORE_DIR_NAME = 'MeshTelemetry'
+STORE_FILE_FORMAT = '%Y%m%d.txt'
+STORE_KEEP_FILES = 7
+
+class NodeRing(object):
+    __slots__ = ('size', 'count', 'head', 'times', 'columns')
+
+    def __init__(self, numColumns = NUM_COLUMNS, size = RING_SIZE):
+        self.size = size
+        self.count = 0
+        self.head = 0 # index of the next sample to write
+        self.times = array('d', bytes(8 * size))
+        self.columns = tuple(array('q', bytes(8 * size)) for _ in range(numColumns))
+
+    def append(self, t, values):
+        head = self.head
+        self.times[head] = t
+        for (column, value) in zip(self.columns, values):
+            column[head] = value
+        self.head = (head + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def index(self, i): # i-th oldest sample to ring index
+        return (self.head - self.count + i) % self.size
+
+    def first(self, since): # number of the oldest sample at or after since, by binary search
+        (lo, hi) = (0, self.count)
+        times = self.times
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if times[self.index(mid)] < since:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def latest(self):
+        if not self.count:
+            return None
+        i = self.index(self.count - 1)
+        return (self.times[i], tuple(column[i] for column in self.columns))
+
+    def window(self, column, since): # (times, values) of samples at or after since
+        column = self.columns[column]
+        indexes = tuple(self.index(i) for i in range(self.first(since), self.count))
+        return (tuple(self.times[i] for i in indexes), tuple(column[i] for i in indexes))
+
+class Bucket(object):
+    __slots__ = ('start', 'count', 'mins', 'maxs', 'sums')
+
+    def __init__(self, start, numColumns):
+        self.start = start
+        self.count = 0
+        self.mins = array('q', bytes(8 * numColumns))
+        self.maxs = array('q', bytes(8 * numColumns))
+        self.sums = array('d', bytes(8 * numColumns))
+
+    def add(self, values):
+        first = not self.count
+        for (i, value) in enumerate(values):
+            if first or value < self.mins[i]:
+                self.mins[i] = value
+            if first or value > self.maxs[i]:
+                self.maxs[i] = value
+            self.sums[i] += value
+        self.count += 1
+
+    def dataStr(self, node):
+        return '%d %d %d %s\n' % (self.start, node, self.count, ' '.join('%d %d %.3f' % (mn, mx, s / self.count) for (mn, mx, s) in zip(self.mins, self.maxs, self.sums)))
+
+class TelemetryStore(object):
+    def __init__(self, dirName = STORE_DIR_NAME, fileFormat = STORE_FILE_FORMAT, keepFiles = STORE_KEEP_FILES):
+        self.dirName = dirName
+        self.fileFormat = fileFormat
+        self.keepFiles = keepFiles
+        self.fileName = None
+        self.file = None
+        makedirs(dirName, exist_ok = True)
+
+    def write(self, t, data):
+        fileName = datetime.fromtimestamp(t).strftime(self.fileFormat)
+        if fileName != self.fileName:
+            self.close()
+            self.fileName = fileName
+            self.file = open(join(self.dirName, fileName), 'a', encoding = 'utf-8')
+            self.rotate()
+        self.file.write(data)
+
+    def rotate(self):
+        fileNames = sorted(fileName for fileName in listdir(self.dirName) if fileName != self.fileName)
+        for fileName in fileNames[:max(0, len(fileNames) - self.keepFiles + 1)]:
+            remove(join(self.dirName, fileName))
+
+    def flush(self):
+        if self.file:
+            self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+class MeshTelemetry(object):
+    def __init__(self, store = None, numColumns = NUM_COLUMNS, ringSize = RING_SIZE, bucketSeconds = BUCKET_SECONDS, clock = time):
+        self.store = store
+        self.numColumns = numColumns
+        self.ringSize = ringSize
+        self.bucketSeconds = bucketSeconds
+        self.clock = clock
+        self.rings = {}
+        self.buckets = {}
+        self.lock = Lock()
+        self.logger = getLogger('MeshTelemetry')
+
+    def ingest(self, node, *values): # matches meshNodeInfoResponse arguments
+        if not all(MIN_VALUE <= value <= MAX_VALUE for value in values):
+            self.logger.warning("Значение вне допустимого диапазона, отчет узла %s пропущен: %s", node, ' '.join(str(value) for value in values))
+            return
+        t = self.clock()
+        with self.lock:
+            ring = self.rings.get(node)
+            if ring is None:
+                ring = self.rings[node] = NodeRing(self.numColumns, self.ringSize)
+            ring.append(t, values)
+            if self.store:
+                start = int(t // self.bucketSeconds * self.bucketSeconds)
+                bucket = self.buckets.get(node)
+                if bucket is None or bucket.start != start:
+                    if bucket:
+                        self.store.write(bucket.start, bucket.dataStr(node))
+                    bucket = self.buckets[node] = Bucket(start, self.numColumns)
+                bucket.add(values)
+
+    def flush(self):
+        with self.lock:
+            if self.store:
+                for (node, bucket) in self.buckets.items():
+                    self.store.write(bucket.start, bucket.dataStr(node))
+                self.buckets.clear()
+                self.store.flush()
+
+    def close(self):
+        self.flush()
+        if self.store:
+            self.store.close()
+
+    def nodes(self):
+        with self.lock:
+            return tuple(sorted(self.rings))
+
+    def latest(self, node):
+        with self.lock:
+            ring = self.rings.get(node)
+            return ring.latest() if ring else None
+
+    def window(self, node, column, seconds):
+        with self.lock:
+            ring = self.rings.get(node)
+            return ring.window(column, self.clock() - seconds) if ring else ((), ())
+
+    def minMax(self, node, column, seconds):
+        (_times, values) = self.window(node, column, seconds)
+        return (min(values), max(values)) if values else None
+
+    def rate(self, node, column, seconds): # value change per second
+        (times, values) = self.window(node, column, seconds)
+        if len(times) < 2 or times[-1] == times[0]:
+            return None
+        return (values[-1] - values[0]) / (times[-1] - times[0])
+
+class MeshTelemetryTest(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.telemetry = MeshTelemetry(None, 2, 4, clock = lambda: self.now)
+
+    def ingest(self, node, *values):
+        self.telemetry.ingest(node, *values)
+        self.now += 1
+
+    def testRing(self):
+        self.assertEqual(self.telemetry.latest(1), None)
+        self.assertEqual(self.telemetry.minMax(1, 0, 10), None)
+        for i in range(6):
+            self.ingest(1, i, 10 - i)
+        self.ingest(2, 7, 7)
+        self.assertEqual(self.telemetry.nodes(), (1, 2))
+        self.assertEqual(self.telemetry.latest(1), (1005.0, (5, 5)))
+        self.assertEqual(self.telemetry.window(1, 0, 100), ((1002.0, 1003.0, 1004.0, 1005.0), (2, 3, 4, 5)))
+        self.assertEqual(self.telemetry.window(1, 1, 3.5), ((1004.0, 1005.0), (6, 5)))
+        self.assertEqual(self.telemetry.minMax(1, 1, 100), (5, 8))
+        self.assertEqual(self.telemetry.rate(1, 0, 100), 1.0)
+        self.assertEqual(self.telemetry.rate(1, 1, 100), -1.0)
+        self.assertEqual(self.telemetry.rate(2, 0, 100), None)
+
+    def testRange(self):
+        self.telemetry.logger.disabled = True
+        self.ingest(1, 99999999999999999999, 3)
+        self.ingest(1, 4, -2 ** 63 - 1)
+        self.telemetry.logger.disabled = False
+        self.assertEqual(self.telemetry.nodes(), ())
+        self.ingest(1, MAX_VALUE, MIN_VALUE)
+        self.assertEqual(self.telemetry.latest(1), (1002.0, (MAX_VALUE, MIN_VALUE)))
+
+    def testStore(self):
+        from tempfile import TemporaryDirectory
+        with TemporaryDirectory() as dirName:
+            store = TelemetryStore(dirName, 'tlm-%S', 2)
+            self.telemetry = MeshTelemetry(store, 2, 4, 2, lambda: self.now)
+            for i in range(5):
+                self.ingest(1, i, -i)
+            self.telemetry.close()
+            fileNames = sorted(listdir(dirName))
+            self.assertEqual(len(fileNames), 2)
+            with open(join(dirName, fileNames[-1]), encoding = 'utf-8') as f:
+                self.assertEqual(f.read(), '1004 1 1 4 4 4.000 -4 -4 -4.000\n')
+            with open(join(dirName, fileNames[0]), encoding = 'utf-8') as f:
+                self.assertEqual(f.read(), '1002 1 2 2 3 2.500 -3 -2 -2.500\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+#
+# Morse Control message search index
+#
+# Inverted index from words of message text to message keys,
+# query words match as prefixes, results can be filtered by state and time.
+#
+from bisect import bisect_left
+from re import compile as reCompile
+from unittest import main, TestCase
+
+WORD = reCompile(r'\w+')
+
+def textWords(text):
+    return frozenset(WORD.findall(text.upper()))
+
+class SearchIndex(object):
+    def __init__(self):
+        self.postings = {} # word: set of message keys
+        self.words = None # sorted words for prefix lookup, built when needed
+        self.messages = {} # key: (state, timeStamp, words)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def add(self, key, state, timeStamp, text):
+        self.remove(key)
+        words = textWords(text)
+        self.messages[key] = (state, timeStamp, words)
+        for word in words:
+            keys = self.postings.get(word)
+            if keys is None:
+                keys = self.postings[word] = set()
+                self.words = None
+            keys.add(key)
+
+    def remove(self, key):
+        message = self.messages.pop(key, None)
+        if message:
+            for word in message[2]:
+                keys = self.postings[word]
+                keys.discard(key)
+                if not keys:
+                    del self.postings[word]
+                    self.words = None
+
+    def lookup(self, prefix): # keys of messages having words starting with prefix
+        if self.words is None:
+            self.words = sorted(self.postings)
+        words = self.words
+        i = bisect_left(words, prefix)
+        if i < len(words) and words[i] == prefix and (i + 1 == len(words) or not words[i + 1].startswith(prefix)):
+            return self.postings[prefix]
+        result = set()
+        while i < len(words) and words[i].startswith(prefix):
+            result |= self.postings[words[i]]
+            i += 1
+        return result
+
+    def search(self, query = '', states = None, since = None, until = None): # keys of messages matching every query word
+        result = None
+        for word in sorted(textWords(query), key = len, reverse = True): # longer words usually match fewer messages
+            keys = self.lookup(word)
+            result = set(keys) if result is None else result & keys
+            if not result:
+                return set()
+        if result is None:
+            result = self.messages.keys()
+        if states is None and since is None and until is None:
+            return set(result)
+        messages = self.messages
+        return set(key for key in result if (states is None or messages[key][0] in states)
+                   and (since is None or messages[key][1] >= since) and (until is None or messages[key][1] < until))
+
+class SearchIndexTest(TestCase):
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.add(1, 1, 100, 'Привет мир')
+        self.index.add(2, 2, 200, 'ПРИВЕТСТВУЮ ВАС\nТЕЛЕГРАММА 2')
+        self.index.add(3, 2, 300, 'телеграмма 3 мир')
+
+    def testSearch(self):
+        self.assertEqual(self.index.search('привет'), {1, 2})
+        self.assertEqual(self.index.search('приветс'), {2})
+        self.assertEqual(self.index.search('мир телеграмма'), {3})
+        self.assertEqual(self.index.search('мир телеграмма 2'), set())
+        self.assertEqual(self.index.search('нет'), set())
+        self.assertEqual(self.index.search(''), {1, 2, 3})
+        self.assertEqual(self.index.search('', (2,)), {2, 3})
+        self.assertEqual(self.index.search('мир', since = 200), {3})
+        self.assertEqual(self.index.search('', until = 300), {1, 2})
+
+    def testUpdate(self):
+        self.index.add(1, 1, 100, 'ПОКА')
+        self.assertEqual(self.index.search('привет'), {2})
+        self.assertEqual(self.index.search('пока'), {1})
+        self.index.remove(2)
+        self.index.remove(4)
+        self.assertEqual(self.index.search('привет'), set())
+        self.assertEqual(self.index.search('телеграмма'), {3})
+        self.assertEqual(len(self.index), 2)
+
+if __name__ == '__main__':
+    main()
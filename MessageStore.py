@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+#
+# Morse Control append-only message store
+#
+# Every change of a message appends a line with its full data to the journal,
+# deleting a message appends a delete line. A binary index file maps message keys
+# to state, time stamp and journal line offset, so opening the store reads only
+# the index, and message data is read through a memory mapping of the journal
+# when the message is displayed, and dropped again when it's scrolled away.
+# The journal is compacted in a background thread when it's mostly dead lines.
+#
+from datetime import datetime
+from logging import getLogger
+from mmap import mmap, ACCESS_READ
+from os import replace
+from os.path import exists
+from struct import calcsize, iter_unpack, pack
+from threading import Lock, Thread
+from unittest import main, TestCase
+
+from MessageSearch import SearchIndex
+from MorseMessages import MessageRecord, writeText, OUTGOING, SENT, RECEIVED, EDIT, STATE_MARKS, STORE_DATETIME_FORMAT
+
+JOURNAL_FILE_NAME = 'MorseControl.journal'
+INDEX_FILE_NAME = 'MorseControl.index'
+
+DELETED = -1
+DELETE_MARK = 'x'
+NO_DATA = '-'
+
+INDEX_ENTRY = '<Ibqqi' # key, state, time stamp, journal line offset, journal line length
+INDEX_ENTRY_SIZE = calcsize(INDEX_ENTRY)
+
+COMPACT_MIN_SIZE = 64 * 1024
+COMPACT_RATIO = 2 # the journal is compacted when it's this many times larger than its live lines
+
+def indexStamp(timeStamp):
+    return int(timeStamp.timestamp()) if timeStamp else -1
+
+def journalLine(key, record):
+    state = RECEIVED if record.state is EDIT else record.state
+    timeStamp = record.timeStamp.strftime(STORE_DATETIME_FORMAT) if record.timeStamp else NO_DATA
+    return '%s %d %s %s %s\n' % (STATE_MARKS[state], key, timeStamp, record.bits or NO_DATA, '\\n'.join(record.text.splitlines()))
+
+def parseLine(line): # (key, state, timeStamp, bits, text), state is DELETED for delete lines
+    tokens = line.rstrip('\r\n').split(' ', 4)
+    if tokens[0] == DELETE_MARK:
+        return (int(tokens[1]), DELETED, None, None, None)
+    (mark, key, timeStamp, bits, text) = tokens
+    timeStamp = None if timeStamp == NO_DATA else datetime.strptime(timeStamp, STORE_DATETIME_FORMAT)
+    return (int(key), STATE_MARKS.index(mark), timeStamp, '' if bits == NO_DATA else bits, text.replace('\\n', '\n'))
+
+class MessageStore(object):
+    def __init__(self, fileName = JOURNAL_FILE_NAME, indexFileName = INDEX_FILE_NAME, compactMinSize = COMPACT_MIN_SIZE):
+        self.fileName = fileName
+        self.indexFileName = indexFileName
+        self.compactMinSize = compactMinSize
+        self.isNew = not exists(fileName)
+        self.changed = False
+        self.lock = Lock()
+        self.compactor = None
+        self.searchIndex = None # built on first search
+        self.logger = getLogger('MessageStore')
+        self.openFiles()
+
+    def openFiles(self):
+        self.entries = {} # key: (state, indexStamp, offset, length)
+        self.nextKey = 1
+        self.liveSize = 0
+        self.journal = open(self.fileName, 'ab')
+        self.reader = open(self.fileName, 'rb')
+        self.mapping = None # created when first needed and recreated when the journal grows
+        self.size = self.journal.tell()
+        try:
+            with open(self.indexFileName, 'rb') as f:
+                data = f.read()
+        except OSError:
+            data = b''
+        entries = tuple(iter_unpack(INDEX_ENTRY, data[:len(data) - len(data) % INDEX_ENTRY_SIZE]))
+        valid = len(entries)
+        while valid and not self.isValid(entries[valid - 1]): # dropping index entries written ahead of the journal
+            valid -= 1
+        if valid and not self.isValid(entries[0]): # the index doesn't match the journal at all
+            valid = 0
+        for entry in entries[:valid]:
+            self.apply(*entry)
+        self.index = open(self.indexFileName, 'ab')
+        if valid * INDEX_ENTRY_SIZE != len(data):
+            self.index.truncate(valid * INDEX_ENTRY_SIZE)
+        (_key, _state, _timeStamp, offset, length) = entries[valid - 1] if valid else (0, 0, 0, 0, 0)
+        if offset + length < self.size:
+            self.recover(offset + length)
+
+    def isValid(self, entry):
+        (key, _state, _timeStamp, offset, length) = entry
+        if offset + length > self.size:
+            return False
+        self.reader.seek(offset)
+        line = self.reader.read(length)
+        try:
+            return line.endswith(b'\n') and parseLine(line.decode('utf-8'))[0] == key
+        except (ValueError, UnicodeDecodeError):
+            return False
+
+    def recover(self, offset): # indexing the journal lines written after the last index entry
+        self.reader.seek(offset)
+        for line in self.reader.readlines():
+            if not line.endswith(b'\n'):
+                self.journal.truncate(offset) # the last line was not completely written
+                break
+            try:
+                (key, state, timeStamp, _bits, _text) = parseLine(line.decode('utf-8'))
+            except (ValueError, UnicodeDecodeError) as e:
+                self.logger.warning("Пропущена поврежденная строка журнала %s со смещением %d: %s: %r", self.fileName, offset, e, line[:80])
+                offset += len(line)
+                continue
+            self.index.write(pack(INDEX_ENTRY, key, state, indexStamp(timeStamp), offset, len(line)))
+            self.apply(key, state, indexStamp(timeStamp), offset, len(line))
+            offset += len(line)
+        self.index.flush()
+        self.size = offset
+
+    def apply(self, key, state, timeStamp, offset, length):
+        old = self.entries.pop(key, None)
+        if old:
+            self.liveSize -= old[3]
+        if state != DELETED:
+            self.entries[key] = (state, timeStamp, offset, length)
+            self.liveSize += length
+        self.nextKey = max(self.nextKey, key + 1)
+
+    def append(self, key, state, timeStamp, line):
+        data = line.encode('utf-8')
+        offset = self.size
+        self.journal.write(data)
+        self.journal.flush()
+        self.size += len(data)
+        self.index.write(pack(INDEX_ENTRY, key, state, timeStamp, offset, len(data)))
+        self.index.flush()
+        self.apply(key, state, timeStamp, offset, len(data))
+        self.changed = True
+
+    def line(self, offset, length): # called with the lock held
+        if self.mapping is None or offset + length > len(self.mapping):
+            if self.mapping is not None:
+                self.mapping.close()
+            self.mapping = mmap(self.reader.fileno(), 0, access = ACCESS_READ)
+        return self.mapping[offset:offset + length].decode('utf-8')
+
+    def keys(self, states = None, since = None, until = None): # in display order: outgoing first, then the newest first
+        with self.lock:
+            items = [(key, state, timeStamp) for (key, (state, timeStamp, _offset, _length)) in self.entries.items()
+                     if (states is None or state in states) and (since is None or timeStamp >= indexStamp(since)) and (until is None or timeStamp < indexStamp(until))]
+        items.sort(key = lambda item: (item[1] != OUTGOING, -item[2], -item[0]))
+        return [key for (key, _state, _timeStamp) in items]
+
+    def records(self, states = None, since = None, until = None): # text and bits are not loaded, except for outgoing messages
+        result = []
+        with self.lock:
+            entries = self.entries
+        for key in self.keys(states, since, until):
+            (state, timeStamp, _offset, _length) = entries[key]
+            record = MessageRecord(state, datetime.fromtimestamp(timeStamp) if timeStamp >= 0 else None, None, None)
+            record.key = key
+            result.append(self.load(record) if state is OUTGOING else record)
+        return result
+
+    def load(self, record):
+        if record.text is None:
+            with self.lock:
+                line = self.line(*self.entries[record.key][2:])
+            (_key, _state, _timeStamp, record.bits, record.text) = parseLine(line)
+        return record
+
+    @staticmethod
+    def unload(record): # drops the data of a stored message not being changed, load() reads it again
+        if record.key is not None and record.state in (SENT, RECEIVED) and record.savedText is None:
+            record.text = record.bits = None
+
+    def put(self, record):
+        with self.lock:
+            if record.key is None:
+                record.key = self.nextKey
+                self.nextKey += 1
+            state = RECEIVED if record.state is EDIT else record.state
+            self.append(record.key, state, indexStamp(record.timeStamp), journalLine(record.key, record))
+            if self.searchIndex is not None:
+                self.searchIndex.add(record.key, state, indexStamp(record.timeStamp), record.text)
+        self.checkCompact()
+
+    def delete(self, record):
+        with self.lock:
+            if record.key not in self.entries:
+                return
+            self.append(record.key, DELETED, -1, '%s %d\n' % (DELETE_MARK, record.key))
+            if self.searchIndex is not None:
+                self.searchIndex.remove(record.key)
+        self.checkCompact()
+
+    def search(self, query = '', states = None, since = None, until = None): # keys of matching messages
+        with self.lock:
+            if self.searchIndex is None:
+                self.searchIndex = SearchIndex()
+                for (key, (state, timeStamp, offset, length)) in sorted(self.entries.items(), key = lambda item: item[1][2]):
+                    self.searchIndex.add(key, state, timeStamp, parseLine(self.line(offset, length))[4])
+            return self.searchIndex.search(query, states, since and indexStamp(since), until and indexStamp(until))
+
+    def importRecords(self, records): # records in display order, as read by MorseMessages.readRecords()
+        records = tuple(records)
+        for record in reversed(records):
+            self.put(record)
+        return len(records)
+
+    def exportText(self, textFile):
+        writeText((self.load(record) for record in self.records()), textFile)
+
+    def checkCompact(self):
+        if self.size > self.compactMinSize and self.size > COMPACT_RATIO * self.liveSize and not (self.compactor and self.compactor.is_alive()):
+            self.compactor = Thread(target = self.compact, name = '%s 0x%x compactor' % (self.__class__.__name__, id(self)))
+            self.compactor.start()
+
+    def compact(self): # lines appended while compacting are copied at the end, with the lock held
+        with self.lock:
+            entries = sorted(self.entries.items(), key = lambda item: item[1][2])
+            end = self.size
+        (tempFileName, tempIndexFileName) = (self.fileName + '.tmp', self.indexFileName + '.tmp')
+        with open(self.fileName, 'rb') as reader, open(tempFileName, 'wb') as journal, open(tempIndexFileName, 'wb') as index:
+            offset = 0
+            for (key, (state, timeStamp, oldOffset, length)) in entries:
+                reader.seek(oldOffset)
+                journal.write(reader.read(length))
+                index.write(pack(INDEX_ENTRY, key, state, timeStamp, offset, length))
+                offset += length
+            with self.lock:
+                reader.seek(end)
+                for line in reader.read(self.size - end).splitlines(True):
+                    (key, state, timeStamp, _bits, _text) = parseLine(line.decode('utf-8'))
+                    journal.write(line)
+                    index.write(pack(INDEX_ENTRY, key, state, indexStamp(timeStamp), offset, len(line)))
+                    offset += len(line)
+                journal.close()
+                index.close()
+                self.closeFiles()
+                replace(tempFileName, self.fileName) # if interrupted here, the index is rebuilt from the journal on next open
+                replace(tempIndexFileName, self.indexFileName)
+                self.openFiles()
+
+    def close(self):
+        if self.compactor:
+            self.compactor.join()
+        with self.lock:
+            self.closeFiles()
+
+    def closeFiles(self):
+        if self.mapping is not None:
+            self.mapping.close()
+        for f in (self.journal, self.index, self.reader):
+            f.close()
+
+class MessageStoreTest(TestCase):
+    def setUp(self):
+        from tempfile import TemporaryDirectory
+        self.tempDir = TemporaryDirectory()
+        self.fileName = self.tempDir.name + '/test.journal'
+        self.indexFileName = self.tempDir.name + '/test.index'
+        self.store = self.open()
+
+    def tearDown(self):
+        self.store.close()
+        self.tempDir.cleanup()
+
+    def open(self, compactMinSize = COMPACT_MIN_SIZE):
+        return MessageStore(self.fileName, self.indexFileName, compactMinSize)
+
+    def reopen(self):
+        self.store.close()
+        self.store = self.open()
+        return [self.store.load(record) for record in self.store.records()]
+
+    @staticmethod
+    def record(state, second, text):
+        return MessageRecord(state, datetime(2015, 3, 10, 12, 0, second) if state is not OUTGOING else None, text, '1010' if state is not OUTGOING else '')
+
+    @staticmethod
+    def fields(records):
+        return [(record.state, record.timeStamp and record.timeStamp.second, record.text, record.bits) for record in records]
+
+    def testStore(self):
+        self.assertTrue(self.store.isNew)
+        records = [self.record(RECEIVED, 1, 'ПЕРВАЯ'), self.record(SENT, 3, 'ВТОРАЯ\nСТРОКА'), self.record(RECEIVED, 2, 'ТРЕТЬЯ'), self.record(OUTGOING, 0, 'ЧЕРНОВИК')]
+        for record in records:
+            self.store.put(record)
+        records[2].text = 'ТРЕТЬЯ ИСПРАВЛЕННАЯ'
+        self.store.put(records[2])
+        self.store.delete(records[0])
+        self.store.delete(records[0])
+        self.assertEqual(self.fields(self.reopen()), [(OUTGOING, None, 'ЧЕРНОВИК', ''), (SENT, 3, 'ВТОРАЯ\nСТРОКА', '1010'), (RECEIVED, 2, 'ТРЕТЬЯ ИСПРАВЛЕННАЯ', '1010')])
+        self.assertFalse(self.store.isNew)
+        record = self.store.records()[1]
+        self.assertEqual(record.text, None)
+        self.store.load(record)
+        self.assertEqual(record.text, 'ВТОРАЯ\nСТРОКА')
+        self.store.unload(record)
+        self.assertEqual((record.text, record.bits), (None, None))
+        self.store.put(self.record(RECEIVED, 4, 'НОВАЯ'))
+        self.assertEqual(self.store.load(record).bits, '1010')
+        self.assertEqual(self.store.load(self.store.records()[1]).text, 'НОВАЯ') # beyond the first mapping
+        self.assertEqual(len(self.store.keys((RECEIVED,))), 2)
+        self.assertEqual(len(self.store.keys(since = datetime(2015, 3, 10, 12, 0, 3), until = datetime(2015, 3, 10, 12, 0, 4))), 1)
+
+    def testRecovery(self):
+        for second in range(3):
+            self.store.put(self.record(RECEIVED, second, 'ТЕКСТ %d' % second))
+        self.store.close()
+        with open(self.indexFileName, 'r+b') as f:
+            f.truncate(INDEX_ENTRY_SIZE + 3) # the last index entries are lost
+        with open(self.fileName, 'ab') as f:
+            f.write(b'< 4 20150310-1200') # incomplete line
+        self.store = self.open()
+        self.assertEqual([record.text for record in self.reopen()], ['ТЕКСТ 2', 'ТЕКСТ 1', 'ТЕКСТ 0'])
+        self.store.put(self.record(RECEIVED, 5, 'ТЕКСТ 5'))
+        with open(self.indexFileName, 'wb') as f:
+            f.write(pack(INDEX_ENTRY, 1, RECEIVED, 0, 1, 20)) # the index doesn't match the journal
+        self.assertEqual(len(self.reopen()), 4)
+
+    def testBadLine(self):
+        self.store.put(self.record(RECEIVED, 0, 'ТЕКСТ 0'))
+        self.store.close()
+        with open(self.fileName, 'ab') as f:
+            f.write(b'< 2 garbage\n') # a complete but unparseable line
+            f.write(journalLine(3, self.record(RECEIVED, 3, 'ТЕКСТ 3')).encode('utf-8'))
+        with self.assertLogs('MessageStore', 'WARNING'):
+            self.store = self.open()
+        self.assertEqual([record.text for record in self.reopen()], ['ТЕКСТ 3', 'ТЕКСТ 0'])
+        self.store.put(self.record(RECEIVED, 4, 'ТЕКСТ 4'))
+        self.assertEqual([record.text for record in self.reopen()], ['ТЕКСТ 4', 'ТЕКСТ 3', 'ТЕКСТ 0'])
+
+    def testCompact(self):
+        self.store.close()
+        self.store = self.open(1000)
+        records = [self.record(RECEIVED, second, 'ТЕКСТ') for second in range(10)]
+        for _ in range(10):
+            for record in records:
+                self.store.put(record)
+        self.store.close()
+        self.store = self.open(1000)
+        self.store.delete(records[0])
+        self.store.compactor.join()
+        self.assertLess(self.store.size, 2 * self.store.liveSize)
+        self.assertEqual(self.fields(self.reopen()), self.fields(reversed(records[1:])))
+
+    def testSearch(self):
+        records = [self.record(RECEIVED, 1, 'ПРИВЕТ МИР'), self.record(SENT, 2, 'ПРИВЕТСТВУЮ'), self.record(RECEIVED, 3, 'ПОКА')]
+        for record in records:
+            self.store.put(record)
+        self.assertEqual(self.store.search('привет'), {records[0].key, records[1].key})
+        records[0].text = 'МИР'
+        self.store.put(records[0])
+        self.store.delete(records[1])
+        self.store.put(self.record(RECEIVED, 4, 'ПРИВЕТ'))
+        self.assertEqual(len(self.store.search('привет')), 1)
+        self.assertEqual(self.store.search('мир'), {records[0].key})
+        self.assertEqual(self.store.search('', (RECEIVED,), datetime(2015, 3, 10, 12, 0, 2)), {records[2].key, records[2].key + 1})
+        self.store.close()
+        self.store = self.open()
+        self.assertEqual(self.store.search('мир пока'), set())
+        self.assertEqual(self.store.search('ПРИВ'), {records[2].key + 1})
+
+    def testImport(self):
+        from io import StringIO
+        from MorseMessages import readRecords, writeRecords
+        records = [self.record(OUTGOING, 0, 'ЧЕРНОВИК'), self.record(SENT, 2, 'ВТОРАЯ'), self.record(RECEIVED, 2, 'ПЕРВАЯ')]
+        data = StringIO()
+        writeRecords(records, data, StringIO())
+        data.seek(0)
+        self.assertEqual(self.store.importRecords(readRecords(data)), 3)
+        self.assertEqual(self.fields(self.reopen()), self.fields(records))
+        text = StringIO()
+        self.store.exportText(text)
+        self.assertIn('ВТОРАЯ', text.getvalue())
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,14 @@
 #!/usr/bin/env python3
-from itertools import chain
+from array import array
+from hashlib import sha1
+from heapq import nsmallest
+from importlib.util import module_from_spec, spec_from_file_location
+from itertools import accumulate, chain
+from math import log
+from os.path import join
 from re import compile as reCompile
+from tempfile import TemporaryDirectory
+from types import MappingProxyType
 from unittest import main, TestCase
 
 DOT = '.'
@@ -27,6 +35,23 @@ TOKENIZER = reCompile('(%s+)' % PAUSE)
 
 BITS_PER_DIT = 3
 
+DEFAULT_WPM = 18 # words per minute
+PARIS_DITS = 50 # length of the word PARIS that defines words per minute, in dits
+
+TIMING_ALPHA = 0.25 # weight of the latest element in the adaptive dit length estimate
+TIMING_SEED_ELEMENTS = 24 # number of elements to estimate the initial dit length from
+
+HARD_DECODER = 'hard'
+BEAM_DECODER = 'beam'
+DECODERS = (HARD_DECODER, BEAM_DECODER)
+
+BEAM_WIDTH = 8 # number of hypotheses kept by the beam decoder
+BEAM_MARGIN = log(1.6) # classifications of an element that are closer than that (in log scale) to the best one are tried
+BEAM_TIMING_WEIGHT = 4.0 # penalty per log distance of the element length from the class length
+BEAM_INVALID_PENALTY = 3.0 # penalty for a character not in the code table or with a bad mark
+
+DECODER_VERSION = 2 # increment on any change of the decoding code or its default arguments, to discard cached decoding results
+
 CODE_TO_BITS = {
     DOT: DIT,
     DASH: DAH,
@@ -92,11 +117,76 @@ RUSSIAN_CODES = {
     END: '..-.-,...-.-'
 }
 
-class Morse(object):
-    def __init__(self, codes = RUSSIAN_CODES, errorCode = '.', defaultChar = UNKNOWN, defaultCode = EXCEPTION): # pylint: disable=W0102
+LATIN_CODES = { # ITU-R M.1677
+    'A': '.-',
+    'B': '-...',
+    'C': '-.-.',
+    'D': '-..',
+    'E': '.',
+    'F': '..-.',
+    'G': '--.',
+    'H': '....',
+    'I': '..',
+    'J': '.---',
+    'K': '-.-',
+    'L': '.-..',
+    'M': '--',
+    'N': '-.',
+    'O': '---',
+    'P': '.--.',
+    'Q': '--.-',
+    'R': '.-.',
+    'S': '...',
+    'T': '-',
+    'U': '..-',
+    'V': '...-',
+    'W': '.--',
+    'X,×': '-..-',
+    'Y': '-.--',
+    'Z': '--..',
+    '0': '-----',
+    '1': '.----',
+    '2': '..---',
+    '3': '...--',
+    '4': '....-',
+    '5': '.....',
+    '6': '-....',
+    '7': '--...',
+    '8': '---..',
+    '9': '----.',
+    '.': '.-.-.-',
+    ',': '--..--',
+    ':': '---...',
+    '?': '..--..',
+    "'": '.----.',
+    '-': '-....-',
+    '/': '-..-.',
+    '(': '-.--.',
+    ')': '-.--.-',
+    '"': '.-..-.',
+    '=': '-...-',
+    '+': '.-.-.',
+    '@': '.--.-.',
+    START: '-.-.-',
+    END: '...-.-'
+}
+
+RUSSIAN = 'russian'
+LATIN = 'latin'
+
+def codeDits(code): # length of codeToBits(code, 1), code may contain spaces
+    return 2 * len(code) + 2 * code.count(DASH) - 1 if code else 0
+
+def ditsToSeconds(dits, wpm = DEFAULT_WPM):
+    return dits * 60.0 / (PARIS_DITS * wpm)
+
+class CodeTable(object): # validated and compiled code table, shared by all Morse instances using it
+    def __init__(self, codes, name = None):
         assert codes, "Empty code table"
-        self.encoding = {}
-        self.decoding = {}
+        self.name = name
+        self.hash = self.contentHash(codes)
+        encoding = {}
+        decoding = {}
         self.maxCodeLength = 0
         for (chars, codes) in codes.items():
             assert ' ' not in chars, "Space in chars: %r" % chars
@@ -105,19 +195,130 @@ class Morse(object):
             assert SPACE not in codes, "Space in codes for chars %r: %r" % (chars, codes)
             codes = codes.split(COMMA)
             for char in chars:
-                assert char not in self.encoding, "Duplicate character: %r" % char
-                self.encoding[char] = codes[0]
+                assert char not in encoding, "Duplicate character: %r" % char
+                encoding[char] = min(codes, key = codeDits) # the first of the shortest alternates
             for code in codes:
                 assert code, "Empty code for chars: %r " % chars
                 assert set(code) <= DOT_DASH, "Bad code for chars %r: %r" % (chars, code)
-                assert code not in self.decoding, "Duplicate code: %s" % code
-                self.decoding[code] = chars[0]
+                assert code not in decoding, "Duplicate code: %s" % code
+                decoding[code] = chars[0]
                 self.maxCodeLength = max(self.maxCodeLength, len(code))
         assert self.maxCodeLength
+        self.encoding = MappingProxyType(encoding)
+        self.decoding = MappingProxyType(decoding)
+        self.costs = MappingProxyType(dict((char, codeDits(code)) for (char, code) in encoding.items()))
+        self.codePrefixes = frozenset(code[:i] for code in decoding for i in range(1, len(code) + 1))
+
+    @staticmethod
+    def contentHash(codes):
+        return sha1(repr(sorted(codes.items())).encode('utf-8')).hexdigest()
+
+CODE_TABLES = {} # name: CodeTable
+COMPILED_CODE_TABLES = {} # content hash: CodeTable
+
+def registerCodeTable(name, codes): # compiles the table unless a table with the same contents is compiled already
+    table = getCodeTable(codes)
+    CODE_TABLES[name] = table
+    if table.name is None:
+        table.name = name
+    return table
+
+def getCodeTable(codes): # codes is a table name, a CodeTable or a dict like RUSSIAN_CODES
+    if isinstance(codes, CodeTable):
+        return codes
+    if isinstance(codes, str):
+        assert codes in CODE_TABLES, "Unknown code table: %r" % codes
+        return CODE_TABLES[codes]
+    table = COMPILED_CODE_TABLES.get(CodeTable.contentHash(codes))
+    if table is None:
+        table = CodeTable(codes)
+        COMPILED_CODE_TABLES[table.hash] = table
+    return table
+
+class Triples(object): # read-only sequence of (bits, code, char) triples, stored as three joined strings and offsets into them
+    __slots__ = ('bits', 'codes', 'chars', 'offsets')
+
+    def __init__(self, triples = ()):
+        columns = tuple(zip(*triples)) or ((), (), ())
+        (self.bits, self.codes, self.chars) = (''.join(column) for column in columns)
+        self.offsets = tuple(array('I', accumulate(chain((0,), (len(item) for item in column)))) for column in columns)
+
+    @classmethod
+    def fromColumns(cls, bits, codes, chars, offsets):
+        ret = cls.__new__(cls)
+        (ret.bits, ret.codes, ret.chars, ret.offsets) = (bits, codes, chars, offsets)
+        return ret
+
+    def __len__(self):
+        return len(self.offsets[0]) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            (start, stop, step) = index.indices(len(self))
+            if step != 1:
+                return Triples(tuple(self)[index])
+            stop = max(start, stop)
+            return Triples.fromColumns(*(text[offsets[start]:offsets[stop]] for (text, offsets) in zip((self.bits, self.codes, self.chars), self.offsets)),
+                                       offsets = tuple(array('I', (offset - offsets[start] for offset in offsets[start:stop + 1])) for offsets in self.offsets))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Triples index out of range")
+        return tuple(text[offsets[index]:offsets[index + 1]] for (text, offsets) in zip((self.bits, self.codes, self.chars), self.offsets))
+
+    def __iter__(self):
+        return zip(*(self.column(index) for index in range(3)))
+
+    def column(self, index): # bits, codes or chars of all triples, for 0, 1 or 2
+        text = (self.bits, self.codes, self.chars)[index]
+        offsets = self.offsets[index]
+        return tuple(text[start:end] for (start, end) in zip(offsets, offsets[1:]))
+
+    def __eq__(self, other):
+        if isinstance(other, Triples):
+            return (self.bits, self.codes, self.chars, self.offsets) == (other.bits, other.codes, other.chars, other.offsets)
+        if not isinstance(other, (tuple, list)): # strings and other iterables are not sequences of triples
+            return NotImplemented
+        return len(self) == len(other) and all(isinstance(otherTriple, (tuple, list)) and triple == tuple(otherTriple) for (triple, otherTriple) in zip(self, other))
+
+    def __ne__(self, other):
+        ret = self.__eq__(other)
+        return ret if ret is NotImplemented else not ret
+
+    def __hash__(self): # same as for a tuple of the same triples
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, tuple(self))
+
+class TimingProfile(object): # adaptive dit length estimate, carried from message to message
+    __slots__ = ('unit', 'count')
+
+    def __init__(self, unit = None, count = 0):
+        self.unit = unit # dit length in bits
+        self.count = count # number of elements the estimate is based on
+
+    def units(self, length, _isMark, alpha = TIMING_ALPHA): # 1 for dit or element gap, 3 for dah or char gap, 7 for word gap or bad mark
+        ratio = length / self.unit
+        units = 1 if ratio <= 2 else 3 if ratio <= 5 else 7
+        if units < 7: # word gaps vary too much to track speed by, and overlong marks are errors
+            self.unit += alpha * (float(length) / units - self.unit)
+            self.count += 1
+        return units
+
+class Morse(object):
+    def __init__(self, codes = RUSSIAN, errorCode = '.', defaultChar = UNKNOWN, defaultCode = EXCEPTION):
+        # codes is a registered table name, a CodeTable or a dict like RUSSIAN_CODES, compiled once for all instances
+        self.codeTable = getCodeTable(codes)
+        (self.encoding, self.decoding, self.maxCodeLength, self.codePrefixes) = (self.codeTable.encoding, self.codeTable.decoding, self.codeTable.maxCodeLength, self.codeTable.codePrefixes)
         self.errorCode = errorCode
         self.sendErrorCode = self.errorCode * ((self.maxCodeLength + len(self.errorCode)) // len(self.errorCode))
         self.defaultChar = self._validateDefaultChar(defaultChar)
         self.defaultCode = self._validateDefaultCode(defaultCode)
+        # Changes whenever the code table, DECODER_VERSION or the decoder tuning changes, for caching decoding results
+        self.version = sha1(repr((DECODER_VERSION, DIT, DAH, PAUSE, TOKENIZER.pattern, TIMING_ALPHA, TIMING_SEED_ELEMENTS,
+                                  BEAM_WIDTH, BEAM_MARGIN, BEAM_TIMING_WEIGHT, BEAM_INVALID_PENALTY,
+                                  self.codeTable.hash, errorCode, defaultChar, defaultCode)).encode('utf-8')).hexdigest()
 
     @staticmethod
     def _validateCode(code):
@@ -137,6 +338,9 @@ class Morse(object):
     def isError(self, code):
         return self.errorCode and len(code) > self.maxCodeLength and code == self.errorCode * (len(code) // len(self.errorCode))
 
+    def isCodePrefix(self, code): # whether the code could still be completed to a valid or an error code
+        return code in self.codePrefixes or self.errorCode and code == (self.errorCode * len(code))[:len(code)]
+
     def encodeSymbol(self, char, defaultCode = None):
         assert char, "Empty symbol"
         assert ' ' not in char, "Encoding spaces is not allowed: %r" % char
@@ -241,9 +445,10 @@ class Morse(object):
             if len(ret) > 4:
                 ret.append((self.codeToBits(WORD_SPACE + SPACE, bitsPerDit), WORD_SPACE, SPACE))
             ret.append((self.codeToBits(self.encoding[END], bitsPerDit), self.encoding[END], END))
-        return tuple(ret)
+        return Triples(ret)
 
-    def bitsToTriples(self, bits, zeros = frozenset('0._ '), ones = frozenset('1|-=+*^'), convertZerosTo = PAUSE, convertOnesTo = DIT):
+    @staticmethod
+    def lengthEdges(lengths): # (maxDit, maxDah) for sorted element lengths
         class Cluster(object):
             def __init__(self, center, weight, mn, mx):
                 self.center = center
@@ -252,8 +457,6 @@ class Morse(object):
                 self.mx = mx
             def __str__(self):
                 return '%s(%s, %s, %s, %s)' % (self.__class__.__name__, self.center, self.weight, self.mn, self.mx)
-        tokens = TOKENIZER.split(''.join(convertOnesTo if b in ones else convertZerosTo if b in zeros else None for b in bits).strip(convertZerosTo))
-        lengths = sorted(len(token) for token in tokens)
         (minLen, maxLen) = (lengths[0], lengths[-1])
         lenRange = float(maxLen - minLen)
         # Employ 3-means clustering
@@ -277,42 +480,138 @@ class Morse(object):
             limit = clusters[-1].mx + 1
             clusters.extend(Cluster(limit, 0, limit, limit) for i in range(3 - len(clusters)))
         # Calculating edges between dots and dashes, and dashes and word pauses
-        maxDit = (clusters[0].mx + clusters[1].mn) / 2.0
-        maxDah = (clusters[1].mx + clusters[2].mn) / 2.0
+        return ((clusters[0].mx + clusters[1].mn) / 2.0, (clusters[1].mx + clusters[2].mn) / 2.0)
+
+    def beamTriples(self, tokens, lengths, join, maxDit, beamWidth = BEAM_WIDTH):
+        # Viterbi search over element classifications keeping beamWidth best hypotheses,
+        # elements are scored by log distance of their length from the class length, characters by code table validity.
+        # Hypothesis state is (index of the first token of the current character, its code, whether its marks are all good),
+        # the value is (penalty, output), output is a linked list of ((bits, code, char), previous output)
+        dits = sorted(length for length in lengths[::2] if length <= maxDit)
+        unit = float(dits[len(dits) // 2]) if dits else maxDit / 2.0
+        def choices(length): # (units, penalty) for plausible classifications of an element, 7 for a mark means a bad mark
+            penalties = tuple((units, BEAM_TIMING_WEIGHT * abs(log(length / (units * unit)))) for units in (1, 3, 7))
+            best = min(penalty for (_units, penalty) in penalties)
+            return tuple((units, penalty - best) for (units, penalty) in penalties if penalty - best < BEAM_TIMING_WEIGHT * BEAM_MARGIN)
+
+        def closeChar(penalty, output, start, end, code, ok):
+            if ok:
+                char = self.decodeSymbol(code)
+                if char == ERROR and output is None:
+                    char = CONNECT
+                if code not in self.decoding and not self.isError(code) and self.isCodePrefix(code): # otherwise penalized already
+                    penalty += BEAM_INVALID_PENALTY
+            else:
+                char = ''
+            return (penalty, ((join(tokens[start:end]), code, char), output))
+
+        def offer(hypotheses, state, penalty, output): # only the best way to reach each state matters
+            old = hypotheses.get(state)
+            if old is None or penalty < old[0]:
+                hypotheses[state] = (penalty, output)
+
+        beam = {(0, '', True): (0, None)}
+        for (index, length) in enumerate(lengths):
+            isMark = not index % 2 # tokens alternate, starting with a mark
+            hypotheses = {}
+            for ((start, code, ok), (penalty, output)) in beam.items():
+                for (units, cost) in choices(length):
+                    if isMark:
+                        if ok and units < 7:
+                            newCode = code + (DOT if units == 1 else DASH)
+                            offer(hypotheses, (start, newCode, True), penalty + cost + (0 if self.isCodePrefix(newCode) or not self.isCodePrefix(code) else BEAM_INVALID_PENALTY), output)
+                        else:
+                            offer(hypotheses, (start, code, False), penalty + cost + (BEAM_INVALID_PENALTY if ok else 0), output)
+                    elif units == 1:
+                        offer(hypotheses, (start, code, ok), penalty + cost, output)
+                    else:
+                        (newPenalty, newOutput) = closeChar(penalty + cost, output, start, index, code, ok)
+                        offer(hypotheses, (index + 1, '', True), newPenalty, ((join(tokens[index:index + 1]), SPACE if units == 3 else WORD_SPACE, '' if units == 3 else SPACE), newOutput))
+            beam = dict(nsmallest(beamWidth, hypotheses.items(), key = lambda item: item[1][0]))
+        (_penalty, output) = min((closeChar(penalty, output, start, len(lengths), code, ok) for ((start, code, ok), (penalty, output)) in beam.items()), key = lambda hypothesis: hypothesis[0])
+        ret = []
+        while output:
+            (triple, output) = output
+            ret.append(triple)
+        return tuple(reversed(ret))
+
+    def tokensToTriples(self, tokens, lengths, join, profile = None, decoder = HARD_DECODER):
+        # Tokens alternate marks and gaps, starting and ending with a mark, lengths are their lengths in any units,
+        # join() makes the first item of a triple from a slice of tokens.
+        # With a TimingProfile given, the speed is tracked through the message and the profile is updated,
+        # a profile without estimate yet is seeded from clustering of the first elements of the message.
+        # With BEAM_DECODER (experimental, see MorseBenchmark), ambiguous elements are resolved by code table validity, profile is not supported then
+        assert decoder in DECODERS, "Unknown decoder: %r" % decoder
+        if decoder == BEAM_DECODER:
+            assert profile is None, "Timing profile is not supported by the beam decoder"
+            return self.beamTriples(tokens, lengths, join, self.lengthEdges(sorted(lengths))[0])
+        if profile is not None:
+            if profile.unit is None:
+                profile.unit = self.lengthEdges(sorted(lengths[:TIMING_SEED_ELEMENTS]))[0] / 2
+            units = profile.units
+        else:
+            (maxDit, maxDah) = self.lengthEdges(sorted(lengths))
+            units = lambda length, _isMark: 1 if length <= maxDit else 3 if length <= maxDah else 7
         # Perform transcoding
         ret = []
-        groupBits = []
+        groupStart = None
         groupCode = []
         groupOK = True
-        for token in chain(tokens, ('',)):
-            length = len(token)
-            if token and token[0] == convertOnesTo:
-                groupBits.append(token)
-                if groupOK and length <= maxDah:
-                    groupCode.append(DOT if length <= maxDit else DASH)
+        for (index, length) in enumerate(chain(lengths, (0,))):
+            isMark = not index % 2 # the final zero length is a gap as the number of tokens is odd
+            tokenUnits = units(length, isMark) if length else 7
+            if isMark:
+                if groupStart is None:
+                    groupStart = index
+                if groupOK and tokenUnits < 7:
+                    groupCode.append(DOT if tokenUnits == 1 else DASH)
                 else:
                     groupOK = False
-            elif length and length <= maxDit:
-                groupBits.append(token)
-            else:
-                if groupBits:
+            elif tokenUnits != 1:
+                if groupStart is not None:
                     code = ''.join(groupCode)
                     char = self.decodeSymbol(code) if groupOK else ''
                     if char == ERROR and not ret:
                         char = CONNECT
-                    ret.append((''.join(groupBits), code, char))
-                    groupBits = []
+                    ret.append((join(tokens[groupStart:index]), code, char))
+                    groupStart = None
                     groupCode = []
                     groupOK = True
                 if length: # not the last token
-                    ret.append((token, SPACE if length <= maxDah else WORD_SPACE, '' if length <= maxDah else SPACE))
+                    ret.append((join(tokens[index:index + 1]), SPACE if tokenUnits == 3 else WORD_SPACE, '' if tokenUnits == 3 else SPACE))
         return tuple(ret)
 
+    def bitsToTriples(self, bits, zeros = frozenset('0._ '), ones = frozenset('1|-=+*^'), convertZerosTo = PAUSE, convertOnesTo = DIT, profile = None, decoder = HARD_DECODER):
+        tokens = TOKENIZER.split(''.join(convertOnesTo if b in ones else convertZerosTo if b in zeros else None for b in bits).strip(convertZerosTo))
+        if not tokens[0]:
+            return Triples()
+        return Triples(self.tokensToTriples(tokens, tuple(len(token) for token in tokens), ''.join, profile, decoder))
+
+    def durationsToTriples(self, durations, profile = None, decoder = HARD_DECODER):
+        # Durations of key-down and key-up intervals alternating, starting with key-down, or (keyDown, keyUp) timestamp pairs,
+        # in any units, the first items of the resulting triples are tuples of durations instead of bits.
+        # A timing profile must not be shared with bits input, unless the units are the same
+        durations = tuple(durations)
+        if durations and isinstance(durations[0], (tuple, list)):
+            timeStamps = durations
+            durations = []
+            for (index, (down, up)) in enumerate(timeStamps):
+                if index:
+                    durations.append(down - timeStamps[index - 1][1])
+                durations.append(up - down)
+            durations = tuple(durations)
+        if len(durations) % 2 == 0: # trailing key-up interval, if any
+            durations = durations[:-1]
+        if not durations:
+            return ()
+        assert all(duration > 0 for duration in durations), "Non-positive duration: %r" % (durations,)
+        return self.tokensToTriples(durations, durations, tuple, profile, decoder)
+
     @staticmethod
     def triplesToChars(triples, unwrap = False, processErrors = False):
         def processWord(word):
             return ''.join((a + ' ' if b and (len(a) > 1 or len(b) > 1) else a) for (a, b) in zip(word, chain(word[1:], (None,))))
-        chars = tuple(t[-1] for t in triples)
+        chars = triples.column(2) if isinstance(triples, Triples) else tuple(t[-1] for t in triples)
         ret = []
         word = []
         for c in chars:
@@ -335,6 +634,31 @@ class Morse(object):
     def charsToBits(self, chars, bitsPerDit = BITS_PER_DIT, wrapForTransmission = False):
         return self.codeToBits(self.encodeMessage(chars, None, wrapForTransmission), bitsPerDit, wrapForTransmission)
 
+    def airtime(self, chars, wrapForTransmission = False, defaultCode = None):
+        # Same as len(charsToBits(chars, 1, wrapForTransmission)), in dits, summed from character costs without encoding.
+        # Every code is counted with the gap following it, so the gap after the last one is subtracted in the end
+        costs = self.codeTable.costs
+        def symbolDits(symbol, defaultCode):
+            dits = costs.get(symbol.upper())
+            return codeDits(self.encodeSymbol(symbol, defaultCode)) if dits is None else dits
+        words = chars.strip().split() if isinstance(chars, str) else chars
+        ret = codeDits(self.sendErrorCode * 2 + WORD_SPACE) + 1 if wrapForTransmission else 0
+        numWords = 0
+        for word in (chain((START,), words, (END,)) if wrapForTransmission else words):
+            word = word.strip()
+            assert word, "Empty word"
+            numWords += 1
+            dits = symbolDits(word, '')
+            if dits:
+                ret += dits + 1
+            else:
+                symbols = tuple(dits for dits in (symbolDits(char, defaultCode) for char in word) if dits)
+                ret += sum(symbols) + len(symbols) + (codeDits(SPACE) + 1) * max(0, len(symbols) - 1)
+        return max(0, ret + (codeDits(WORD_SPACE) + 1) * (numWords - 1) - 1)
+
+registerCodeTable(RUSSIAN, RUSSIAN_CODES)
+registerCodeTable(LATIN, LATIN_CODES)
+
 class MorseTest(TestCase, Morse):
     def __init__(self, *args, **kwargs):
         TestCase.__init__(self, *args, **kwargs)
@@ -345,7 +669,7 @@ class MorseTest(TestCase, Morse):
         self.assertEqual(f('А'), '.-')
         self.assertEqual(f('ё'), '.')
         self.assertEqual(f('ь'), '-..-')
-        self.assertEqual(f(')'), '-.--.-')
+        self.assertEqual(f(')'), '-.--.')
         self.assertEqual(f('НЧЛ'), '-.-.-')
         self.assertEqual(f('ОШК'), '.......')
         self.assertEqual(f('НПН', ''), '')
@@ -361,7 +685,7 @@ class MorseTest(TestCase, Morse):
         self.assertEqual(f('А'), '.-')
         self.assertEqual(f('ё'), '.')
         self.assertEqual(f('ь'), '-..-')
-        self.assertEqual(f(')'), '-.--.-')
+        self.assertEqual(f(')'), '-.--.')
         self.assertEqual(f('НЧЛ'), '-.-.-')
         self.assertEqual(f('ОШК'), '.......')
         self.assertRaises(AssertionError, f, '')
@@ -377,7 +701,7 @@ class MorseTest(TestCase, Morse):
         self.assertEqual(f('АБZВ', ''), '.- -... .--')
         self.assertEqual(f('АБZВ', '.-.-.-'), '.- -... .-.-.- .--')
         chars = ['1', 'Д', '9', '?', 'Ч', 'Б', 'Ш', '.', 'Г', '4', 'Ь', 'Ъ', 'Й', 'О', ';', 'К', 'Ы', 'С', ':', 'А', 'М', '5', '(', ')', 'Ф', 'Ѳ', 'Л', '+', '3', 'И', 'I', 'Ѵ', 'КНЦ', 'У', 'НЧЛ', '-', '8', '!', 'Э', '7', '2', 'Е', 'Ё', 'Ѣ', 'Ж', 'Ю', 'Ц', "'", 'Н', '=', 'Щ', 'Х', '*', '6', 'П', '0', 'В', '/', '\\', 'Р', 'Я', 'Т', '"', 'З']
-        codes = '.---- -.. ----. ..--.. ---. -... ---- ...... --. ....- -..- -..- .--- --- -.-.-. -.- -.-- ... ---... .- -- ..... -.--.- -.--.- ..-. ..-. .-.. .-.-. ...-- .. .. .. ..-.- ..- -.-.- -....- ---.. --..-- ..-.. --... ..--- . . . ...- ..-- -.-. .----. -. -...- --.- .... .... -.... .--. ----- .-- -..-. -..-. .-. .-.- - .-..-. --..'
+        codes = '.---- -.. ----. ..--.. ---. -... ---- ...... --. ....- -..- -..- .--- --- -.-.-. -.- -.-- ... ---... .- -- ..... -.--. -.--. ..-. ..-. .-.. .-.-. ...-- .. .. .. ..-.- ..- -.-.- -....- ---.. --..-- ..-.. --... ..--- . . . ...- ..-- -.-. .----. -. -...- --.- .... .... -.... .--. ----- .-- -..-. -..-. .-. .-.- - .-..-. --..'
         self.assertEqual(f(chars), codes)
 
     def testEncodePhrase(self, f = None):
@@ -385,7 +709,7 @@ class MorseTest(TestCase, Morse):
         self.assertEqual(f('А'), '.-')
         self.assertEqual(f('ё'), '.')
         self.assertEqual(f('ь'), '-..-')
-        self.assertEqual(f(')'), '-.--.-')
+        self.assertEqual(f(')'), '-.--.')
         self.assertEqual(f('НЧЛ'), '-.-.-')
         self.assertEqual(f('ОШК'), '.......')
         self.assertRaises(AssertionError, f, 'абвг', '...-.')
@@ -400,7 +724,7 @@ class MorseTest(TestCase, Morse):
         self.assertEqual(f(()), '')
         self.assertRaises(AssertionError, f, ('',))
         chars = ['1', 'Д', '9', '?', 'Ч', 'Б', 'Ш', '.', 'Г', '4', 'Ь', 'Ъ', 'Й', 'О', ';', 'К', 'Ы', 'С', ':', 'А', 'М', '5', '(', ')', 'Ф', 'Ѳ', 'Л', '+', '3', 'И', 'I', 'Ѵ', 'КНЦ', 'У', 'НЧЛ', '-', '8', '!', 'Э', '7', '2', 'Е', 'Ё', 'Ѣ', 'Ж', 'Ю', 'Ц', "'", 'Н', '=', 'Щ', 'Х', '*', '6', 'П', '0', 'В', '/', '\\', 'Р', 'Я', 'Т', '"', 'З']
-        codes = '.----   -..   ----.   ..--..   ---.   -...   ----   ......   --.   ....-   -..-   -..-   .---   ---   -.-.-.   -.-   -.--   ...   ---...   .-   --   .....   -.--.-   -.--.-   ..-.   ..-.   .-..   .-.-.   ...--   ..   ..   ..   ..-.-   ..-   -.-.-   -....-   ---..   --..--   ..-..   --...   ..---   .   .   .   ...-   ..--   -.-.   .----.   -.   -...-   --.-   ....   ....   -....   .--.   -----   .--   -..-.   -..-.   .-.   .-.-   -   .-..-.   --..'
+        codes = '.----   -..   ----.   ..--..   ---.   -...   ----   ......   --.   ....-   -..-   -..-   .---   ---   -.-.-.   -.-   -.--   ...   ---...   .-   --   .....   -.--.   -.--.   ..-.   ..-.   .-..   .-.-.   ...--   ..   ..   ..   ..-.-   ..-   -.-.-   -....-   ---..   --..--   ..-..   --...   ..---   .   .   .   ...-   ..--   -.-.   .----.   -.   -...-   --.-   ....   ....   -....   .--.   -----   .--   -..-.   -..-.   .-.   .-.-   -   .-..-.   --..'
         self.assertEqual(f(chars), codes)
         chars = 'ПОЛУЧЕННАЯ ТЕЛЕГРАММА, ТРУЛЯЛЯ-ТРАЛЯЛЯ!'
         codes = '.--. --- .-.. ..- ---. . -. -. .- .-.-   - . .-.. . --. .-. .- -- -- .- .-.-.-   - .-. ..- .-.. .-.- .-.. .-.- -....- - .-. .- .-.. .-.- .-.. .-.- --..--'
@@ -546,5 +870,138 @@ class MorseTest(TestCase, Morse):
         self.assertEqual(self.triplesToChars(self.bitsToTriples(bits)), 'СОЕД НЧЛ ПОЛУЧЕННАЯ ТЕЛЕГР НПН ММА, ТРУЛ НПН НПН ОШК ТРУЛЯЛЯ-ТРАЛЯЛЯ! КНЦ')
         self.assertEqual(self.triplesToChars(self.bitsToTriples(bits), True, True), 'ПОЛУЧЕННАЯ ТЕЛЕГР НПН ММА, ТРУЛЯЛЯ-ТРАЛЯЛЯ!')
 
+    def testTriplesContainer(self):
+        chars = 'Привет, телеграф!'
+        plain = tuple(self.charsToTriples(chars, 1, True))
+        triples = Triples(plain)
+        self.assertEqual(self.charsToTriples(chars, 1, True), triples)
+        self.assertEqual(len(triples), len(plain))
+        self.assertEqual(tuple(triples), plain)
+        self.assertEqual(triples, plain)
+        self.assertEqual(plain, triples)
+        self.assertEqual(triples, [list(triple) for triple in plain])
+        self.assertNotEqual(triples, plain[1:])
+        self.assertEqual(hash(triples), hash(plain))
+        self.assertEqual(triples.bits, ''.join(triple[0] for triple in plain))
+        for index in (0, 5, -1, -len(plain)):
+            self.assertEqual(triples[index], plain[index])
+        self.assertRaises(IndexError, triples.__getitem__, len(plain))
+        for index in (slice(3, 9), slice(None, -2), slice(7, 2), slice(-4, None), slice(1, None, 2), slice(None, None, -1)):
+            self.assertEqual(tuple(triples[index]), plain[index])
+            self.assertIsInstance(triples[index], Triples)
+        self.assertEqual(triples[3:9], Triples(plain[3:9]))
+        self.assertEqual(triples.column(1), tuple(triple[1] for triple in plain))
+        self.assertEqual(self.triplesToChars(triples, True), self.triplesToChars(plain, True))
+        self.assertEqual(len(Triples()), 0)
+        self.assertEqual(Triples(), ())
+        self.assertNotEqual(Triples(), '')
+        self.assertIs(Triples().__eq__(''), NotImplemented)
+        self.assertNotEqual(triples, 'Ж' * len(plain))
+        self.assertNotEqual(triples, iter(plain))
+        self.assertNotEqual(Triples((('1', '.', 'Е'),)), ['1.Е'])
+        self.assertEqual(Triples().bits, '')
+
+    def testAdaptive(self):
+        bits = self.charsToBits('Т Т', 3)
+        self.assertEqual(self.triplesToChars(self.bitsToTriples(bits)), 'ЕЕ')
+        self.assertEqual(self.triplesToChars(self.bitsToTriples(bits, profile = TimingProfile(3))), 'Т Т')
+        bits = self.charsToBits('ПРИВЕТ ТЕЛЕГРАФ', 3) + PAUSE * 21 + self.charsToBits('МЕДЛЕННО', 5)
+        self.assertNotEqual(self.triplesToChars(self.bitsToTriples(bits)), 'ПРИВЕТ ТЕЛЕГРАФ МЕДЛЕННО')
+        profile = TimingProfile()
+        self.assertEqual(self.triplesToChars(self.bitsToTriples(bits, profile = profile)), 'ПРИВЕТ ТЕЛЕГРАФ МЕДЛЕННО')
+        self.assertAlmostEqual(profile.unit, 5, 2)
+        self.assertEqual(self.triplesToChars(self.bitsToTriples(self.charsToBits('Т Т', 5), profile = profile)), 'Т Т')
+
+    def testBeam(self):
+        chars = 'Полученная телеграмма, труляля-траляля!'
+        for bitsPerDit in (1, 3):
+            for wrap in (False, True):
+                self.assertEqual(self.bitsToTriples(self.charsToBits(chars, bitsPerDit, wrap), decoder = BEAM_DECODER), self.charsToTriples(chars, bitsPerDit, wrap))
+        bits = self.charsToBits('ПРИВЕТ Э', 3) + PAUSE * 6 + self.codeToBits('..-..', 3) # short character gap
+        self.assertEqual(self.triplesToChars(self.bitsToTriples(bits)), 'ПРИВЕТ НПН')
+        self.assertEqual(self.triplesToChars(self.bitsToTriples(bits, decoder = BEAM_DECODER)), 'ПРИВЕТ ЭЭ')
+        bits = self.charsToBits('ПРИВЕТ 1', 3)[:-4] # short last dah
+        self.assertEqual(self.triplesToChars(self.bitsToTriples(bits)), 'ПРИВЕТ НПН')
+        self.assertEqual(self.triplesToChars(self.bitsToTriples(bits, decoder = BEAM_DECODER)), 'ПРИВЕТ 1')
+        self.assertEqual(self.bitsToTriples('', decoder = BEAM_DECODER), ())
+        self.assertRaises(AssertionError, self.bitsToTriples, bits, decoder = 'nope')
+        self.assertRaises(AssertionError, self.bitsToTriples, bits, profile = TimingProfile(), decoder = BEAM_DECODER)
+
+    def testDurations(self):
+        chars = 'Полученная телеграмма, труляля-траляля!'
+        bits = self.charsToBits(chars, 1)
+        triples = self.bitsToTriples(bits)
+        durations = tuple(len(token) * 0.06 for token in TOKENIZER.split(bits))
+        for decoder in DECODERS:
+            durationTriples = self.durationsToTriples(durations, decoder = decoder)
+            self.assertEqual(tuple(triple[1:] for triple in durationTriples), tuple(triple[1:] for triple in triples))
+            for (durationTriple, triple) in zip(durationTriples, triples):
+                self.assertAlmostEqual(sum(durationTriple[0]), len(triple[0]) * 0.06)
+        self.assertEqual(self.triplesToChars(self.durationsToTriples(durations + (0.5,), profile = TimingProfile())), chars.upper())
+        timeStamps = []
+        time = 1000.0
+        for (index, duration) in enumerate(durations):
+            if not index % 2:
+                timeStamps.append((time, time + duration))
+            time += duration
+        self.assertEqual(self.triplesToChars(self.durationsToTriples(timeStamps)), chars.upper())
+        self.assertEqual(self.durationsToTriples(()), ())
+        self.assertEqual(self.durationsToTriples([(1.0, 1.5)]), (((0.5,), '.', 'Е'),))
+        self.assertRaises(AssertionError, self.durationsToTriples, (0.1, 0, 0.1))
+
+    def testAirtime(self):
+        for chars in ('', 'Т', 'Полученная телеграмма, труляля-траляля!', '(скобки) НЧЛ ОШК КНЦ', ['А', 'НЧЛ', 'ПР']):
+            for wrap in (False, True):
+                self.assertEqual(self.airtime(chars, wrap), len(self.charsToBits(chars, 1, wrap)))
+        self.assertEqual(self.airtime('АБZВ  Z ZZ Г', defaultCode = ''), len(self.codeToBits(self.encodeMessage('АБZВ  Z ZZ Г', ''), 1)))
+        self.assertEqual(self.airtime('АБZВ', defaultCode = '.'), self.airtime('АБЕВ'))
+        self.assertRaises(KeyError, self.airtime, 'АБZВ')
+        self.assertEqual(self.encodeSymbol(')'), '-.--.') # shorter of the alternates
+        self.assertEqual(self.encodeSymbol('Ъ'), '-..-')
+        self.assertEqual(Morse(LATIN).airtime('PARIS') + 7, PARIS_DITS) # with the word gap
+        self.assertEqual(self.codeTable.costs['Ь'], 11)
+        self.assertEqual(ditsToSeconds(PARIS_DITS, 20), 3)
+
+    def testCodeTables(self):
+        self.assertIs(Morse().codeTable, CODE_TABLES[RUSSIAN])
+        self.assertIs(Morse(RUSSIAN_CODES).codeTable, CODE_TABLES[RUSSIAN])
+        self.assertEqual(Morse(dict(RUSSIAN_CODES)).version, Morse().version)
+        with self.assertRaises(TypeError):
+            self.encoding['Z'] = '.'
+        latin = Morse(LATIN)
+        self.assertEqual(latin.codeTable.name, LATIN)
+        self.assertEqual(latin.triplesToChars(latin.bitsToTriples(latin.charsToBits('Hello, world', 1, True)), True, True), 'HELLO, WORLD')
+        self.assertEqual(latin.encodeSymbol('×'), '-..-')
+        self.assertNotEqual(latin.version, self.version)
+        custom = dict(LATIN_CODES, Ä = '.-.-')
+        table = registerCodeTable('german', custom)
+        self.assertIs(Morse('german').codeTable, table)
+        self.assertIs(Morse(custom).codeTable, table)
+        self.assertIs(registerCodeTable('deutsch', dict(custom)), table)
+        self.assertEqual(Morse(table).decodeSymbol('.-.-'), 'Ä')
+        self.assertRaises(AssertionError, Morse, 'klingon')
+        self.assertRaises(AssertionError, Morse, dict(RUSSIAN_CODES, Z = '.'))
+        self.assertRaises(AssertionError, Morse, {})
+        del CODE_TABLES['german'], CODE_TABLES['deutsch']
+
+    def testVersion(self):
+        self.assertEqual(Morse().version, self.version)
+        self.assertNotEqual(Morse(dict(RUSSIAN_CODES, Й = '.---.')).version, self.version)
+        self.assertNotEqual(Morse(defaultChar = '').version, self.version)
+        with TemporaryDirectory() as directory: # the same code in another place and with shifted lines
+            fileName = join(directory, 'MorseCopy.py')
+            with open(__file__, encoding = 'utf-8') as source, open(fileName, 'w', encoding = 'utf-8') as f:
+                f.write('\n\n' + source.read())
+            spec = spec_from_file_location('MorseCopy', fileName)
+            module = module_from_spec(spec)
+            spec.loader.exec_module(module)
+            self.assertEqual(module.Morse().version, self.version)
+        alpha = TIMING_ALPHA
+        try:
+            globals()['TIMING_ALPHA'] = alpha / 2
+            self.assertNotEqual(Morse().version, self.version)
+        finally:
+            globals()['TIMING_ALPHA'] = alpha
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+#
+# Morse Control tone synthesis
+#
+# Renders keying bits as 16-bit mono PCM with raised cosine edges on every tone,
+# so the sound doesn't click. Only the ramp gains and a block of whole periods of the tone
+# are computed once and reused, tones of any length are cut from that block and produced
+# in pieces of bounded size, to be written to a WAV file or played elsewhere.
+#
+from array import array
+from fractions import Fraction
+from math import ceil, cos, pi, sin
+from re import compile as reCompile
+from sys import byteorder
+from unittest import main, TestCase
+from wave import open as waveOpen
+
+from Morse import Morse, Triples, BITS_PER_DIT, DEFAULT_WPM, DIT, PARIS_DITS
+
+DEFAULT_FREQUENCY = 700 # Hz
+DEFAULT_SAMPLE_RATE = 8000 # Hz
+DEFAULT_VOLUME = 0.5 # part of the full scale
+
+RAMP_TIME = 0.005 # seconds of tone rise and fall
+CHUNK_SAMPLES = 8192 # most samples produced at once
+
+SAMPLE_WIDTH = 2 # bytes
+FULL_SCALE = 32767
+
+RUNS = reCompile('1+|0+')
+
+class ToneGenerator(object):
+    def __init__(self, wpm = DEFAULT_WPM, frequency = DEFAULT_FREQUENCY, sampleRate = DEFAULT_SAMPLE_RATE, volume = DEFAULT_VOLUME):
+        assert wpm > 0, "Bad speed: %r" % wpm
+        assert 0 < frequency < sampleRate / 2, "Bad frequency: %r" % frequency
+        assert 0 <= volume <= 1, "Bad volume: %r" % volume
+        self.wpm = wpm
+        self.frequency = frequency
+        self.sampleRate = sampleRate
+        self.volume = volume
+        self.ditSamples = 60.0 * sampleRate / (PARIS_DITS * wpm)
+        self.rampSamples = int(RAMP_TIME * sampleRate)
+        self.silence = array('h', bytes(SAMPLE_WIDTH * CHUNK_SAMPLES))
+        self.ramps = {} # ramp length: gains, at most rampSamples of them for short tones
+        # The shortest whole number of periods that is a whole number of samples, if it's not too long
+        self.period = (Fraction(sampleRate).limit_denominator(1000) / Fraction(frequency).limit_denominator(1000)).numerator
+        self.steady = None
+        if self.period <= CHUNK_SAMPLES:
+            self.steady = self.sine(0, self.period * (int(ceil(float(CHUNK_SAMPLES) / self.period)) + 1)) # any piece of CHUNK_SAMPLES is a single slice
+
+    def sine(self, start, end): # full volume tone samples from start to end
+        if self.steady is not None:
+            offset = start % self.period
+            return self.steady[offset:offset + end - start]
+        step = 2 * pi * self.frequency / self.sampleRate
+        amplitude = self.volume * FULL_SCALE
+        return array('h', (int(round(amplitude * sin(step * i))) for i in range(start, end)))
+
+    def ramp(self, length): # raised cosine gains
+        gains = self.ramps.get(length)
+        if gains is None:
+            gains = self.ramps[length] = tuple((1 - cos(pi * (i + 0.5) / length)) / 2 for i in range(length))
+        return gains
+
+    def tone(self, samples): # yields pieces of the tone of at most CHUNK_SAMPLES samples
+        gains = self.ramp(min(self.rampSamples, samples // 2))
+        for start in range(0, samples, CHUNK_SAMPLES):
+            end = min(samples, start + CHUNK_SAMPLES)
+            piece = self.sine(start, end)
+            for i in range(start, min(end, len(gains))): # rise
+                piece[i - start] = int(round(piece[i - start] * gains[i]))
+            for i in range(max(start, samples - len(gains)), end): # fall
+                piece[i - start] = int(round(piece[i - start] * gains[samples - 1 - i]))
+            yield piece
+
+    def pause(self, samples):
+        for start in range(0, samples, CHUNK_SAMPLES):
+            yield self.silence[:min(samples - start, CHUNK_SAMPLES)]
+
+    def samples(self, bits, bitsPerDit = BITS_PER_DIT): # yields arrays of at most CHUNK_SAMPLES samples, bits may be triples
+        if isinstance(bits, Triples):
+            bits = bits.bits
+        elif not isinstance(bits, str):
+            bits = ''.join(triple[0] for triple in bits)
+        samplesPerBit = self.ditSamples / bitsPerDit
+        chunk = array('h')
+        start = 0
+        for match in RUNS.finditer(bits):
+            end = int(round(match.end() * samplesPerBit)) # rounding positions, not lengths, keeps the total length exact
+            for piece in (self.tone if match.group()[0] == DIT else self.pause)(end - start):
+                size = CHUNK_SAMPLES - len(chunk)
+                chunk.extend(piece[:size])
+                if len(chunk) == CHUNK_SAMPLES:
+                    yield chunk
+                    chunk = piece[size:] # every sample is copied at most twice
+            start = end
+        if chunk:
+            yield chunk
+
+    def pcm(self, bits, bitsPerDit = BITS_PER_DIT): # yields little-endian PCM data as bytes
+        for chunk in self.samples(bits, bitsPerDit):
+            if byteorder == 'big':
+                chunk.byteswap()
+            yield chunk.tobytes()
+
+    def writeWav(self, fileName, bits, bitsPerDit = BITS_PER_DIT): # returns the number of samples written
+        numSamples = 0
+        with waveOpen(fileName, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(SAMPLE_WIDTH)
+            f.setframerate(self.sampleRate)
+            for data in self.pcm(bits, bitsPerDit):
+                f.writeframesraw(data)
+                numSamples += len(data) // SAMPLE_WIDTH
+        return numSamples
+
+class ToneGeneratorTest(TestCase):
+    def setUp(self):
+        self.generator = ToneGenerator(20, 1000, 8000, 1)
+
+    def render(self, bits, bitsPerDit = BITS_PER_DIT):
+        ret = array('h')
+        for chunk in self.generator.samples(bits, bitsPerDit):
+            self.assertLessEqual(len(chunk), CHUNK_SAMPLES)
+            ret.extend(chunk)
+        return ret
+
+    def testSamples(self):
+        samples = self.render('111000111', 3) # 3 dits at 20 WPM are 0.18 seconds
+        self.assertEqual(len(samples), 1440)
+        self.assertEqual(samples[0], 0)
+        self.assertLess(abs(samples[479]), 200) # faded out
+        self.assertEqual(max(samples[:480]), FULL_SCALE)
+        self.assertEqual(set(samples[480:960]), {0})
+        self.assertEqual(samples[960:], samples[:480])
+        self.assertEqual(len(self.render('1' * 7, 3)), 1120)
+        self.assertEqual(len(self.render('1' + '0' * 999 + '1', 1)), 1001 * 480)
+        self.assertEqual(sorted(self.generator.ramps), [40])
+
+    def testLongTone(self): # a stuck key doesn't make the generator keep the whole tone
+        samples = self.render('0' + '1' * 200 + '0', 1) # 96000 samples
+        self.assertEqual(len(samples), 202 * 480)
+        self.assertEqual(samples[520:1000], self.generator.steady[40:520]) # after the rise
+        self.assertEqual(samples[96000:96440], self.generator.steady[:440]) # before the fall
+        self.assertEqual(samples[96440:96480], self.render('1', 1)[-40:])
+        self.assertEqual(set(samples[:480]) | set(samples[-480:]), {0})
+        self.assertLess(len(self.generator.steady), 2 * CHUNK_SAMPLES)
+        self.assertEqual(sorted(self.generator.ramps), [40])
+        generator = ToneGenerator(20, 1000.5, 8000, 1) # no short whole period
+        self.assertIsNone(generator.steady)
+        self.assertEqual(sum(len(chunk) for chunk in generator.samples('1' * 30, 1)), 14400)
+
+    def testTriples(self):
+        morse = Morse()
+        bits = morse.charsToBits('ПРИВЕТ МИР', wrapForTransmission = True)
+        self.assertEqual(self.render(morse.bitsToTriples(bits)), self.render(bits))
+
+    def testWav(self):
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        with TemporaryDirectory() as dirName:
+            fileName = join(dirName, 'test.wav')
+            bits = Morse().charsToBits('ТЕЛЕГРАММА')
+            numSamples = self.generator.writeWav(fileName, bits)
+            self.assertEqual(numSamples, len(self.render(bits)))
+            with waveOpen(fileName, 'rb') as f:
+                self.assertEqual((f.getnchannels(), f.getsampwidth(), f.getframerate(), f.getnframes()), (1, SAMPLE_WIDTH, 8000, numSamples))
+
+if __name__ == '__main__':
+    main()
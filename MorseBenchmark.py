@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+#
+# Morse decoder accuracy and speed benchmark
+#
+# Random telegrams are encoded with jitter of element lengths at various speeds (bits per dit),
+# jitter levels and message lengths, and decoded with every decoder engine.
+# Jitter is either Gaussian, of the same size in dits for all elements,
+# or proportional, every element stretched or shrunk at random by up to the given part of its length,
+# like a hand keyed telegram. Drifting models are proportional too, but the speed also changes
+# steadily within the message, from the given rate to DRIFT times slower (slowdown) or back (speedup),
+# like an operator getting tired or getting into the swing. Reported are character error rate
+# (edit distance to the original text, per character) and decoding throughput.
+#
+# Usage: python3 MorseBenchmark.py [-h|--help] [-t|--trials N] [-s|--seed N]
+# Tests: python3 -m unittest MorseBenchmark
+#
+from collections import OrderedDict
+from getopt import getopt, GetoptError
+from math import ceil
+from random import Random
+from sys import argv, exit # pylint: disable=W0622
+from time import time
+from unittest import TestCase
+
+from Morse import Morse, TimingProfile, BEAM_DECODER, DOT, DASH, SPACE, WORD_SPACE, TOKENIZER
+
+ENGINES = OrderedDict(( # name: function returning bitsToTriples() arguments
+    ('hard', dict),
+    ('adaptive', lambda: dict(profile = TimingProfile())),
+    ('beam', lambda: dict(decoder = BEAM_DECODER))
+))
+
+MODELS = OrderedDict(( # name: function returning bits for Morse code with jitter
+    ('gauss', lambda code, rate, jitter, random: encodeUncertain(code, rate, jitter, random = random)),
+    ('proportional', lambda code, rate, jitter, random: encodeProportional(code, rate, jitter, random)),
+    ('slowdown', lambda code, rate, jitter, random: encodeProportional(code, rate, jitter, random, rate * DRIFT)),
+    ('speedup', lambda code, rate, jitter, random: encodeProportional(code, rate * DRIFT, jitter, random, rate))
+))
+
+DRIFT = 2 # ratio of the speeds at the ends of a drifting message
+
+RATES = (1, 3, 8) # bits per dit
+JITTERS = (0, 0.1, 0.2, 0.3, 0.4) # standard deviation of element lengths, in dits
+LENGTHS = (5, 20, 50) # words per message
+TRIALS = 10 # messages per combination
+
+USAGE = "Usage: python3 MorseBenchmark.py [-h|--help] [-t|--trials N] [-s|--seed N]"
+
+MAX_WORD_LENGTH = 8
+WORD_SEPARATOR = '='
+
+def makeUncertain(bits, d = 0.7, random = None): # jitters the lengths of the three most common elements of bits, keeping them in their classes
+    random = random or Random()
+    tokens = TOKENIZER.split(bits)
+    counts = {}
+    for token in tokens:
+        if token:
+            counts[len(token)] = counts.get(len(token), 0) + 1
+    lengths = sorted(length for (length, _count) in sorted(counts.items(), key = lambda length_count: -length_count[1])[:3])
+    (one, three, seven) = lengths + [0,] * (3 - len(lengths))
+    three = three or 3 * one
+    seven = seven or three * 7 // 3
+    maxDot = (one + three) // 2
+    maxDash = (three + seven) // 2
+    dOne = min(maxDot - one, one - 1)
+    dThree = min(maxDash - three, three - maxDot - 1)
+    dSeven = seven - maxDash - 1
+    ret = []
+    for token in tokens:
+        if len(token) == one:
+            token = token[0] * max(1, min(maxDot, one + int(random.gauss(0, d) * dOne)))
+        elif len(token) == three:
+            token = token[0] * max(maxDot + 1, min(maxDash, three + int(random.gauss(0, d) * dThree)))
+        elif len(token) == seven:
+            token = token[0] * max(maxDash + 1, seven + int(random.gauss(0, d) * dSeven))
+        ret.append(token)
+    return ''.join(ret)
+
+def encodeUncertain(morseCode, rate = 2, d = 0.7, bounded = False, random = None): # bits for morseCode, element lengths jittered by d dits
+    # With bounded, elements are kept within the length ranges of their classes
+    random = random or Random()
+    maxDot = min(int(3 * rate) - 1, int(ceil(2 * rate)))
+    maxDash = min(int(7 * rate) - 1, int(ceil(5 * rate)))
+    maxPause = int(ceil(9 * rate))
+    def token(bit, mn, mx, n, r):
+        length = max(1, int(round(rate * (n + r * random.gauss(0, d))))) if d else n * rate
+        return bit * (max(mn, min(mx, length)) if bounded else length)
+    prev = SPACE
+    ret = []
+    for c in morseCode.strip().replace(WORD_SPACE, WORD_SEPARATOR):
+        if c in (DOT, DASH) and prev in (DOT, DASH):
+            ret.append(token('0', 1, maxDot, 1, 1))
+        if c == DOT:
+            ret.append(token('1', 1, maxDot, 1, 1))
+        elif c == DASH:
+            ret.append(token('1', maxDot + 1, maxDash, 3, 1))
+        elif c == SPACE:
+            ret.append(token('0', maxDot + 1, maxDash, 3, 1))
+        elif c == WORD_SEPARATOR:
+            ret.append(token('0', maxDash + 1, maxPause, 7, 2))
+        else:
+            assert False, "Bad code: %r" % c
+        prev = c
+    return ''.join(ret)
+
+def encodeProportional(morseCode, rate = 2, jitter = 0.3, random = None, endRate = None): # bits for morseCode, element lengths multiplied by 1 +- jitter
+    # With endRate, the rate changes linearly from rate at the first element to endRate at the last one
+    random = random or Random()
+    prev = SPACE
+    elements = [] # (bit, dits)
+    for c in morseCode.strip().replace(WORD_SPACE, WORD_SEPARATOR):
+        if c in (DOT, DASH) and prev in (DOT, DASH):
+            elements.append(('0', 1))
+        if c == DOT:
+            elements.append(('1', 1))
+        elif c == DASH:
+            elements.append(('1', 3))
+        elif c == SPACE:
+            elements.append(('0', 3))
+        elif c == WORD_SEPARATOR:
+            elements.append(('0', 7))
+        else:
+            assert False, "Bad code: %r" % c
+        prev = c
+    step = (endRate - rate) / max(1, len(elements) - 1) if endRate is not None else 0
+    return ''.join(bit * max(1, int(round((rate + step * i) * n * random.uniform(1 - jitter, 1 + jitter)))) for (i, (bit, n)) in enumerate(elements))
+
+def editDistance(a, b):
+    previous = list(range(len(b) + 1))
+    for (i, x) in enumerate(a, 1):
+        current = [i]
+        for (j, y) in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        previous = current
+    return previous[-1]
+
+def triplesToSymbols(triples): # characters of decoded triples, multi-letter signs as single symbols
+    return [triple[-1] for triple in triples if triple[-1]]
+
+def randomText(morse, numWords, random):
+    letters = sorted(char for (char, code) in morse.encoding.items() if len(char) == 1 and char.isalpha() and morse.decoding[code] == char) # no synonyms
+    return SPACE.join(''.join(random.choice(letters) for _ in range(random.randint(1, MAX_WORD_LENGTH))) for _ in range(numWords))
+
+def benchmark(rates = RATES, jitters = JITTERS, lengths = LENGTHS, trials = TRIALS, seed = 0, engines = ENGINES, models = MODELS):
+    # Yields (engine, model, rate, jitter, length, character error rate, characters per second)
+    morse = Morse()
+    random = Random(seed)
+    for length in lengths:
+        texts = tuple(randomText(morse, length, random) for _ in range(trials))
+        for (model, encode) in models.items():
+            for rate in rates:
+                for jitter in jitters:
+                    samples = tuple((list(text), encode(morse.encodePhrase(text), rate, jitter, random)) for text in texts)
+                    numChars = sum(len(chars) for (chars, _bits) in samples)
+                    for (name, arguments) in engines.items():
+                        errors = 0
+                        elapsed = 0
+                        for (chars, bits) in samples:
+                            start = time()
+                            triples = morse.bitsToTriples(bits, **arguments())
+                            elapsed += time() - start
+                            errors += editDistance(chars, triplesToSymbols(triples))
+                        yield (name, model, rate, jitter, length, float(errors) / numChars, numChars / elapsed if elapsed else float('inf'))
+
+def runBenchmark(args):
+    trials = TRIALS
+    seed = 0
+    try:
+        (options, _parameters) = getopt(args, 'ht:s:', ('help', 'trials=', 'seed='))
+    except GetoptError as e:
+        print("%s\n%s" % (e, USAGE))
+        exit(2)
+    for (option, value) in options:
+        if option in ('-h', '--help'):
+            print(USAGE)
+            return
+        elif option in ('-t', '--trials'):
+            trials = int(value)
+        elif option in ('-s', '--seed'):
+            seed = int(value)
+    print('%-8s %-12s %4s %6s %5s %7s %10s' % ('engine', 'jitter model', 'rate', 'jitter', 'words', 'CER %', 'chars/s'))
+    for (name, model, rate, jitter, length, errorRate, speed) in benchmark(trials = trials, seed = seed):
+        print('%-8s %-12s %4d %6.2f %5d %7.2f %10.0f' % (name, model, rate, jitter, length, 100 * errorRate, speed))
+
+class BenchmarkTest(TestCase):
+    def setUp(self):
+        self.morse = Morse()
+
+    def testUncertain(self):
+        code = self.morse.encodePhrase('ПРИВЕТ ТЕЛЕГРАФ')
+        self.assertEqual(encodeUncertain(code, 3, 0), self.morse.codeToBits(code, 3))
+        bits = encodeUncertain(code, 5, 0.5, True, Random(1))
+        self.assertNotEqual(bits, self.morse.codeToBits(code, 5))
+        self.assertLessEqual(max(len(token) for token in TOKENIZER.split(bits)), 45) # longest word gap
+        bits = self.morse.codeToBits(code, 5)
+        self.assertEqual(self.morse.triplesToChars(self.morse.bitsToTriples(makeUncertain(bits, 0.5, Random(1)))), 'ПРИВЕТ ТЕЛЕГРАФ')
+
+    def testEditDistance(self):
+        self.assertEqual(editDistance('', ''), 0)
+        self.assertEqual(editDistance('АБВ', ''), 3)
+        self.assertEqual(editDistance('ПРИВЕТ', 'ПРЕВЕД'), 2)
+        self.assertEqual(editDistance(list('ТЕЛ'), ['Т', 'НПН', 'Л']), 1)
+
+    def testProportional(self):
+        code = self.morse.encodePhrase('ПРИВЕТ ТЕЛЕГРАФ')
+        self.assertEqual(encodeProportional(code, 3, 0), self.morse.codeToBits(code, 3))
+        bits = encodeProportional(code, 10, 0.3, Random(1))
+        self.assertNotEqual(bits, self.morse.codeToBits(code, 10))
+        self.assertTrue(all(7 <= len(token) <= 91 for token in TOKENIZER.split(bits)))
+
+    def testDrift(self):
+        code = self.morse.encodePhrase('ПРИВЕТ ТЕЛЕГРАФ')
+        bits = encodeProportional(code, 3, 0, endRate = 6)
+        tokens = TOKENIZER.split(bits)
+        self.assertEqual((len(tokens[0]), len(tokens[-1])), (3, 6)) # П starts with a dot, Ф ends with a dot
+        self.assertEqual(encodeProportional(code, 3, 0, endRate = 3), self.morse.codeToBits(code, 3))
+
+    def testAdaptiveDrift(self): # the case the adaptive decoder is made for
+        results = dict(((name, model), errorRate) for (name, model, _rate, _jitter, _length, errorRate, _speed)
+                       in benchmark((3,), (0.2,), (20,), 10, models = dict((model, MODELS[model]) for model in ('slowdown', 'speedup'))))
+        for model in ('slowdown', 'speedup'):
+            self.assertLess(results[('adaptive', model)], 0.01)
+            self.assertLess(results[('adaptive', model)], results[('hard', model)] / 10)
+
+    def testBenchmark(self):
+        results = tuple(benchmark((3,), (0, 0.3), (5,), 3))
+        self.assertEqual(tuple(result[:5] for result in results), tuple((name, model, 3, jitter, 5) for model in MODELS for jitter in (0, 0.3) for name in ENGINES))
+        self.assertEqual(tuple(result[5] for result in results[:len(ENGINES)]), (0,) * len(ENGINES))
+        self.assertTrue(all(result[6] > 0 for result in results))
+
+    def testBeamProportional(self): # the case the beam decoder is made for
+        results = dict((name, errorRate) for (name, _model, _rate, _jitter, _length, errorRate, _speed) in benchmark((3,), (0.3,), (20,), 20, models = dict(proportional = MODELS['proportional'])))
+        self.assertLess(results['beam'], 0.01)
+        self.assertLess(results['beam'], results['hard'] / 10)
+
+if __name__ == '__main__':
+    runBenchmark(argv[1:])
@@ -5,22 +5,28 @@
 from collections import deque
 from functools import partial
 from getopt import getopt
-from logging import getLogger, getLoggerClass, setLoggerClass, FileHandler, Formatter, Handler, INFO, NOTSET
+from logging import getLogger, FileHandler, Formatter, Handler, INFO, NOTSET
+from logging.handlers import QueueHandler, QueueListener
+from queue import Full, Queue
 from sys import argv, exit # pylint: disable=W0622
-from time import sleep, time
 from traceback import format_exc
 
 try:
-    from PyQt5 import uic
-    from PyQt5.QtCore import QByteArray, QCoreApplication, QDateTime, QObject, QSettings, pyqtSignal
+    from PyQt5.QtCore import QByteArray, QCoreApplication, QDateTime, QSettings, QTimer, pyqtSignal
     from PyQt5.QtWidgets import QApplication, QDesktopWidget, QDialog, QLabel, QMessageBox, QMainWindow
 except ImportError as ex:
     raise ImportError("%s: %s\n\nPlease install PyQt5 v5.2.1 or later: http://riverbankcomputing.com/software/pyqt/download5\n" % (ex.__class__.__name__, ex))
 
-from UARTTextProtocol import Command, COMMAND_MARKER
-from UARTTextCommands import ackResponse, morseBeepCommand, morseTxCommand, morsePrintCommand, morseRxResponse
-from SerialPort import SerialPort, DT, TIMEOUT
+from UICompiler import loadUi
+from UARTTextProtocol import Command, CommandDispatcher, logUnexpectedInput, COMMAND_MARKER
+from UARTTextCommands import commandSet, ackResponse, meshNodeInfoResponse, morseBeepCommand, morseTxCommand, morsePrintCommand, morseRxResponse
+from SerialPort import SerialPort
+from EmulatedSerial import EmulatedSerial
 from MorseWidgets import MessageFrame, YesNoMessageBox
+from MeshTelemetry import MeshTelemetry, TelemetryStore
+from MessageStore import MessageStore
+from MorseMessages import readRecords, SENT, RECEIVED
+from MorseProfiles import TimingProfiles
 
 LONG_DATETIME_FORMAT = 'yyyy.MM.dd hh:mm:ss'
 
@@ -29,75 +35,58 @@ MESSAGE_UI_FILE_NAME = 'MorseMessage.ui'
 
 ABOUT_UI_FILE_NAME = 'AboutMC.ui'
 
-DATA_FILE_NAME = 'MorseControl.msg'
+JOURNAL_FILE_NAME = 'MorseControl.journal'
+INDEX_FILE_NAME = 'MorseControl.index'
+DATA_FILE_NAME = 'MorseControl.msg' # imported into the journal once
 TEXT_FILE_NAME = 'MorseControl.txt'
 
 LOG_FILE_NAME = 'MorseControl.log'
+LOG_MAX_LINES = 5000 # log view scrollback
+LOG_REFRESH_INTERVAL = 100 # milliseconds between log view updates
+LOG_QUEUE_SIZE = 10000 # records waiting for the log writer thread
+
+TELEMETRY_DIR_NAME = 'MeshTelemetry'
+
+PROFILES_FILE_NAME = 'MorseControl.profiles'
+DECODE_CACHE_FILE_NAME = 'MorseControl.cache'
 
 WINDOW_SIZE = 2.0 / 3
 WINDOW_POSITION = (1 - WINDOW_SIZE) / 2
 
-class CallableHandler(Handler):
-    def __init__(self, emitCallable, level = NOTSET):
+SEARCH_DELAY = 300 # milliseconds after the last change of the search query
+SEARCH_STATES = (None, (SENT,), (RECEIVED,)) # by searchStateComboBox index
+
+class BatchHandler(Handler): # collects formatted lines for the GUI thread to take in batches
+    def __init__(self, maxLines, level = NOTSET):
         super().__init__(level)
-        self.emitCallable = emitCallable
+        self.lines = deque(maxlen = maxLines)
 
     def emit(self, record):
-        self.emitCallable(self.format(record))
-
-class EventLogger(getLoggerClass(), QObject):
-    logSignal = pyqtSignal(tuple, dict)
+        self.lines.append(self.format(record))
 
-    def configure(self, parent = None):
-        QObject.__init__(self, parent)
-        self.logSignal.connect(self.doLog)
-
-    def doLog(self, args, kwargs): # pylint: disable=R0201
-        super()._log(*args, **kwargs)
-
-    def _log(self, *args, **kwargs):
-        self.logSignal.emit(args, kwargs)
+    def takeLines(self):
+        lines = []
+        try:
+            while True:
+                lines.append(self.lines.popleft())
+        except IndexError:
+            return lines
 
-class EmulatedSerial(object):
-    def __init__(self):
-        self.name = 'EMUL'
-        self.interval = 20 # emulate receiving message every 20 seconds
-        self.timeout = TIMEOUT
-        self.buffer = deque()
-        self.ready = False
-        self.nextMessage = time() + self.interval
-
-    def readline(self):
-        while True:
-            if self.buffer:
-                return self.buffer.popleft()
-            now = time()
-            if self.ready and (self.nextMessage is None or now > self.nextMessage):
-                self.nextMessage = now + self.interval
-                return morseRxResponse.encode('000000000000010101010101010101010101010100000001110101110101110000000101110111010001110111011100010111010100010101110001110111011101000100011101000111010001011100010111010111000001110001000101110101000100011101110100010111010001010101110100011101110001110111000101110001011101011101011100000111000101110100010101110001011101010001110101011101110001110111011101011100010101010101010101010001110001011101000101011100010111010100010111010111000101110101000101110101110001110101010101110001110001011101000101110001011101010001011101011100010111010100010111010111000111011101010111011100000001010111010111000000')
-            sleep(DT)
-
-    def write(self, data):
-        ret = ''
+class DroppingQueueHandler(QueueHandler): # drops records when the queue is full, instead of reporting an error for each one
+    def enqueue(self, record):
         try:
-            (tag, _args) = Command.decodeCommand(data)
-            if tag:
-                ret = ackResponse.encode(0)
-            else:
-                raise ValueError("Неизвестная команда")
-        except ValueError as e:
-            ret = str(e)
-        self.buffer.append(ret)
-        self.ready = True
-        return len(data)
-
-    def close(self):
-        pass
+            self.queue.put_nowait(record)
+        except Full:
+            pass
+
+class BlockingQueueListener(QueueListener): # waits for room for the stop marker in a full queue
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
 
 class AboutDialog(QDialog):
     def __init__(self):
         super().__init__()
-        uic.loadUi(ABOUT_UI_FILE_NAME, self)
+        loadUi(ABOUT_UI_FILE_NAME, self)
 
 class PortLabel(QLabel):
     STATUS_COLORS = {
@@ -120,16 +109,18 @@ class PortLabel(QLabel):
 class MorseControl(QMainWindow):
     comConnect = pyqtSignal(str)
     comDisconnect = pyqtSignal()
-    comInput = pyqtSignal(str)
+    guiCall = pyqtSignal(object, tuple)
+    commandReply = pyqtSignal(object)
 
     def __init__(self, args):
         super().__init__()
-        uic.loadUi(MAIN_UI_FILE_NAME, self)
+        loadUi(MAIN_UI_FILE_NAME, self)
         # Processing command line options
         self.advanced = False
         self.emulated = False
+        self.adaptive = True
         self.needLoadSettings = True
-        (options, _parameters) = getopt(args, 'aer', ('advanced', 'emulated', 'reset'))
+        (options, _parameters) = getopt(args, 'aerf', ('advanced', 'emulated', 'reset', 'fixed'))
         for (option, _value) in options:
             if option in ('-a', '--advanced'):
                 self.advanced = True
@@ -137,6 +128,8 @@ class MorseControl(QMainWindow):
                 self.emulated = True
             elif option in ('-r', '--reset'):
                 self.needLoadSettings = False
+            elif option in ('-f', '--fixed'): # fixed edges decoder, better only with a steady speed and Gaussian jitter, see MorseBenchmark
+                self.adaptive = False
         # Setting variables
         self.port = None
         # Setting window size
@@ -150,39 +143,64 @@ class MorseControl(QMainWindow):
         self.portLabel.configure()
         self.resetButton.clicked.connect(self.reset)
         self.consoleEdit.configure(self.consoleEnter)
+        self.searchTimer = QTimer(self)
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(SEARCH_DELAY)
+        self.searchTimer.timeout.connect(self.search)
+        self.searchEdit.textChanged.connect(self.searchTimer.start)
+        self.searchStateComboBox.currentIndexChanged.connect(self.search)
         self.aboutDialog = AboutDialog()
         self.aboutAction.triggered.connect(self.aboutDialog.exec_)
         self.aboutQtAction.triggered.connect(partial(QMessageBox.aboutQt, self, "About Qt"))
-        # Setup logging
+        # Setup logging, records from any thread are queued, written to file in a background thread and shown in batches
         formatter = Formatter('%(asctime)s %(levelname)s\t%(message)s', '%Y-%m-%d %H:%M:%S')
-        handlers = (FileHandler(LOG_FILE_NAME), CallableHandler(self.logTextEdit.appendPlainText))
-        rootLogger = getLogger('')
+        self.logHandler = BatchHandler(LOG_MAX_LINES)
+        handlers = (FileHandler(LOG_FILE_NAME), self.logHandler)
         for handler in handlers:
             handler.setFormatter(formatter)
-            rootLogger.addHandler(handler)
+        logQueue = Queue(LOG_QUEUE_SIZE)
+        self.logListener = BlockingQueueListener(logQueue, *handlers, respect_handler_level = True)
+        self.logListener.start()
+        self.logQueueHandler = DroppingQueueHandler(logQueue)
+        rootLogger = getLogger('')
+        rootLogger.addHandler(self.logQueueHandler)
         rootLogger.setLevel(INFO)
-        setLoggerClass(EventLogger)
+        self.logTextEdit.setMaximumBlockCount(LOG_MAX_LINES)
+        self.logTimer = QTimer(self)
+        self.logTimer.setInterval(LOG_REFRESH_INTERVAL)
+        self.logTimer.timeout.connect(self.updateLog)
+        self.logTimer.start()
         self.logger = getLogger('MorseControl')
-        self.logger.configure(self) # pylint: disable=E1103
         self.logger.info("старт")
         # Loading messages
-        MessageFrame.configure(MESSAGE_UI_FILE_NAME, self.messageHistoryWidget, self.sendMessage, self.printMessage)
+        MessageFrame.configure(MESSAGE_UI_FILE_NAME, self.messageHistoryView, self.sendMessage, self.printMessage, DECODE_CACHE_FILE_NAME, self.adaptive)
         # Starting up!
         self.loadSettings()
         self.loadData()
         self.comConnect.connect(self.processConnect)
         self.comDisconnect.connect(self.processDisconnect)
-        self.comInput.connect(self.processInput)
+        self.guiCall.connect(self.doGuiCall)
+        self.commandReply.connect(self.processReply)
+        self.dispatcher = CommandDispatcher(commandSet, self.guiCall.emit, partial(logUnexpectedInput, self.logger))
+        self.profiles = TimingProfiles(PROFILES_FILE_NAME)
+        self.dispatcher.subscribe(morseRxResponse, self.receive)
+        self.telemetry = MeshTelemetry(TelemetryStore(TELEMETRY_DIR_NAME))
+        self.dispatcher.subscribe(meshNodeInfoResponse, self.telemetry.ingest, True)
         self.port = SerialPort(self.logger, morseBeepCommand.prefix, ackResponse.prefix,
-                               self.comConnect.emit, self.comDisconnect.emit, self.comInput.emit, self.portLabel.setPortStatus.emit,
-                               EmulatedSerial() if self.emulated else None, (230400,))
+                               self.comConnect.emit, self.comDisconnect.emit, self.dispatcher.dispatch, self.portLabel.setPortStatus.emit,
+                               EmulatedSerial() if self.emulated else None, (230400,), writeBufferSize = None) # asynchronous commands may follow each other quickly
         if self.savedMaximized:
             self.showMaximized()
         else:
             self.show()
 
+    def updateLog(self):
+        lines = self.logHandler.takeLines()
+        if lines:
+            self.logTextEdit.appendPlainText('\n'.join(lines))
+
     def askForExit(self):
-        if not MessageFrame.hasUnsaved():
+        if not self.messageHistoryView.hasUnsaved():
             return True
         messageBox = YesNoMessageBox("Телеграмма не отправлена", "Вы уверены, что хотите выйти?", self)
         return messageBox.exec_() == QMessageBox.Yes
@@ -193,44 +211,48 @@ class MorseControl(QMainWindow):
             self.logger.warning("Ошибка подключения устройства: %d", code)
         else:
             self.logger.info("Обнаружено подключенное устройство")
-            MessageFrame.setConnected(True)
+            self.messageHistoryView.setConnected(True)
 
     def processDisconnect(self):
         self.logger.warning("Устройство отключено")
-        MessageFrame.setConnected(False)
+        self.messageHistoryView.setConnected(False)
 
-    def processCommand(self, command, expect = COMMAND_MARKER):
-        if not self.port:
-            return
-        data = self.port.command(command, expect, QApplication.processEvents)
+    def processCommand(self, command, expect = COMMAND_MARKER): # returns at once, the reply comes to processReply()
+        if self.port:
+            self.port.commandAsync(command, expect, self.commandReply.emit)
+
+    def processReply(self, data): # None on timeout
         if data:
             data = str(data).strip()
-            (tag, args) = Command.decodeCommand(data)
+            (tag, _args) = Command.decodeCommand(data)
             if tag:
                 self.logger.info("OK")
-                return args
             else:
                 self.logger.warning("Неожиданные данные: %s", data)
         else:
             self.logger.warning("истекло время ожидания выполнения команды")
 
-    def processInput(self, data):
-        data = data.strip()
-        (tag, args) = Command.decodeCommand(data)
-        if tag == morseRxResponse.tag:
-            MessageFrame(args[0])
-        elif args is not None: # unexpected valid command
-            self.logger.warning("Неожиданная команда: %s %s", tag, ' '.join(str(arg) for arg in args))
-        elif tag: # unknown command
-            self.logger.warning("Неизвестная команда %s: %s", tag, data)
-        else: # not a command
-            self.logger.warning("Неожиданные данные: %s", data)
+    @staticmethod
+    def doGuiCall(handler, args):
+        handler(*args)
 
     def consoleEnter(self):
         data = self.consoleEdit.getInput()
         if data:
             self.port.write(data)
 
+    def receive(self, bits): # decoding with the timing profile of the current line
+        if self.adaptive:
+            port = self.port.port
+            self.messageHistoryView.addReceived(bits, self.profiles.get(port.name if port else None))
+            self.profiles.save()
+        else:
+            self.messageHistoryView.addReceived(bits)
+
+    def search(self):
+        self.searchTimer.stop()
+        self.messageHistoryView.setSearch(self.searchEdit.text(), SEARCH_STATES[self.searchStateComboBox.currentIndex()])
+
     def sendMessage(self, message):
         self.processCommand(morseTxCommand.encode(message), ackResponse.prefix)
 
@@ -241,7 +263,9 @@ class MorseControl(QMainWindow):
         if self.askForExit():
             self.saveData()
             self.saveSettings()
+            self.telemetry.close()
             self.logger.info("завершение")
+            self.stopLogging()
         else:
             event.ignore()
 
@@ -249,20 +273,23 @@ class MorseControl(QMainWindow):
         self.logger.info("сброс")
         self.port.reset()
 
-    @staticmethod
-    def saveData():
-        with open(DATA_FILE_NAME, 'w', encoding='utf-8', newline = '\r\n') as dataFile, open(TEXT_FILE_NAME, 'w', encoding='utf-8', newline = '\r\n') as textFile:
-            MessageFrame.writeData(dataFile, textFile)
-
-    @staticmethod
-    def loadData():
-        try:
-            dataFile = open(DATA_FILE_NAME, encoding='utf-8')
-        except OSError:
-            dataFile = None
-        MessageFrame.readData(dataFile)
-        if dataFile:
-            dataFile.close()
+    def saveData(self): # messages are saved to the journal as they change, only the outgoing one and the text copy are left
+        self.messageHistoryView.saveOutgoing()
+        if self.store.changed:
+            with open(TEXT_FILE_NAME, 'w', encoding='utf-8', newline = '\r\n') as textFile:
+                self.store.exportText(textFile)
+        self.store.close()
+        MessageFrame.decodeCache.save()
+
+    def loadData(self):
+        self.store = MessageStore(JOURNAL_FILE_NAME, INDEX_FILE_NAME)
+        if self.store.isNew:
+            try:
+                with open(DATA_FILE_NAME, encoding='utf-8') as dataFile:
+                    self.logger.info("импортировано телеграмм: %d", self.store.importRecords(readRecords(dataFile)))
+            except OSError:
+                pass
+        self.messageHistoryView.setStore(self.store)
 
     def saveSettings(self):
         settings = QSettings()
@@ -313,8 +340,13 @@ class MorseControl(QMainWindow):
     def error(self, message):
         print("ERROR:", message)
         self.logger.error(message)
+        self.stopLogging()
         exit(-1)
 
+    def stopLogging(self): # records logged after this are not queued, as no one would take them
+        getLogger('').removeHandler(self.logQueueHandler)
+        self.logListener.stop()
+
 if __name__ == '__main__': # Not using main() function per recommendation for PyQt5:
     try:                   # http://pyqt.sourceforge.net/Docs/PyQt5/pyqt4_differences.html#object-destruction-on-exit
         application = QApplication(argv)
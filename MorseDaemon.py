@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+#
+# Morse Control headless relay daemon, doesn't need PyQt5
+#
+# Receives, decodes and stores telegrams to the same message store as the GUI,
+# sends telegrams from text files put to the spool directory, one by one,
+# a file is deleted after the device acknowledges its transmission.
+# Files should be written elsewhere and moved to the spool directory.
+# With a port specified, texts sent to that local TCP port are spooled too:
+#     echo ПРИВЕТ | nc -N localhost 7373
+# The GUI and the daemon must not use the same message store at the same time.
+#
+# Received telegrams are decoded the same way as in the GUI, with the adaptive decoder,
+# using the timing profile of the serial port, or of the operator given with --operator,
+# or, with --fixed, with the fixed edges decoder, that is better only with a steady speed and Gaussian jitter,
+# or with the experimental beam decoder, trying ambiguous elements both ways, with --beam.
+# In MorseBenchmark, the beam decoder is the best with proportional jitter of element lengths
+# and a steady speed, but it's worse than the adaptive one with speed drift, and several times slower.
+# The code table is Russian, unless another registered one is given with --alphabet, like latin.
+#
+# Usage: python3 MorseDaemon.py [-e|--emulated] [-f|--fixed] [-b|--beam] [-a|--alphabet NAME] [-s|--spool DIR] [-p|--port PORT] [-o|--operator NAME]
+#
+from datetime import datetime
+from functools import partial
+from getopt import getopt
+from itertools import count
+from logging import getLogger, FileHandler, Formatter, StreamHandler, INFO
+from os import listdir, makedirs, remove, replace
+from os.path import join
+from re import compile as reCompile
+from signal import signal, SIGTERM
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+from sys import argv, exit # pylint: disable=W0622
+from threading import Thread
+from time import sleep, time
+
+from UARTTextProtocol import CommandDispatcher, logUnexpectedInput
+from UARTTextCommands import commandSet, ackResponse, meshNodeInfoResponse, morseBeepCommand, morseTxCommand, morseRxResponse, MORSE_TX_BITS_PER_DIT
+from SerialPort import SerialPort
+from EmulatedSerial import EmulatedSerial
+from Morse import Morse, BEAM_DECODER, RUSSIAN
+from MeshTelemetry import MeshTelemetry, TelemetryStore
+from MessageStore import MessageStore
+from MorseMessages import MessageRecord, SENT, RECEIVED, STORE_DATETIME_FORMAT
+from MorseProfiles import TimingProfiles
+
+LOG_FILE_NAME = 'MorseDaemon.log'
+
+SPOOL_DIR_NAME = 'MorseSpool'
+SPOOL_SUFFIX = '.txt'
+SPOOL_INTERVAL = 1 # seconds between spool directory checks
+RETRY_INTERVAL = 10 # seconds to wait after a failed transmission
+
+SOCKET_HOST = 'localhost'
+
+class SpoolRequestHandler(StreamRequestHandler):
+    def handle(self): # the text is read until the client closes its side of the connection
+        text = self.rfile.read().decode('utf-8', 'replace')
+        self.wfile.write(b'OK\n' if self.server.morseDaemon.spool(text) else b'EMPTY\n')
+
+class MorseDaemon(object):
+    SPACE_CUTTER = reCompile(r'\s+')
+
+    def __init__(self, spoolDirName = SPOOL_DIR_NAME, socketPort = None, emulated = False, operator = None, beam = False, alphabet = RUSSIAN, tracking = True):
+        self.logger = getLogger('MorseDaemon')
+        self.logger.info("старт")
+        self.morse = Morse(alphabet)
+        self.profiles = TimingProfiles()
+        self.operator = operator
+        self.beam = beam
+        self.tracking = tracking
+        self.spoolDirName = spoolDirName
+        makedirs(spoolDirName, exist_ok = True)
+        self.spoolNumbers = count()
+        self.sending = None # (fileName, MessageRecord) waiting for acknowledgement
+        self.retryTime = 0
+        self.store = MessageStore()
+        self.telemetry = MeshTelemetry(TelemetryStore())
+        self.dispatcher = CommandDispatcher(commandSet, None, partial(logUnexpectedInput, self.logger))
+        self.dispatcher.subscribe(morseRxResponse, self.receive)
+        self.dispatcher.subscribe(meshNodeInfoResponse, self.telemetry.ingest)
+        self.server = None
+        if socketPort:
+            self.server = ThreadingTCPServer((SOCKET_HOST, socketPort), SpoolRequestHandler)
+            self.server.morseDaemon = self
+            Thread(target = self.server.serve_forever, name = 'MorseDaemon socket', daemon = True).start()
+            self.logger.info("Прием телеграмм на порту %d", socketPort)
+        self.port = SerialPort(self.logger, morseBeepCommand.prefix, ackResponse.prefix,
+                               self.processConnect, self.processDisconnect, self.dispatcher.dispatch, None,
+                               EmulatedSerial() if emulated else None, (230400,), writeBufferSize = None) # asynchronous commands may follow each other quickly
+
+    def processConnect(self, pong):
+        (code,) = ackResponse.decode(pong) # pylint: disable=W0633
+        if code:
+            self.logger.warning("Ошибка подключения устройства: %d", code)
+        else:
+            self.logger.info("Обнаружено подключенное устройство")
+
+    def processDisconnect(self):
+        self.logger.warning("Устройство отключено")
+
+    def receive(self, bits):
+        if self.beam:
+            triples = self.morse.bitsToTriples(bits, decoder = BEAM_DECODER)
+        elif self.tracking:
+            port = self.port.port
+            triples = self.morse.bitsToTriples(bits, profile = self.profiles.get(self.operator or (port.name if port else None)))
+            self.profiles.save()
+        else:
+            triples = self.morse.bitsToTriples(bits)
+        text = self.morse.triplesToChars(triples, True, True)
+        self.store.put(MessageRecord(RECEIVED, datetime.now(), text, bits))
+        self.logger.info("Получена телеграмма: %s", text)
+
+    def cleanText(self, text): # what MessageTextEdit would allow to type
+        text = ''.join(c for c in text.upper() if c.isspace() or c in self.morse.encoding)
+        return self.SPACE_CUTTER.sub(' ', text.strip().replace('\n', ' = '))
+
+    def spool(self, text):
+        if not self.cleanText(text):
+            return False
+        fileName = join(self.spoolDirName, '%s-%d%s' % (datetime.now().strftime(STORE_DATETIME_FORMAT), next(self.spoolNumbers), SPOOL_SUFFIX))
+        with open(fileName + '.tmp', 'w', encoding = 'utf-8') as f:
+            f.write(text)
+        replace(fileName + '.tmp', fileName)
+        return True
+
+    def poll(self):
+        if self.sending or not self.port.ready or time() < self.retryTime:
+            return
+        fileNames = sorted(fileName for fileName in listdir(self.spoolDirName) if fileName.endswith(SPOOL_SUFFIX))
+        if not fileNames:
+            return
+        fileName = join(self.spoolDirName, fileNames[0])
+        with open(fileName, encoding = 'utf-8', errors = 'replace') as f:
+            text = self.cleanText(f.read())
+        if not text:
+            self.logger.warning("Пустая телеграмма: %s", fileName)
+            self.removeSpooled(fileName)
+            return
+        self.sending = (fileName, MessageRecord(SENT, None, text, self.morse.charsToBits(text))) # stored bits are as the GUI stores them
+        self.port.commandAsync(morseTxCommand.encode(self.morse.charsToBits(text, MORSE_TX_BITS_PER_DIT)), ackResponse.prefix, self.sent)
+
+    def sent(self, reply): # called from the serial port reader thread
+        (fileName, record) = self.sending
+        try:
+            try:
+                (code,) = ackResponse.decode(reply.strip()) if reply else (None,) # pylint: disable=W0633
+            except ValueError:
+                code = None
+            if code == 0:
+                record.timeStamp = datetime.now()
+                self.store.put(record)
+                self.logger.info("Отправлена телеграмма: %s", record.text)
+                self.removeSpooled(fileName)
+            else:
+                self.logger.warning("Телеграмма не отправлена, повтор через %d секунд: %s", RETRY_INTERVAL, fileName)
+                self.retryTime = time() + RETRY_INTERVAL
+        finally: # the spool must go on, whatever failed
+            self.sending = None
+
+    def removeSpooled(self, fileName):
+        try:
+            remove(fileName)
+        except OSError as e:
+            self.logger.warning("Ошибка удаления файла %s: %s", fileName, e)
+
+    def run(self):
+        try:
+            while True:
+                self.poll()
+                sleep(SPOOL_INTERVAL)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        self.port.reset()
+        self.store.close()
+        self.telemetry.close()
+        self.logger.info("завершение")
+
+def main(args):
+    spoolDirName = SPOOL_DIR_NAME
+    socketPort = None
+    emulated = False
+    operator = None
+    beam = False
+    alphabet = RUSSIAN
+    tracking = True
+    (options, _parameters) = getopt(args, 'efba:s:p:o:', ('emulated', 'fixed', 'beam', 'alphabet=', 'spool=', 'port=', 'operator='))
+    for (option, value) in options:
+        if option in ('-e', '--emulated'):
+            emulated = True
+        elif option in ('-f', '--fixed'):
+            tracking = False
+        elif option in ('-b', '--beam'):
+            beam = True
+        elif option in ('-a', '--alphabet'):
+            alphabet = value
+        elif option in ('-s', '--spool'):
+            spoolDirName = value
+        elif option in ('-p', '--port'):
+            socketPort = int(value)
+        elif option in ('-o', '--operator'):
+            operator = value
+    formatter = Formatter('%(asctime)s %(levelname)s\t%(message)s', '%Y-%m-%d %H:%M:%S')
+    rootLogger = getLogger('')
+    for handler in (FileHandler(LOG_FILE_NAME), StreamHandler()):
+        handler.setFormatter(formatter)
+        rootLogger.addHandler(handler)
+    rootLogger.setLevel(INFO)
+    signal(SIGTERM, lambda _signum, _frame: exit(0))
+    MorseDaemon(spoolDirName, socketPort, emulated, operator, beam, alphabet, tracking).run()
+
+if __name__ == '__main__':
+    main(argv[1:])
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+#
+# Morse Control message records and data file format
+#
+from datetime import datetime
+
+OUTGOING = 0
+SENT = 1
+RECEIVED = 2
+EDIT = 3
+
+STATE_MARKS = '!><$'
+STATE_TEXTS = ('Исходящая', 'Отправленная', 'Полученная', 'Полученная')
+
+STORE_DATETIME_FORMAT = '%Y%m%d-%H%M%S'
+DISPLAY_DATETIME_FORMAT = '%A %d %B %Y, %H:%M:%S'
+
+DATA_FILE_HEADER = '# MorseControl data file'
+TEXT_FILE_HEADER = '# MorseControl text file'
+
+class MessageRecord(object):
+    __slots__ = ('state', 'timeStamp', 'text', 'bits', 'savedText', 'height', 'key')
+
+    def __init__(self, state = OUTGOING, timeStamp = None, text = '', bits = None):
+        self.state = state
+        self.timeStamp = timeStamp
+        self.text = text
+        self.bits = bits
+        self.savedText = None # text before editing, for EDIT state
+        self.height = None # display height, once known
+        self.key = None # MessageStore key, once stored
+
+    def dataStr(self):
+        state = RECEIVED if self.state is EDIT else self.state
+        text = '\\n'.join(self.text.splitlines())
+        stateMark = STATE_MARKS[state]
+        if state is OUTGOING:
+            return ('\n%s\n%s\n' % (stateMark, text)) if text else ''
+        else:
+            return '\n%s\n%s\n%s\n' % (' '.join((stateMark, self.timeStamp.strftime(STORE_DATETIME_FORMAT))), text, self.bits)
+
+    def textStr(self):
+        stateText = STATE_TEXTS[self.state]
+        if self.state is OUTGOING:
+            return ('\n%s\n%s\n' % (stateText, self.text)) if self.text else ''
+        else:
+            return '\n%s\n%s\n' % (' '.join((stateText, self.timeStamp.strftime(DISPLAY_DATETIME_FORMAT))), self.text)
+
+    @classmethod
+    def fromReader(cls, reader): # raises StopIteration at the end of data
+        line = None
+        while not line:
+            line = next(reader)
+        tokens = line.split()
+        state = STATE_MARKS.index(tokens[0])
+        if state is OUTGOING:
+            assert len(tokens) == 1
+            return cls(state, None, next(reader).replace('\\n', '\n'))
+        assert len(tokens) == 2
+        timeStamp = datetime.strptime(tokens[1], STORE_DATETIME_FORMAT)
+        text = next(reader).replace('\\n', '\n')
+        return cls(state, timeStamp, text, next(reader))
+
+def streamReader(stream): # generator
+    for line in stream:
+        line = line.strip()
+        if not line.startswith('#'):
+            yield line
+
+def readRecords(stream): # generator
+    reader = streamReader(stream)
+    while True:
+        try:
+            yield MessageRecord.fromReader(reader)
+        except StopIteration:
+            return
+
+def writeRecords(records, dataFile, textFile):
+    dataFile.write(DATA_FILE_HEADER)
+    textFile.write(TEXT_FILE_HEADER)
+    for record in records:
+        dataFile.write(record.dataStr())
+        textFile.write(record.textStr())
+
+def writeText(records, textFile):
+    textFile.write(TEXT_FILE_HEADER)
+    for record in records:
+        textFile.write(record.textStr())
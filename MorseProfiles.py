@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+#
+# Persistent per line or operator timing profiles for the adaptive Morse decoder
+#
+from os import replace
+from unittest import main, TestCase
+
+from Morse import TimingProfile
+
+PROFILES_FILE_NAME = 'MorseControl.profiles'
+PROFILES_FILE_HEADER = '# MorseControl timing profiles: name, dit length in bits, number of elements'
+
+DEFAULT_PROFILE = 'default'
+
+class TimingProfiles(object):
+    def __init__(self, fileName = PROFILES_FILE_NAME):
+        self.fileName = fileName
+        self.profiles = {}
+        try:
+            with open(fileName, encoding = 'utf-8') as f:
+                for line in f:
+                    tokens = line.split()
+                    if tokens and not tokens[0].startswith('#'):
+                        (name, unit, count) = tokens
+                        self.profiles[name] = TimingProfile(float(unit), int(count))
+        except (OSError, ValueError):
+            pass
+
+    def get(self, name = None):
+        name = '_'.join(str(name).split()) if name else DEFAULT_PROFILE
+        profile = self.profiles.get(name)
+        if profile is None:
+            profile = self.profiles[name] = TimingProfile()
+        return profile
+
+    def save(self):
+        with open(self.fileName + '.tmp', 'w', encoding = 'utf-8') as f:
+            f.write(PROFILES_FILE_HEADER + '\n')
+            for (name, profile) in sorted(self.profiles.items()):
+                if profile.unit is not None:
+                    f.write('%s %.3f %d\n' % (name, profile.unit, profile.count))
+        replace(self.fileName + '.tmp', self.fileName)
+
+class TimingProfilesTest(TestCase):
+    def testProfiles(self):
+        from tempfile import TemporaryDirectory
+        with TemporaryDirectory() as dirName:
+            fileName = dirName + '/test.profiles'
+            profiles = TimingProfiles(fileName)
+            self.assertIs(profiles.get(), profiles.get(DEFAULT_PROFILE))
+            profiles.get('/dev/tty USB0').unit = 4.5
+            profiles.get('empty')
+            profiles.save()
+            profiles = TimingProfiles(fileName)
+            self.assertEqual(sorted(profiles.profiles), ['/dev/tty_USB0'])
+            self.assertEqual(profiles.get('/dev/tty USB0').unit, 4.5)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+#
+# Morse Control audio receiver
+#
+# Detects a Morse tone in audio, block by block, and produces the bits string for Morse.bitsToTriples(),
+# one bit per block. Tone power in every block is computed as a single DFT bin (as Goertzel filter does)
+# for all blocks of a chunk at once. The threshold lies between the noise and the signal levels,
+# tracked per chunk, and single block glitches are removed with a majority filter.
+# The tone frequency, if not given, is found as the spectrum peak of the first chunk where the peak
+# clearly stands out of the noise, the chunks before it are taken as pauses.
+#
+# Usage: python3 MorseReceiver.py [-f|--frequency HZ] file.wav ...
+#
+from getopt import getopt
+from sys import argv
+from unittest import main, TestCase
+from wave import open as waveOpen
+
+try:
+    import numpy
+except ImportError as ex:
+    raise ImportError("%s: %s\n\nPlease install NumPy v1.7 or later: http://www.numpy.org\n" % (ex.__class__.__name__, ex))
+
+from Morse import Morse, DIT, PAUSE
+
+BLOCK_TIME = 0.01 # seconds per detected bit
+CHUNK_TIME = 1 # seconds of audio processed at once
+FREQUENCY_RANGE = (200, 2000) # Hz to look for the tone in
+LEVEL_ALPHA = 0.3 # weight of the latest chunk in noise and signal level estimates
+NOISE_PERCENTILE = 20
+SIGNAL_PERCENTILE = 90
+MIN_SNR = 10 # dB between noise and signal levels for a chunk to be taken as containing signal
+MIN_PEAK_SNR = 20 # dB between the spectrum peak and the median of the band for the peak to be taken as the tone
+
+class ToneDetector(object):
+    def __init__(self, sampleRate, frequency = None, blockTime = BLOCK_TIME):
+        self.sampleRate = sampleRate
+        self.blockSize = max(1, int(round(blockTime * sampleRate)))
+        self.chunkSize = self.blockSize * max(1, int(round(CHUNK_TIME / blockTime)))
+        self.frequency = None
+        self.kernel = None
+        if frequency:
+            self.setFrequency(frequency)
+        self.buffer = numpy.zeros(0)
+        self.noise = None # dB
+        self.signal = None # dB
+        self.tail = numpy.zeros(1, bool) # last raw bits, for the majority filter across chunks
+
+    @property
+    def bitsPerSecond(self):
+        return float(self.sampleRate) / self.blockSize
+
+    def setFrequency(self, frequency):
+        assert 0 < frequency < self.sampleRate / 2, "Bad frequency: %r" % frequency
+        self.frequency = frequency
+        self.kernel = numpy.exp(-2j * numpy.pi * frequency * numpy.arange(self.blockSize) / self.sampleRate)
+
+    def findFrequency(self, samples): # spectrum peak within FREQUENCY_RANGE, None if there is no clear peak
+        spectrum = numpy.abs(numpy.fft.rfft(samples * numpy.hanning(len(samples))))
+        frequencies = numpy.fft.rfftfreq(len(samples), 1.0 / self.sampleRate)
+        (low, high) = FREQUENCY_RANGE
+        band = (frequencies >= low) & (frequencies <= min(high, self.sampleRate / 2.0))
+        peak = numpy.argmax(spectrum[band])
+        if spectrum[band][peak] <= 10 ** (MIN_PEAK_SNR / 20.0) * numpy.median(spectrum[band]):
+            return None
+        return float(frequencies[band][peak])
+
+    def levels(self, samples): # tone level of every block, dB
+        blocks = samples[:len(samples) // self.blockSize * self.blockSize].reshape(-1, self.blockSize)
+        return 20 * numpy.log10(numpy.abs(blocks.dot(self.kernel)) + 1e-9)
+
+    def threshold(self, levels): # level above which blocks are marks, None if no signal has been seen yet
+        noise = numpy.percentile(levels, NOISE_PERCENTILE)
+        self.noise = noise if self.noise is None else self.noise + LEVEL_ALPHA * (noise - self.noise)
+        signal = numpy.percentile(levels, SIGNAL_PERCENTILE)
+        if signal - self.noise > MIN_SNR: # otherwise the chunk is just noise
+            self.signal = signal if self.signal is None else self.signal + LEVEL_ALPHA * (signal - self.signal)
+        return None if self.signal is None else (self.noise + self.signal) / 2
+
+    def process(self, samples): # bits for complete chunks, the last bit is delayed until the next chunk
+        if self.frequency is None:
+            frequency = self.findFrequency(samples)
+            if frequency is not None:
+                self.setFrequency(frequency)
+        if self.frequency is None: # no tone yet
+            raw = numpy.zeros(len(samples) // self.blockSize, bool)
+        else:
+            levels = self.levels(samples)
+            threshold = self.threshold(levels)
+            raw = levels > threshold if threshold is not None else numpy.zeros(len(levels), bool)
+        extended = numpy.concatenate((self.tail, raw))
+        self.tail = extended[-2:]
+        bits = (extended[:-2].astype(int) + extended[1:-1] + extended[2:]) >= 2 # majority of three
+        return ''.join(numpy.where(bits, DIT, PAUSE))
+
+    def feed(self, samples): # samples are any sequence of numbers, returns bits for the audio received so far
+        self.buffer = numpy.concatenate((self.buffer, numpy.asarray(samples, float)))
+        ret = []
+        while len(self.buffer) >= self.chunkSize:
+            ret.append(self.process(self.buffer[:self.chunkSize]))
+            self.buffer = self.buffer[self.chunkSize:]
+        return ''.join(ret)
+
+    def flush(self): # bits for the rest of the audio
+        ret = self.process(self.buffer) if len(self.buffer) >= self.blockSize else ''
+        self.buffer = numpy.zeros(0)
+        if len(self.tail) > 1: # the last block, followed by a pause
+            ret += DIT if self.tail[0] and self.tail[1] else PAUSE
+        self.tail = numpy.zeros(1, bool)
+        return ret
+
+def readWav(fileName, chunkTime = CHUNK_TIME): # yields (sampleRate, samples) in chunks, channels are mixed
+    with waveOpen(fileName, 'rb') as f:
+        (numChannels, sampleWidth, sampleRate) = (f.getnchannels(), f.getsampwidth(), f.getframerate())
+        assert sampleWidth in (1, 2, 4), "Unsupported sample width: %d" % sampleWidth
+        dtype = {1: 'u1', 2: '<i2', 4: '<i4'}[sampleWidth]
+        while True:
+            data = f.readframes(int(chunkTime * sampleRate))
+            if not data:
+                break
+            samples = numpy.frombuffer(data, dtype).astype(float)
+            if sampleWidth == 1:
+                samples -= 128
+            yield (sampleRate, samples.reshape(-1, numChannels).mean(axis = 1))
+
+def wavToBits(fileName, frequency = None, blockTime = BLOCK_TIME): # returns (bits, ToneDetector)
+    detector = None
+    ret = []
+    for (sampleRate, samples) in readWav(fileName):
+        if detector is None:
+            detector = ToneDetector(sampleRate, frequency, blockTime)
+        ret.append(detector.feed(samples))
+    if detector is None:
+        return ('', None)
+    ret.append(detector.flush())
+    return (''.join(ret), detector)
+
+class ToneDetectorTest(TestCase):
+    def setUp(self):
+        from MorseAudio import ToneGenerator
+        self.morse = Morse()
+        self.generator = ToneGenerator(18, 700, 8000, 0.5)
+        self.chars = 'ПРИВЕТ ТЕЛЕГРАФ, ПРИЕМ'
+        self.bits = self.morse.charsToBits(self.chars, wrapForTransmission = True)
+
+    def samples(self, noise = 0, leadIn = 4000):
+        samples = numpy.concatenate([numpy.zeros(leadIn)] + [numpy.asarray(chunk, float) for chunk in self.generator.samples(self.bits)] + [numpy.zeros(4000)])
+        if noise:
+            samples += numpy.random.RandomState(1).normal(0, noise, len(samples))
+        return samples
+
+    def decode(self, bits):
+        return self.morse.triplesToChars(self.morse.bitsToTriples(bits), True, True)
+
+    def testDetection(self):
+        samples = self.samples(4000) # SNR about 0 dB in the whole band
+        detector = ToneDetector(8000)
+        bits = ''.join(detector.feed(samples[i:i + 3000]) for i in range(0, len(samples), 3000)) + detector.flush()
+        self.assertAlmostEqual(detector.frequency, 700, -1)
+        self.assertEqual(len(bits), len(samples) // 80)
+        self.assertEqual(self.decode(bits), self.chars)
+
+    def testLeadIn(self): # the frequency is not taken from chunks with noise only
+        for noise in (0, 4000):
+            samples = self.samples(noise, 20000) # 2.5 seconds
+            detector = ToneDetector(8000)
+            bits = detector.feed(samples) + detector.flush()
+            self.assertAlmostEqual(detector.frequency, 700, -1)
+            self.assertEqual(len(bits), len(samples) // 80)
+            self.assertEqual(self.decode(bits), self.chars)
+        detector = ToneDetector(8000)
+        self.assertEqual(detector.feed(numpy.random.RandomState(2).normal(0, 1000, 16000)) + detector.flush(), PAUSE * 200)
+        self.assertIsNone(detector.frequency)
+
+    def testWav(self):
+        from os.path import join
+        from tempfile import TemporaryDirectory
+        with TemporaryDirectory() as dirName:
+            fileName = join(dirName, 'test.wav')
+            self.generator.writeWav(fileName, self.bits)
+            (bits, detector) = wavToBits(fileName, 700)
+            self.assertEqual(detector.bitsPerSecond, 100)
+            self.assertEqual(self.decode(bits), self.chars)
+            (bits, detector) = wavToBits(fileName)
+            self.assertEqual(self.decode(bits), self.chars)
+
+def decodeFiles(args):
+    frequency = None
+    (options, fileNames) = getopt(args, 'f:', ('frequency=',))
+    for (option, value) in options:
+        if option in ('-f', '--frequency'):
+            frequency = float(value)
+    morse = Morse()
+    for fileName in fileNames:
+        (bits, _detector) = wavToBits(fileName, frequency)
+        print('%s: %s' % (fileName, morse.triplesToChars(morse.bitsToTriples(bits), True, True)))
+
+if __name__ == '__main__':
+    if len(argv) > 1:
+        decodeFiles(argv[1:])
+    else:
+        main()
@@ -2,18 +2,23 @@
 #
 # Morse Control widget definitions
 #
+from array import array
+from bisect import bisect_right
 from datetime import datetime
 from re import compile as reCompile
 
 try:
-    from PyQt5 import uic
-    from PyQt5.QtCore import Qt, QMimeData, QObjectCleanupHandler, QTimer
-    from PyQt5.QtGui import QFontMetrics, QTextCursor
-    from PyQt5.QtWidgets import QFrame, QGridLayout, QLabel, QLineEdit, QMessageBox, QPlainTextEdit, QScrollArea
+    from PyQt5.QtCore import Qt, QAbstractListModel, QMimeData, QModelIndex, QPersistentModelIndex, QRect, QSize, QTimer
+    from PyQt5.QtGui import QFont, QFontMetrics, QPainter, QPalette, QTextCursor
+    from PyQt5.QtWidgets import QApplication, QFrame, QLineEdit, QListView, QMessageBox, QPlainTextEdit, QWidget
 except ImportError as ex:
     raise ImportError("%s: %s\n\nPlease install PyQt5 v5.2.1 or later: http://riverbankcomputing.com/software/pyqt/download5\n" % (ex.__class__.__name__, ex))
 
-from Morse import Morse
+from Morse import Morse, Triples, ditsToSeconds
+from DecodeCache import DecodeCache
+from UICompiler import loadUi
+from UARTTextCommands import MORSE_TX_BITS_PER_DIT
+from MorseMessages import MessageRecord, OUTGOING, SENT, RECEIVED, EDIT, DISPLAY_DATETIME_FORMAT
 
 def fixWidgetSize(widget, adjustment = 1):
     widget.setFixedWidth(widget.fontMetrics().boundingRect(widget.text()).width() * adjustment) # This is a bad hack, but there's no better idea
@@ -22,10 +27,6 @@ def setTip(widget, tip):
     widget.setToolTip(tip)
     widget.setStatusTip(tip)
 
-def widgets(layout, headerSize = 0, tailSize = 0): # generator
-    for i in range(headerSize, layout.count() - tailSize):
-        yield layout.itemAt(i).widget()
-
 class YesNoMessageBox(QMessageBox):
     def __init__(self, title, text, parent):
         QMessageBox.__init__(self, QMessageBox.Question, title, text, QMessageBox.Yes | QMessageBox.No, parent)
@@ -42,56 +43,91 @@ class ConsoleEdit(QLineEdit):
         self.clear()
         return ret
 
-class VerticalScrollArea(QScrollArea):
-    def __init__(self, parent = None):
-        super().__init__(parent)
-        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
-        self.scrollBarSet = False
-
-    def resizeEvent(self, event):
-        if not self.scrollBarSet:
-            self.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
-            self.scrollBarSet = True
-        self.setMinimumWidth(self.widget().sizeHint().width() + self.verticalScrollBar().width())
-        QScrollArea.resizeEvent(self, event)
-
-class BitsGridLayout(QGridLayout):
-    def __init__(self, parent):
-        QGridLayout.__init__(self, parent)
-        self.setContentsMargins(0, 0, 0, 0)
-        self.setSpacing(0)
-
-class MorseLabel(QLabel):
-    def __init__(self, parent, text = ''):
-        super().__init__(text, parent)
-        self.setAlignment(Qt.AlignHCenter)
-
-class BitsLabel(MorseLabel):
+class TriplesWidget(QWidget):
     BIT_CHARS = {'0': ' ', '1': '-'}
-    STYLE_SHEET = '''
-        background-color: white;
-        border-top: 1px solid;
-        border-bottom: 1px solid;
-        font-weight: bold;
-        font-family: Courier New, Courier, monospace
-    '''
-    def __init__(self, parent, bits = '', first = False, last = False):
-        super().__init__(parent, ''.join(self.BIT_CHARS[c] for c in bits) or ' ')
-        self.setStyleSheet(self.STYLE_SHEET + ('; border-left: 1px solid' if first else '') + ('; border-right: 1px solid' if last else ''))
-        font = self.font()
-        font.setBold(True)
-        font.setStretch(80)
-        font.setLetterSpacing(font.PercentageSpacing, 50)
-        self.setFont(font)
-
-class CodeLabel(MorseLabel):
     CODE_CHARS = {'.': '·', '-': '−'}
-    def __init__(self, parent, code = ''):
-        super().__init__(parent, ' '.join(self.CODE_CHARS.get(c, '') for c in code))
-        self.setStyleSheet('font-weight: bold')
+    BITS_FONT_FAMILY = 'Courier New'
+    PADDING = 2
+    textWidths = {} # (row, text) -> width, shared by all instances as all of them use the same fonts
 
-class CharLabel(MorseLabel):
-    pass
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.charFont = QFont(self.font())
+        self.codeFont = QFont(self.font())
+        self.codeFont.setBold(True)
+        self.bitsFont = QFont(self.codeFont)
+        self.bitsFont.setFamily(self.BITS_FONT_FAMILY)
+        self.bitsFont.setStyleHint(QFont.Monospace)
+        self.bitsFont.setStretch(80)
+        self.bitsFont.setLetterSpacing(QFont.PercentageSpacing, 50)
+        self.metrics = tuple(QFontMetrics(font) for font in (self.bitsFont, self.codeFont, self.charFont))
+        self.bitWidth = self.metrics[0].width(self.BIT_CHARS['1'])
+        self.rowHeight = max(metrics.height() for metrics in self.metrics) + self.PADDING
+        self.edgeWidth = self.bitWidth + self.PADDING
+        self.triples = Triples()
+        self.columns = [] # ((bitsText, codeText, charText), width) per triple
+        self.offsets = array('i', (self.edgeWidth,)) # left edge of every column plus right edge of the last one
+        self.setMinimumSize(2 * self.edgeWidth, 3 * self.rowHeight)
+
+    def textWidth(self, row, text):
+        key = (row, text)
+        width = self.textWidths.get(key)
+        if width is None:
+            width = self.textWidths[key] = self.metrics[row].width(text)
+        return width
+
+    def column(self, triple):
+        (bits, code, char) = triple
+        texts = (''.join(self.BIT_CHARS[c] for c in bits), ' '.join(self.CODE_CHARS.get(c, '') for c in code), char)
+        width = max(len(texts[0]) * self.bitWidth, self.textWidth(1, texts[1]), self.textWidth(2, texts[2])) + self.PADDING
+        return (texts, width)
+
+    def setTriples(self, triples): # only the columns between the common head and tail of the old and new triples are rebuilt
+        triples = triples if isinstance(triples, Triples) else Triples(triples)
+        old = self.triples
+        (oldLength, newLength) = (len(old), len(triples))
+        limit = min(oldLength, newLength)
+        start = 0
+        while start < limit and old[start] == triples[start]:
+            start += 1
+        if start == oldLength == newLength:
+            return
+        limit -= start
+        tail = 0
+        while tail < limit and old[oldLength - tail - 1] == triples[newLength - tail - 1]:
+            tail += 1
+        self.triples = triples
+        self.columns[start:oldLength - tail] = [self.column(triple) for triple in triples[start:newLength - tail]]
+        offsets = self.offsets
+        (oldEdge, oldRight) = (offsets[oldLength - tail], offsets[-1])
+        del offsets[start + 1:]
+        for (_texts, width) in self.columns[start:]:
+            offsets.append(offsets[-1] + width)
+        left = offsets[start]
+        if offsets[-1] != oldRight:
+            self.setMinimumSize(offsets[-1] + self.edgeWidth, 3 * self.rowHeight)
+            self.updateGeometry()
+        right = offsets[newLength - tail] if offsets[newLength - tail] == oldEdge else self.width() # the tail columns have moved
+        self.update(QRect(left, 0, right - left, 3 * self.rowHeight))
+
+    def sizeHint(self):
+        return self.minimumSize()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        rect = event.rect()
+        width = self.width()
+        bitsRect = QRect(0, 0, width, self.rowHeight)
+        painter.fillRect(bitsRect.intersected(rect), Qt.white)
+        painter.drawRect(bitsRect.adjusted(0, 0, -1, -1))
+        first = max(0, bisect_right(self.offsets, rect.left()) - 1)
+        last = min(len(self.columns), bisect_right(self.offsets, rect.right()))
+        for (row, font) in enumerate((self.bitsFont, self.codeFont, self.charFont)):
+            painter.setFont(font)
+            y = row * self.rowHeight
+            for i in range(first, last):
+                x = self.offsets[i]
+                painter.drawText(QRect(x, y, self.offsets[i + 1] - x, self.rowHeight), Qt.AlignHCenter | Qt.AlignVCenter, self.columns[i][0][row])
 
 class MessageTextEdit(QPlainTextEdit):
     ALLOWED_CHARACTERS = ' \n\r\x08\x7f' # Space, Enter, Backspace, Del
@@ -132,73 +168,26 @@ class MessageTextEdit(QPlainTextEdit):
             self.callback(self.toPlainText()) # pylint: disable=E1102
 
 class MessageFrame(QFrame):
-    HEAD_SIZE = 0
-    TAIL_SIZE = 1
-    STORE_DATETIME_FORMAT = '%Y%m%d-%H%M%S'
-    DISPLAY_DATETIME_FORMAT = '%A %d %B %Y, %H:%M:%S'
-    OUTGOING = 0
-    SENT = 1
-    RECEIVED = 2
-    EDIT = 3
-    STATE_MARKS = '!><$'
-    SPLITTER = reCompile(r'\s*\n\s*')
     SPACE_CUTTER = reCompile(r'\s+')
-    stateTexts = []
 
     @classmethod
-    def configure(cls, uiFile, parentWidget, sendCallback, printCallback):
+    def configure(cls, uiFile, history, sendCallback, printCallback, decodeCacheFileName = None, adaptive = False):
         cls.uiFile = uiFile
-        cls.parentWidget = parentWidget
-        cls.parentLayout = parentWidget.layout()
+        cls.history = history
         cls.sendCallback = sendCallback
         cls.printCallback = printCallback
         cls.isConnected = False
         cls.morse = Morse()
+        cls.decodeCache = DecodeCache(cls.morse, decodeCacheFileName, adaptive = adaptive) # the text and the triples of a received message come from the same decoding
         MessageTextEdit.configure(cls.morse)
 
-    @staticmethod
-    def streamReader(stream): # generator
-        for line in stream:
-            line = line.strip()
-            if not line.startswith('#'):
-                yield line
-
-    def __init__(self, arg = None):
-        super().__init__(self.parentWidget)
-        self.savedText = None
-        if hasattr(arg, 'readline'):
-            reader = self.streamReader(arg)
-            line = None
-            while not line:
-                line = next(reader)
-            tokens = line.split()
-            state = self.STATE_MARKS.index(tokens[0])
-            if state is self.OUTGOING:
-                assert len(tokens) == 1
-                timeStamp = None
-                text = next(reader)
-            else:
-                assert len(tokens) == 2
-                timeStamp = datetime.strptime(tokens[1], self.STORE_DATETIME_FORMAT)
-                text = next(reader)
-                bits = next(reader)
-        elif arg:
-            reader = None
-            state = self.RECEIVED
-            timeStamp = datetime.now()
-            bits = arg
-            text = None
-        else:
-            state = self.OUTGOING
-            timeStamp = None
-            text = ''
-        if text is not None:
-            text = text.replace('\\n', '\n')
-        uic.loadUi(self.uiFile, self)
+    def __init__(self, record):
+        super().__init__()
+        self.record = record
+        self.index = None # set by MessageHistoryView
+        loadUi(self.uiFile, self)
         self.textToUpdate = None
         self.textUpdateEventCounter = 0
-        if not self.stateTexts:
-            self.stateTexts.extend(label.text() for label in (self.outgoingLabel, self.sentLabel, self.receivedLabel, self.receivedLabel))
         # self.textEdit.setPlaceholderText("Вводите текст сообщения здесь") # ToDo: Add in Designer after moving to Qt 5.3+
         self.resetOutgoingButton.clicked.connect(self.resetOutgoing)
         self.sendOutgoingButton.clicked.connect(self.sendOutgoing)
@@ -208,150 +197,277 @@ class MessageFrame(QFrame):
         self.cancelReceivedButton.clicked.connect(self.cancelEdit)
         self.saveReceivedButton.clicked.connect(self.saveEdit)
         self.printButton.clicked.connect(self.printMessage)
-        self.setState(state)
-        self.setTimeStamp(timeStamp)
-        self.messageTextEdit.callback = self.updateText
+        self.setState(record.state)
+        self.setTimeStamp(record.timeStamp)
+        text = record.text
         self.messageTextEdit.setPlainText(text)
-        if state is self.OUTGOING:
-            index = self.HEAD_SIZE
+        self.messageTextEdit.callback = self.updateText
+        if record.state is OUTGOING:
+            self.updateText(text)
         else:
-            index = self.HEAD_SIZE + 1 if reader is None else self.parentLayout.count() - self.TAIL_SIZE
-            self.bits = bits
-            self.updateTriples(self.morse.bitsToTriples(bits), text is None)
-        self.parentLayout.insertWidget(index, self)
-        self.parentLayout.setStretch(index, 0)
-        self.parentLayout.setStretch(self.parentLayout.count() - self.TAIL_SIZE, 1)
-        if state is self.OUTGOING:
-            self.messageTextEdit.setFocus()
-            self.messageTextEdit.moveCursor(QTextCursor.End)
+            self.updateTriples(self.decodeCache.bitsToTriples(record.bits))
+            self.updateText(text)
 
     def setState(self, state):
-        self.state = state
+        self.state = self.record.state = state
         self.stateStackedWidget.setCurrentIndex(state)
         self.controlStackedWidget.setCurrentIndex(state)
-        self.messageTextEdit.setReadOnly(state in (self.SENT, self.RECEIVED))
+        self.messageTextEdit.setReadOnly(state in (SENT, RECEIVED))
         self.messageTextEdit.updateSize()
 
     def setTimeStamp(self, timeStamp):
-        self.timeStamp = timeStamp
-        self.timeLabel.setText(timeStamp.strftime(self.DISPLAY_DATETIME_FORMAT) if timeStamp else '')
-
-    def addToken(self, bits = '', code = '', char = '', first = False, last = False):
-        c = self.bitsGridLayout.columnCount()
-        self.bitsGridLayout.addWidget(BitsLabel(self, bits, first, last), 0, c)
-        self.bitsGridLayout.addWidget(CodeLabel(self, code), 1, c)
-        self.bitsGridLayout.addWidget(CharLabel(self, char), 2, c)
-        self.bitsGridLayout.setColumnStretch(c, last)
-
-    def updateTriples(self, triples, saveText = False):
-        for widget in self.bitsWidget.findChildren(QLabel):
-            widget.setParent(None)
-        QObjectCleanupHandler().add(self.bitsGridLayout) # pylint: disable=E0203
-        self.bitsGridLayout = BitsGridLayout(self.bitsWidget)
-        self.addToken(first = True)
-        for (bits, code, char) in triples:
-            self.addToken(bits, code, char)
-        self.addToken(last = True)
-        self.bitsWidget.setLayout(self.bitsGridLayout)
-        if saveText:
-            self.messageTextEdit.setPlainText(self.morse.triplesToChars(triples, True, True))
+        self.timeStamp = self.record.timeStamp = timeStamp
+        self.timeLabel.setText(timeStamp.strftime(DISPLAY_DATETIME_FORMAT) if timeStamp else '')
+
+    def updateTriples(self, triples):
+        self.bitsWidget.setTriples(triples)
 
     def updateText(self, text):
-        if self.state is self.OUTGOING:
+        if self.state is OUTGOING:
+            self.record.text = text
             self.sendOutgoingButton.setDisabled(not text or not self.isConnected)
             self.resetOutgoingButton.setDisabled(not text)
             self.printButton.setDisabled(not text or not self.isConnected)
+            self.timeLabel.setText(self.airtimeText(text))
             self.textToUpdate = text
             self.textUpdateEventCounter += 1
             QTimer.singleShot(0, self.doUpdateText)
         else:
             self.printButton.setDisabled(not self.isConnected)
-            if self.state is self.EDIT:
-                self.saveReceivedButton.setDisabled(text == self.savedText)
+            if self.state is EDIT:
+                self.record.text = text
+                self.saveReceivedButton.setDisabled(text == self.record.savedText)
+        self.history.frameResized(self)
+
+    def airtimeText(self, text): # estimated transmission time, instead of the time stamp that outgoing messages don't have yet
+        seconds = int(round(ditsToSeconds(self.morse.airtime(text, defaultCode = ''))))
+        return "≈ %d:%02d" % divmod(seconds, 60) if text.strip() else ''
 
     def doUpdateText(self):
         self.textUpdateEventCounter -= 1
         if self.textUpdateEventCounter == 0:
             triples = self.morse.charsToTriples(self.SPACE_CUTTER.sub(' ', self.textToUpdate.strip().replace('\n', ' = ')))
-            self.bits = ''.join(t[0] for t in triples)
+            self.record.bits = triples.bits
             self.updateTriples(triples)
 
-    def dataStr(self):
-        state = self.RECEIVED if self.state is self.EDIT else self.state
-        text = '\\n'.join(self.messageTextEdit.toPlainText().splitlines())
-        stateMark = self.STATE_MARKS[state]
-        if state is self.OUTGOING:
-            return ('\n%s\n%s\n' % (stateMark, text)) if text else ''
-        else:
-            return '\n%s\n%s\n%s\n' % (' '.join((stateMark, self.timeStamp.strftime(self.STORE_DATETIME_FORMAT))), text, self.bits)
-
-    def textStr(self):
-        stateText = self.stateTexts[self.state]
-        text = self.messageTextEdit.toPlainText()
-        if self.state is self.OUTGOING:
-            return ('\n%s\n%s\n' % (stateText, text)) if text else ''
-        else:
-            return '\n%s\n%s\n' % (' '.join((stateText, self.timeStamp.strftime(self.DISPLAY_DATETIME_FORMAT))), text)
-
-    @classmethod
-    def setConnected(cls, isConnected):
-        cls.isConnected = isConnected
-        for widget in widgets(cls.parentLayout, cls.HEAD_SIZE, cls.TAIL_SIZE):
-            widget.messageTextEdit.updateSize()
-
-    @classmethod
-    def hasUnsaved(cls):
-        return bool(next(widgets(cls.parentLayout, cls.HEAD_SIZE, cls.TAIL_SIZE)).messageTextEdit.toPlainText().strip())
-
-    @classmethod
-    def writeData(cls, dataFile, textFile):
-        dataFile.write('# MorseControl data file')
-        textFile.write('# MorseControl text file')
-        for widget in widgets(cls.parentLayout, cls.HEAD_SIZE, cls.TAIL_SIZE):
-            dataFile.write(widget.dataStr())
-            textFile.write(widget.textStr())
-
-    @classmethod
-    def readData(cls, dataFile):
-        for widget in widgets(cls.parentLayout, cls.HEAD_SIZE, cls.TAIL_SIZE):
-            widget.setParent(None)
-        if dataFile:
-            try:
-                while True:
-                    MessageFrame(dataFile)
-            except StopIteration:
-                pass
-        if cls.parentLayout.count() <= cls.HEAD_SIZE + cls.TAIL_SIZE or cls.parentLayout.itemAt(0).widget().state is not cls.OUTGOING:
-            MessageFrame()
+    def isBusy(self): # must not be destroyed when scrolled out of view
+        return self.state is EDIT or self.isAncestorOf(QApplication.focusWidget())
 
     def resetOutgoing(self):
         self.messageTextEdit.clear()
         self.messageTextEdit.setFocus()
 
     def sendOutgoing(self):
-        self.sendCallback(self.morse.charsToBits(self.messageTextEdit.toPlainText(), True))
-        self.setState(self.SENT)
+        self.sendCallback(self.morse.charsToBits(self.messageTextEdit.toPlainText(), MORSE_TX_BITS_PER_DIT))
+        self.setState(SENT)
         self.setTimeStamp(datetime.now())
-        MessageFrame()
+        self.history.store.put(self.record)
+        self.history.addOutgoing()
 
     def printMessage(self):
-        self.printCallback(self.morse.charsToBits(self.messageTextEdit.toPlainText(), True))
+        self.printCallback(self.morse.charsToBits(self.messageTextEdit.toPlainText(), MORSE_TX_BITS_PER_DIT))
 
     def deleteSaved(self):
         messageBox = YesNoMessageBox("Удалить телеграмму?", "Вы уверены, что хотите удалить данную телеграмму?", self)
         if messageBox.exec_() == messageBox.Yes:
-            self.setParent(None)
+            self.history.removeRecord(self.record)
 
     def editReceived(self):
-        self.savedText = self.messageTextEdit.toPlainText()
-        self.setState(self.EDIT)
+        self.record.savedText = self.messageTextEdit.toPlainText()
+        self.setState(EDIT)
         self.messageTextEdit.setFocus()
 
     def cancelEdit(self):
-        self.messageTextEdit.setPlainText(self.savedText)
-        self.savedText = None
-        self.setState(self.RECEIVED)
+        self.messageTextEdit.setPlainText(self.record.savedText)
+        self.record.text = self.record.savedText
+        self.record.savedText = None
+        self.setState(RECEIVED)
 
     def saveEdit(self):
-        self.savedText = None
-        self.setState(self.RECEIVED)
+        self.record.savedText = None
+        self.setState(RECEIVED)
+        self.history.store.put(self.record)
+
+class MessageHistoryModel(QAbstractListModel):
+    DEFAULT_HEIGHT = 150
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.allRecords = []
+        self.records = [] # the ones matching the filter
+        self.filter = None # keys of the records to show
+        self.defaultHeight = None
+
+    def rowCount(self, parent = QModelIndex()):
+        return 0 if parent.isValid() else len(self.records)
+
+    def height(self, record):
+        return record.height or self.defaultHeight or self.DEFAULT_HEIGHT
+
+    def data(self, index, role = Qt.DisplayRole):
+        if role == Qt.SizeHintRole and index.isValid():
+            return QSize(0, self.height(self.records[index.row()]))
+        return None
+
+    def matches(self, record):
+        return self.filter is None or record.state is OUTGOING or record.key in self.filter
+
+    def insertRecord(self, row, record): # new records are inserted at the top, and are shown regardless of the filter
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.records.insert(row, record)
+        self.allRecords.insert(row, record)
+        self.endInsertRows()
+
+    def removeRow(self, row, parent = QModelIndex()):
+        self.beginRemoveRows(parent, row, row)
+        self.allRecords.remove(self.records.pop(row))
+        self.endRemoveRows()
+        return True
+
+    def setRecords(self, records):
+        self.beginResetModel()
+        self.allRecords = records
+        self.records = list(records)
+        self.filter = None
+        self.endResetModel()
+
+    def setFilter(self, keys):
+        self.beginResetModel()
+        self.filter = keys
+        self.records = [record for record in self.allRecords if self.matches(record)] if keys is not None else list(self.allRecords)
+        self.endResetModel()
+
+class MessageHistoryView(QListView):
+    SPACING = 4
+    OVERSCAN = 2 # number of messages to keep built beyond the visible area
+
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.setVerticalScrollMode(self.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setSelectionMode(self.NoSelection)
+        self.setResizeMode(self.Adjust)
+        self.setSpacing(self.SPACING)
+        self.viewport().setBackgroundRole(QPalette.Window)
+        self.frames = {} # MessageRecord -> MessageFrame
+        self.store = None
+        self.setModel(MessageHistoryModel(self))
+        self.verticalScrollBar().valueChanged.connect(self.updateFrames)
+
+    def records(self):
+        return self.model().records
+
+    def visibleRow(self, y): # the first row with its bottom below y, by binary search
+        (lo, hi) = (0, self.model().rowCount())
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.visualRect(self.model().index(mid)).bottom() < y:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def updateGeometries(self):
+        super().updateGeometries()
+        self.updateFrames()
+
+    def updateFrames(self):
+        model = self.model()
+        if not model or not model.records:
+            return
+        first = max(0, self.visibleRow(0) - self.OVERSCAN)
+        last = min(model.rowCount(), self.visibleRow(self.viewport().height()) + self.OVERSCAN + 1)
+        wanted = model.records[first:last]
+        wantedSet = set(wanted)
+        for (record, frame) in tuple(self.frames.items()):
+            if record not in wantedSet and not frame.isBusy():
+                self.dropFrame(record)
+        for (row, record) in enumerate(wanted, first):
+            frame = self.frames.get(record)
+            if not frame:
+                frame = self.frames[record] = MessageFrame(self.store.load(record))
+                frame.index = QPersistentModelIndex(model.index(row))
+                frame.setParent(self.viewport()) # not using setIndexWidget() as it relayouts all the items every time
+                frame.show()
+                self.frameResized(frame)
+        for frame in self.frames.values():
+            frame.setGeometry(self.visualRect(QModelIndex(frame.index)))
+
+    def dropFrame(self, record):
+        frame = self.frames.pop(record)
+        frame.hide()
+        frame.deleteLater()
+        self.store.unload(record)
+        return frame
+
+    def frameResized(self, frame):
+        if frame.index is None or not frame.index.isValid():
+            return
+        model = self.model()
+        height = frame.sizeHint().height()
+        if height != model.height(frame.record):
+            if model.defaultHeight is None and frame.state is not OUTGOING:
+                model.defaultHeight = height
+            self.setMinimumWidth(max(self.minimumWidth(), frame.sizeHint().width() + self.verticalScrollBar().sizeHint().width() + 2 * self.SPACING))
+            self.scheduleDelayedItemsLayout()
+        frame.record.height = height
+
+    def addOutgoing(self):
+        self.model().insertRecord(0, MessageRecord(OUTGOING))
+        self.focusOutgoing()
+
+    def focusOutgoing(self):
+        self.scrollToTop()
+        self.updateFrames()
+        textEdit = self.frames[self.records()[0]].messageTextEdit
+        textEdit.setFocus()
+        textEdit.moveCursor(QTextCursor.End)
+
+    def addReceived(self, bits, profile = None): # profile is the timing profile of the line, for the adaptive decoder
+        record = MessageRecord(RECEIVED, datetime.now(), '', bits)
+        record.text = MessageFrame.morse.triplesToChars(MessageFrame.decodeCache.bitsToTriples(bits, profile), True, True)
+        self.model().insertRecord(1, record)
+        self.store.put(record)
+
+    def removeRecord(self, record):
+        row = self.dropFrame(record).index.row() if record in self.frames else self.records().index(record)
+        self.model().removeRow(row)
+        self.store.delete(record)
+
+    def setConnected(self, isConnected):
+        MessageFrame.isConnected = isConnected
+        for frame in self.frames.values():
+            frame.messageTextEdit.updateSize()
+
+    def hasUnsaved(self):
+        return bool(self.records()[0].text.strip())
+
+    def saveOutgoing(self):
+        record = self.records()[0]
+        if record.text.strip():
+            self.store.put(record)
+        else:
+            self.store.delete(record)
+
+    def setSearch(self, query, states = None): # busy frames are kept, and their messages stay shown regardless of the filter
+        busy = set(record for (record, frame) in self.frames.items() if frame.isBusy())
+        for record in tuple(self.frames):
+            if record not in busy:
+                self.dropFrame(record)
+        keys = self.store.search(query, states) if query.strip() or states else None
+        model = self.model()
+        model.setFilter(keys if keys is None else keys | set(record.key for record in busy))
+        for (row, record) in enumerate(model.records):
+            if record in busy:
+                self.frames[record].index = QPersistentModelIndex(model.index(row))
+        self.scrollToTop()
+
+    def setStore(self, store):
+        for record in tuple(self.frames):
+            self.dropFrame(record)
+        self.store = store
+        records = store.records()
+        if not records or records[0].state is not OUTGOING:
+            records.insert(0, MessageRecord(OUTGOING))
+        self.model().setRecords(records)
+        self.focusOutgoing()
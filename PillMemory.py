@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+#
+# Pill memory bulk read/write engine
+#
+# Usage: python3 PillMemory.py [options] dump fileName address numWords
+#        python3 PillMemory.py [options] program fileName address
+#
+# Options: -c|--checkpoint fileName  - resume from/save progress to the specified file
+#          -n|--no-verify            - don't read back programmed data
+#          -r|--repeat               - use pillRepeatWrite32 instead of pillWrite32
+#          -w|--window N             - number of requests in flight
+#          -v|--verbose              - log serial traffic
+#
+# Addresses are counted in 32-bit words.
+# Replies carry no address, so they are matched to the requests in order,
+# any timeout or failure makes the engine go back to the oldest unconfirmed chunk.
+# Read requests in flight all have different sizes, so a lost request
+# shows up as a size mismatch instead of data being stored at a wrong address.
+# Lost writes are caught by the read-back verification.
+#
+from collections import deque
+from getopt import getopt
+from struct import pack, unpack
+from sys import argv, exit # pylint: disable=W0622
+from threading import Condition
+from time import time
+from unittest import main as testMain, TestCase
+
+from UARTTextProtocol import MAX_COMMAND_ARGS, INT_LIMIT
+from UARTTextCommands import ackResponse, pillData32Response, pillRead32Command, pillRepeatWrite32Command, pillWrite32Command, UART_STATUS_OK
+
+WORD_SIZE = 4
+CHUNK_WORDS = MAX_COMMAND_ARGS - 1 # pillWrite32 takes address and words
+WINDOW = 8
+TIMEOUT = 2
+MAX_RETRIES = 5
+
+DATA = 'data'
+ACK = 'ack'
+
+def wordsToBytes(words):
+    return pack('<%dI' % len(words), *(word % INT_LIMIT for word in words))
+
+def bytesToWords(data):
+    data = bytes(data) + bytes(-len(data) % WORD_SIZE)
+    return unpack('<%dI' % (len(data) // WORD_SIZE), data)
+
+class Chunk(object):
+    __slots__ = ('address', 'count', 'words', 'tries')
+
+    def __init__(self, address, count, words = None):
+        self.address = address
+        self.count = count
+        self.words = words
+        self.tries = 0
+
+class Checkpoint(object):
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.chunks = {}
+        try:
+            with open(fileName) as f:
+                for line in f:
+                    words = tuple(int(word) for word in line.split())
+                    if words:
+                        self.chunks[words[0]] = words[1:]
+        except OSError:
+            pass
+        self.file = open(fileName, 'a')
+
+    def get(self, address):
+        return self.chunks.get(address)
+
+    def add(self, address, words):
+        self.chunks[address] = words
+        self.file.write('%d %s\n' % (address, ' '.join(str(word) for word in words)))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class PillEngine(object):
+    def __init__(self, write, window = WINDOW, chunkWords = CHUNK_WORDS, timeout = TIMEOUT, maxRetries = MAX_RETRIES, progressCallback = None, clock = time):
+        self.write = write
+        self.window = window
+        self.chunkWords = chunkWords
+        self.timeout = timeout
+        self.maxRetries = maxRetries
+        self.progressCallback = progressCallback
+        self.clock = clock
+        self.condition = Condition()
+        self.replies = deque()
+        self.connected = True
+        self.bytesPerSecond = 0
+
+    def subscribe(self, dispatcher):
+        dispatcher.subscribe(pillData32Response, self.onData, True)
+        dispatcher.subscribe(ackResponse, self.onAck, True)
+
+    def reply(self, kind, value):
+        with self.condition:
+            self.replies.append((kind, value))
+            self.condition.notify()
+
+    def onData(self, words):
+        self.reply(DATA, words)
+
+    def onAck(self, status):
+        self.reply(ACK, status)
+
+    def setConnected(self, connected):
+        with self.condition:
+            self.connected = connected
+            self.replies.clear()
+            self.condition.notify()
+
+    def chunks(self, address, numWords, words = None, stagger = False):
+        offset = 0
+        index = 0
+        while offset < numWords:
+            count = min(max(1, self.chunkWords - (index % self.window if stagger else 0)), numWords - offset)
+            yield Chunk(address + offset, count, words[offset:offset + count] if words is not None else None)
+            offset += count
+            index += 1
+
+    def drain(self, inFlight):
+        # Replies can't be matched to requests after a failure, so wait for the outstanding ones and drop them
+        deadline = self.clock() + self.timeout
+        while inFlight > len(self.replies) and self.connected and self.clock() < deadline:
+            self.condition.wait(deadline - self.clock())
+        self.replies.clear()
+
+    def transfer(self, chunks, request, accept):
+        todo = deque(chunks)
+        total = sum(chunk.count for chunk in todo) * WORD_SIZE
+        pending = deque() # (chunk, deadline)
+        done = 0
+        start = self.clock()
+        with self.condition:
+            while todo or pending:
+                if not self.connected:
+                    todo.extendleft(reversed(tuple(chunk for (chunk, _deadline) in pending)))
+                    pending.clear()
+                    self.condition.wait(self.timeout)
+                    continue
+                while todo and len(pending) < self.window:
+                    chunk = todo.popleft()
+                    pending.append((chunk, self.clock() + self.timeout))
+                    self.write(request(chunk))
+                failed = None
+                while self.replies and pending:
+                    (kind, value) = self.replies.popleft()
+                    (chunk, _deadline) = pending.popleft()
+                    if accept(chunk, kind, value):
+                        done += chunk.count * WORD_SIZE
+                        elapsed = self.clock() - start
+                        self.bytesPerSecond = done / elapsed if elapsed else 0
+                        if self.progressCallback:
+                            self.progressCallback(done, total, self.bytesPerSecond)
+                    else:
+                        failed = chunk
+                        break
+                if failed is None and pending and self.clock() > pending[0][1]:
+                    failed = pending.popleft()[0]
+                if failed is not None:
+                    failed.tries += 1
+                    if failed.tries > self.maxRetries:
+                        raise TimeoutError("Pill memory transfer failed at address %d after %d retries" % (failed.address, self.maxRetries))
+                    self.drain(len(pending))
+                    todo.extendleft(reversed((failed,) + tuple(chunk for (chunk, _deadline) in pending)))
+                    pending.clear()
+                elif pending and not self.replies:
+                    self.condition.wait(max(0, pending[0][1] - self.clock()))
+
+    def readWords(self, address, numWords, checkpoint = None):
+        result = {}
+        chunks = []
+        for chunk in self.chunks(address, numWords, stagger = True):
+            words = checkpoint.get(chunk.address) if checkpoint else None
+            if words is not None and len(words) == chunk.count:
+                result[chunk.address] = words
+            else:
+                chunks.append(chunk)
+        def accept(chunk, kind, words):
+            if kind != DATA or len(words) != chunk.count:
+                return False
+            words = tuple(word % INT_LIMIT for word in words)
+            result[chunk.address] = words
+            if checkpoint:
+                checkpoint.add(chunk.address, words)
+            return True
+        self.transfer(chunks, lambda chunk: pillRead32Command.encode(chunk.address, chunk.count), accept)
+        return tuple(word for chunkAddress in sorted(result) for word in result[chunkAddress])
+
+    def writeWords(self, address, words, checkpoint = None, repeat = False):
+        words = tuple(word % INT_LIMIT for word in words)
+        command = pillRepeatWrite32Command if repeat else pillWrite32Command
+        chunks = tuple(chunk for chunk in self.chunks(address, len(words), words) if not checkpoint or checkpoint.get(chunk.address) != chunk.words)
+        def accept(chunk, kind, status):
+            if kind != ACK or status != UART_STATUS_OK:
+                return False
+            if checkpoint:
+                checkpoint.add(chunk.address, chunk.words)
+            return True
+        self.transfer(chunks, lambda chunk: command.encode(chunk.address, *chunk.words), accept)
+        return chunks
+
+    def dump(self, address, numWords, checkpoint = None):
+        return wordsToBytes(self.readWords(address, numWords, checkpoint))
+
+    def program(self, address, data, verify = True, checkpoint = None, repeat = False):
+        words = bytesToWords(data)
+        self.writeWords(address, words, checkpoint, repeat)
+        if verify:
+            for attempt in range(2):
+                readBack = self.readWords(address, len(words))
+                bad = tuple(chunk for chunk in self.chunks(address, len(words), words) if readBack[chunk.address - address:chunk.address - address + chunk.count] != chunk.words)
+                if not bad:
+                    break
+                if attempt:
+                    raise ValueError("Pill memory verification failed at address %d" % bad[0].address)
+                for chunk in bad:
+                    self.writeWords(chunk.address, chunk.words, None, repeat)
+
+class FakePill(object):
+    def __init__(self, engine, size, lost = (), corrupt = ()):
+        self.engine = engine
+        self.memory = [0] * size
+        self.lost = set(lost) # numbers of requests to ignore
+        self.corrupt = set(corrupt) # numbers of write requests to store wrong data for
+        self.requests = 0
+        self.queue = deque()
+
+    def write(self, data):
+        self.requests += 1
+        if self.requests in self.lost:
+            return
+        if data.startswith(pillRead32Command.prefix):
+            (address, count) = pillRead32Command.decode(data)
+            self.queue.append((DATA, tuple(self.memory[address:address + count])))
+        else:
+            (address, *words) = pillWrite32Command.decode(data)
+            if self.requests in self.corrupt:
+                words = [word + 1 for word in words]
+            self.memory[address:address + len(words)] = words
+            self.queue.append((ACK, UART_STATUS_OK))
+        if len(self.queue) > 2 or self.requests % 3 == 0: # deliver replies with some delay
+            while self.queue:
+                self.engine.reply(*self.queue.popleft())
+
+    def flush(self):
+        while self.queue:
+            self.engine.reply(*self.queue.popleft())
+
+class PillEngineTest(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.engine = PillEngine(self.write, 4, 10, 1, 3, clock = self.clock)
+        self.pill = FakePill(self.engine, 1000)
+        self.engine.condition.wait = lambda timeout = None: self.pill.flush()
+
+    def clock(self):
+        self.now += 0.01
+        return self.now
+
+    def write(self, data):
+        self.pill.write(data)
+
+    def testConversion(self):
+        self.assertEqual(wordsToBytes((1, -1)), b'\x01\x00\x00\x00\xff\xff\xff\xff')
+        self.assertEqual(bytesToWords(b'\x01\x00\x00\x00\xff\xff'), (1, 0xffff))
+
+    def testDumpAndProgram(self):
+        self.pill.memory[:] = range(1000)
+        self.assertEqual(self.engine.readWords(5, 95), tuple(range(5, 100)))
+        data = bytes(range(256)) * 2
+        self.engine.program(100, data)
+        self.assertEqual(self.engine.dump(100, len(data) // WORD_SIZE), data)
+        self.assertGreater(self.engine.bytesPerSecond, 0)
+
+    def testRecovery(self):
+        self.pill.memory[:] = range(1000)
+        self.pill.lost.update((2, 9))
+        self.assertEqual(self.engine.readWords(0, 200), tuple(range(200)))
+        self.pill.corrupt.add(self.pill.requests + 3)
+        self.engine.program(0, wordsToBytes(range(7, 207)))
+        self.assertEqual(self.pill.memory[:200], list(range(7, 207)))
+        self.pill.lost.update(range(self.pill.requests + 1, self.pill.requests + 100))
+        self.assertRaises(TimeoutError, self.engine.readWords, 0, 10)
+
+    def testCheckpoint(self):
+        from tempfile import TemporaryDirectory
+        from os.path import join
+        with TemporaryDirectory() as dirName:
+            fileName = join(dirName, 'checkpoint')
+            checkpoint = Checkpoint(fileName)
+            self.pill.memory[:] = range(1000)
+            self.assertEqual(self.engine.readWords(0, 100, checkpoint), tuple(range(100)))
+            checkpoint.close()
+            requests = self.pill.requests
+            checkpoint = Checkpoint(fileName)
+            self.assertEqual(self.engine.readWords(0, 120, checkpoint), tuple(range(120)))
+            self.assertEqual(self.pill.requests, requests + 3) # the last chunk was shorter
+            checkpoint.close()
+
+def main(args):
+    from logging import basicConfig, getLogger, INFO, WARNING
+    from UARTTextProtocol import CommandDispatcher
+    from UARTTextCommands import commandSet, pingCommand
+    from SerialPort import SerialPort
+    checkpointFileName = None
+    verify = True
+    repeat = False
+    window = WINDOW
+    verbose = False
+    (options, parameters) = getopt(args, 'c:nrw:v', ('checkpoint=', 'no-verify', 'repeat', 'window=', 'verbose'))
+    for (option, value) in options:
+        if option in ('-c', '--checkpoint'):
+            checkpointFileName = value
+        elif option in ('-n', '--no-verify'):
+            verify = False
+        elif option in ('-r', '--repeat'):
+            repeat = True
+        elif option in ('-w', '--window'):
+            window = int(value)
+        elif option in ('-v', '--verbose'):
+            verbose = True
+    if len(parameters) not in (3, 4) or parameters[0] not in ('dump', 'program') or (parameters[0] == 'dump') != (len(parameters) == 4):
+        print("Usage: python3 PillMemory.py [options] dump fileName address numWords\n       python3 PillMemory.py [options] program fileName address")
+        exit(2)
+    basicConfig(format = '%(asctime)s %(levelname)s\t%(message)s', level = INFO if verbose else WARNING)
+    logger = getLogger('PillMemory')
+    def progress(done, total, bytesPerSecond):
+        print("\r%d/%d bytes, %.0f bytes/s" % (done, total, bytesPerSecond), end = '', flush = True)
+    engine = PillEngine(None, window, progressCallback = progress)
+    dispatcher = CommandDispatcher(commandSet)
+    engine.subscribe(dispatcher)
+    engine.setConnected(False)
+    port = SerialPort(logger, pingCommand.prefix, ackResponse.prefix, lambda pong: engine.setConnected(True), lambda: engine.setConnected(False), dispatcher.dispatch, writeBufferSize = None)
+    engine.write = port.write
+    checkpoint = Checkpoint(checkpointFileName) if checkpointFileName else None
+    try:
+        (command, fileName, address) = parameters[:3]
+        if command == 'dump':
+            data = engine.dump(int(address, 0), int(parameters[3], 0), checkpoint)
+            with open(fileName, 'wb') as f:
+                f.write(data)
+        else:
+            with open(fileName, 'rb') as f:
+                engine.program(int(address, 0), f.read(), verify, checkpoint, repeat)
+        print("\nDone")
+    finally:
+        if checkpoint:
+            checkpoint.close()
+
+if __name__ == '__main__':
+    if argv[1:2] == ['test']:
+        testMain(argv = argv[:1] + argv[2:])
+    else:
+        main(argv[1:])
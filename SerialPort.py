@@ -6,8 +6,9 @@
 from collections import deque
 from itertools import chain
 from re import sub
-from threading import Thread
+from threading import Lock, Thread
 from time import sleep, time
+from unittest import main, TestCase
 
 try:
     from serial import Serial, SerialTimeoutException
@@ -27,7 +28,7 @@ class SerialPort(object):
     ERROR = 3
     NONE = 4
 
-    def __init__(self, logger, ping = None, pong = '', connectCallback = None, disconnectCallback = None, readCallback = None, portTryCallback = None, externalPort = None, baudRates = BAUD_RATES):
+    def __init__(self, logger, ping = None, pong = '', connectCallback = None, disconnectCallback = None, readCallback = None, portTryCallback = None, externalPort = None, baudRates = BAUD_RATES, writeBufferSize = 1):
         self.logger = logger
         self.ping = ping
         self.pong = pong
@@ -38,12 +39,14 @@ class SerialPort(object):
         self.readCallback = readCallback
         self.portTryCallback = portTryCallback
         self.externalPort = externalPort
-        self.writeBuffer = deque(maxlen = 1)
+        self.writeBuffer = deque(maxlen = writeBufferSize) # None means unlimited, for pipelined commands
         self.port = None
         self.ready = None
         self.expectTimeout = None
         self.expectPrefix = None
         self.expectResult = None
+        self.pending = deque() # (prefix, deadline, callback) of asynchronous commands waiting for replies, oldest first
+        self.pendingLock = Lock()
         self.startThread(self.reader, 'reader')
         self.startThread(self.writer, 'writer')
         self.startThread(self.connect, 'connect')
@@ -60,14 +63,18 @@ class SerialPort(object):
     def reader(self):
         while True:
             try:
+                self.expirePending()
                 if self.port:
                     line = self.port.readline()
                     if line:
                         self.logger.info("< %s" % line.rstrip())
                         if self.expectTimeout and time() < self.expectTimeout and line.lower().startswith(self.expectPrefix.lower()):
                             self.expectResult = line
+                        elif self.pending and self.takePending(line):
+                            pass
                         elif self.ready and self.readCallback:
                             self.readCallback(line)
+                        continue # don't slow down reading while there is input
             except Exception:
                 #from traceback import format_exc
                 #print(format_exc())
@@ -117,9 +124,9 @@ class SerialPort(object):
                                 for _ in range(NUM_CONNECT_ATTEMPTS):
                                     pong = self.command(self.ping, self.pong, notReady = True)
                                     if pong is not None:
+                                        self.ready = True # before the callback, so it can write to the port
                                         if self.connectCallback:
                                             self.connectCallback(pong)
-                                        self.ready = True
                                         break
                                 else:
                                     continue
@@ -170,3 +177,124 @@ class SerialPort(object):
     def command(self, command, expectPrefix = None, idle = None, notReady = False):
         self.write(command, notReady)
         return self.expect(expectPrefix, idle, notReady) if expectPrefix is not None else None
+
+    def commandAsync(self, command, expectPrefix, callback, notReady = False): # callback(reply) is called from the reader thread, with None on timeout
+        assert self.writeBuffer.maxlen is None, "Asynchronous commands need writeBufferSize = None, or they could be dropped"
+        if not (self.port and (self.ready or notReady)):
+            self.write(command, notReady)
+            callback(None)
+            return
+        with self.pendingLock:
+            self.pending.append((expectPrefix.lower(), time() + self.port.timeout, callback))
+        self.write(command, notReady)
+
+    def takePending(self, line):
+        lowerLine = line.lower()
+        with self.pendingLock:
+            for (i, (prefix, _deadline, callback)) in enumerate(self.pending):
+                if lowerLine.startswith(prefix):
+                    del self.pending[i]
+                    break
+            else:
+                return False
+        self.callPending(callback, line)
+        return True
+
+    def expirePending(self):
+        if self.pending:
+            now = time()
+            expired = []
+            with self.pendingLock:
+                while self.pending and self.pending[0][1] <= now:
+                    expired.append(self.pending.popleft()[2])
+            for callback in expired:
+                self.callPending(callback, None)
+
+    def callPending(self, callback, reply): # a failing callback is logged, so it can't break the reader thread and the connection
+        try:
+            callback(reply)
+        except Exception: # pylint: disable=W0703
+            self.logger.exception("Ошибка обработчика ответа %s: %r", getattr(callback, '__name__', callback), reply)
+
+class SerialPortTest(TestCase):
+    class Device(object): # acknowledges every command with its number
+        def __init__(self):
+            self.name = 'TEST'
+            self.timeout = TIMEOUT
+            self.written = []
+            self.replies = deque()
+
+        def readline(self):
+            if self.replies:
+                return self.replies.popleft()
+            sleep(DT)
+            return ''
+
+        def write(self, data):
+            self.written.append(data)
+            self.replies.append('ack %d\n' % len(self.written))
+            return len(data)
+
+        def close(self):
+            pass
+
+    def testCommandAsync(self):
+        from logging import getLogger
+        device = self.Device()
+        port = SerialPort(getLogger('SerialPortTest'), externalPort = device, writeBufferSize = None)
+        timeout = time() + TIMEOUT
+        while not port.ready and time() < timeout:
+            sleep(DT)
+        self.assertTrue(port.ready)
+        replies = {}
+        port.commandAsync('tx 101', 'ack', lambda reply: replies.setdefault('A', reply))
+        port.commandAsync('tx 110', 'ack', lambda reply: replies.setdefault('B', reply))
+        timeout = time() + 2 * TIMEOUT
+        while len(replies) < 2 and time() < timeout:
+            sleep(DT)
+        self.assertEqual(device.written, ['tx 101\n', 'tx 110\n'])
+        self.assertEqual(replies, {'A': 'ack 1\n', 'B': 'ack 2\n'})
+        self.assertRaises(AssertionError, SerialPort(getLogger('SerialPortTest'), externalPort = self.Device()).commandAsync, 'tx 1', 'ack', None)
+
+    def testConnectCallback(self):
+        from logging import getLogger
+        device = self.Device()
+        ports = []
+        states = []
+        def connected(pong):
+            while not ports:
+                sleep(DT)
+            states.append((pong, ports[0].ready))
+            ports[0].write('tx 1')
+        ports.append(SerialPort(getLogger('SerialPortTest'), 'ping', 'ack', connected, externalPort = device, writeBufferSize = None))
+        timeout = time() + TIMEOUT
+        while len(device.written) < 2 and time() < timeout:
+            sleep(DT)
+        self.assertEqual(states, [('ack 1\n', True)])
+        self.assertEqual(device.written, ['ping\n', 'tx 1\n'])
+
+    def testFailingCallback(self):
+        from logging import getLogger, CRITICAL
+        logger = getLogger('SerialPortTest')
+        logger.setLevel(CRITICAL) # the tracebacks are expected
+        device = self.Device()
+        port = SerialPort(logger, externalPort = device, writeBufferSize = None)
+        timeout = time() + TIMEOUT
+        while not port.ready and time() < timeout:
+            sleep(DT)
+        self.assertTrue(port.ready)
+        def fail(reply):
+            raise ValueError(reply)
+        port.commandAsync('tx 1', 'ack', fail) # fails on the reply
+        port.commandAsync('tx 2', 'nak', fail) # never answered, fails on the timeout
+        sleep(TIMEOUT + 3 * DT)
+        replies = []
+        port.commandAsync('tx 3', 'ack', replies.append)
+        timeout = time() + TIMEOUT
+        while not replies and time() < timeout:
+            sleep(DT)
+        self.assertEqual(replies, ['ack 3\n'])
+        self.assertFalse(port.pending)
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,7 @@
 #
 # See https://docs.google.com/document/d/1J2z4WCSR-WekH4tEe7bfqvjPJ0Hx7Ww-26ECBoLwl4s
 #
-from UARTTextProtocol import Command
+from UARTTextProtocol import CommandSet
 
 # ACK status codes
 
@@ -80,52 +80,104 @@ UART_MORSE_RX = 'rx'
 UART_MORSE_TX = 'tx'
 UART_MORSE_PRINT = 'print'
 
+MORSE_TX_BITS_PER_DIT = 1 # tx and print bits are one per dit, with no НЧЛ/КНЦ wrapping, as MorseControl sends them
+
 # Command definitions
 
-pingCommand = Command(UART_PING, '', UART_ACK)
-ackResponse = Command(UART_ACK, 'd')
+SCHEMA_VERSION = 1
+
+COMMANDS = ( # (tag, args, reply, fields)
+    (UART_PING, '', UART_ACK),
+    (UART_ACK, 'd', None, ('status',)),
+
+    (UART_PILL_GET_STATE, 'd', UART_PILL_RET_STATE),
+    (UART_PILL_RET_STATE, 'dd'),
+
+    (UART_PILL_WRITE, 'dd*', UART_ACK, ('address', 'words')),
+    (UART_PILL_READ, 'dd', UART_PILL_DATA, ('address', 'count')),
+    (UART_PILL_DATA, 'd*', None, ('words',)),
+    (UART_PILL_REPEAT_WRITE, 'dd*', UART_ACK, ('address', 'words')),
+
+    (UART_SET_ID, 'd', UART_ACK, ('id',)),
+    (UART_GET_ID, '', UART_RET_ID),
+    (UART_RET_ID, 'd', None, ('id',)),
+
+    (UART_SET_TYPE, 'd', UART_ACK, ('type',)),
+    (UART_GET_TYPE, '', UART_RET_TYPE),
+    (UART_RET_TYPE, 'd', None, ('type',)),
+
+    (UART_SET_DOSE_TOP, 'd'),
+
+    (UART_MESH_GET_SETTINGS, '', UART_MESH_SETTINGS),
+    (UART_MESH_SETTINGS, 'dd'),
+
+    (UART_MESH_SET_CYCLE, 'd', UART_MESH_CYCLE_SET, ('cycle',)),
+    (UART_MESH_CYCLE_SET, 'd', None, ('cycle',)),
+
+    (UART_MESH_NODE_INFO, 'ddddddd', None, ('node', 'value1', 'value2', 'value3', 'value4', 'value5', 'value6')), # value meaning is firmware specific, see MeshTelemetry
+
+    (UART_FF_GET, '', UART_FF),
+    (UART_FF_SET, 's*', UART_ACK, ('program',)),
+    (UART_FF, 's*', None, ('program',)),
+
+    (UART_MORSE_BEEP, '', UART_ACK),
+    (UART_MORSE_SPEED, 'd', UART_ACK, ('speed',)),
+    (UART_MORSE_UART_BEEP, 'd', UART_ACK, ('enabled',)),
+    (UART_MORSE_CONNECT_BEEP, 'd', UART_ACK, ('enabled',)),
+    (UART_MORSE_RX_BEEP, 'd', UART_ACK, ('enabled',)),
+    (UART_MORSE_TX_BEEP, 'd', UART_ACK, ('enabled',)),
+    (UART_MORSE_LINE, 'd', UART_ACK, ('line',)),
+
+    (UART_MORSE_TX, 's', UART_ACK, ('bits',)),
+    (UART_MORSE_PRINT, 's', UART_ACK, ('bits',)),
+
+    (UART_MORSE_RX, 's', None, ('bits',))
+)
+
+commandSet = CommandSet(COMMANDS, SCHEMA_VERSION)
 
-pillGetStateCommand = Command(UART_PILL_GET_STATE, 'd', UART_PILL_RET_STATE)
-pillRetStateResponse = Command(UART_PILL_RET_STATE, 'dd')
+pingCommand = commandSet[UART_PING]
+ackResponse = commandSet[UART_ACK]
 
-pillWrite32Command = Command(UART_PILL_WRITE, 'dd*', UART_ACK)
-pillRead32Command = Command(UART_PILL_READ, 'dd', UART_PILL_DATA)
-pillData32Response = Command(UART_PILL_DATA, 'd*')
-pillRepeatWrite32Command = Command(UART_PILL_REPEAT_WRITE, 'dd*', UART_ACK)
+pillGetStateCommand = commandSet[UART_PILL_GET_STATE]
+pillRetStateResponse = commandSet[UART_PILL_RET_STATE]
 
-setIDCommand = Command(UART_SET_ID, 'd', UART_ACK)
-getIDCommand = Command(UART_GET_ID, '', UART_RET_ID)
-retIDResponse = Command(UART_RET_ID, 'd')
+pillWrite32Command = commandSet[UART_PILL_WRITE]
+pillRead32Command = commandSet[UART_PILL_READ]
+pillData32Response = commandSet[UART_PILL_DATA]
+pillRepeatWrite32Command = commandSet[UART_PILL_REPEAT_WRITE]
 
-setTypeCommand = Command(UART_SET_TYPE, 'd', UART_ACK)
-getTypeCommand = Command(UART_GET_TYPE, '', UART_RET_TYPE)
-retTypeResponse = Command(UART_RET_TYPE, 'd')
+setIDCommand = commandSet[UART_SET_ID]
+getIDCommand = commandSet[UART_GET_ID]
+retIDResponse = commandSet[UART_RET_ID]
 
-setDoseTopCommand = Command(UART_SET_DOSE_TOP, 'd')
+setTypeCommand = commandSet[UART_SET_TYPE]
+getTypeCommand = commandSet[UART_GET_TYPE]
+retTypeResponse = commandSet[UART_RET_TYPE]
 
-meshGetSettingsCommand = Command(UART_MESH_GET_SETTINGS, '', UART_MESH_SETTINGS)
-meshGetSettingsResponse = Command(UART_MESH_SETTINGS, 'dd')
+setDoseTopCommand = commandSet[UART_SET_DOSE_TOP]
 
-meshSetCycleCommand = Command(UART_MESH_SET_CYCLE, 'd', UART_MESH_CYCLE_SET)
-meshSetCycleResponse = Command(UART_MESH_CYCLE_SET, 'd')
+meshGetSettingsCommand = commandSet[UART_MESH_GET_SETTINGS]
+meshGetSettingsResponse = commandSet[UART_MESH_SETTINGS]
 
-meshNodeInfoResponse = Command(UART_MESH_NODE_INFO, 'ddddddd')
+meshSetCycleCommand = commandSet[UART_MESH_SET_CYCLE]
+meshSetCycleResponse = commandSet[UART_MESH_CYCLE_SET]
 
-ffGetCommand = Command(UART_FF_GET, '', UART_FF)
-ffSetCommand = Command(UART_FF_SET, 's*', UART_ACK)
-ffResponse = Command(UART_FF, 's*')
+meshNodeInfoResponse = commandSet[UART_MESH_NODE_INFO]
 
-morseBeepCommand = Command(UART_MORSE_BEEP, '', UART_ACK)
-morseSpeedCommand = Command(UART_MORSE_SPEED, 'd', UART_ACK)
-morseUartBeepCommand = Command(UART_MORSE_UART_BEEP, 'd', UART_ACK)
-morseConnectBeepCommand = Command(UART_MORSE_CONNECT_BEEP, 'd', UART_ACK)
-morseRxBeepCommand = Command(UART_MORSE_RX_BEEP, 'd', UART_ACK)
-morseTxBeepCommand = Command(UART_MORSE_TX_BEEP, 'd', UART_ACK)
-morseLineCommand = Command(UART_MORSE_LINE, 'd', UART_ACK)
+ffGetCommand = commandSet[UART_FF_GET]
+ffSetCommand = commandSet[UART_FF_SET]
+ffResponse = commandSet[UART_FF]
 
-morseTxCommand = Command(UART_MORSE_TX, 's', UART_ACK)
-morsePrintCommand = Command(UART_MORSE_PRINT, 's', UART_ACK)
+morseBeepCommand = commandSet[UART_MORSE_BEEP]
+morseSpeedCommand = commandSet[UART_MORSE_SPEED]
+morseUartBeepCommand = commandSet[UART_MORSE_UART_BEEP]
+morseConnectBeepCommand = commandSet[UART_MORSE_CONNECT_BEEP]
+morseRxBeepCommand = commandSet[UART_MORSE_RX_BEEP]
+morseTxBeepCommand = commandSet[UART_MORSE_TX_BEEP]
+morseLineCommand = commandSet[UART_MORSE_LINE]
 
-morseRxResponse = Command(UART_MORSE_RX, 's')
+morseTxCommand = commandSet[UART_MORSE_TX]
+morsePrintCommand = commandSet[UART_MORSE_PRINT]
 
-Command.linkReplies()
+morseRxResponse = commandSet[UART_MORSE_RX]
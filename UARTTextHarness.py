@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+#
+# Ostranna UART text protocol fuzz tests and throughput benchmark
+#
+# Usage: python3 UARTTextHarness.py [-f|--fuzz] [-b|--benchmark] [-n|--iterations N] [-s|--seed N] [-t|--time SECONDS]
+#
+from getopt import getopt
+from random import Random
+from sys import argv
+from time import perf_counter
+
+from UARTTextProtocol import Command, FORMATS, INT_LIMIT, MAX_COMMAND_ARGS, MAX_COMMAND_LENGTH, SEPARATOR
+from UARTTextCommands import commandSet
+
+ITERATIONS = 1000
+SEED = 0
+BENCHMARK_TIME = 0.2
+
+STR_CHARS = ''.join(chr(c) for c in range(33, 127) if chr(c) != SEPARATOR) # The protocol has no escaping for separators
+HEX_CHARS = ''.join(chr(c) for c in range(256))
+FUZZ_CHARS = '#,  0123456789abcdefxX-+.' + STR_CHARS[:20]
+
+PAYLOAD_SIZES = (16, 64, 256, 1024, 4096, MAX_COMMAND_LENGTH)
+
+def randomStr(random, chars, maxLength = 20):
+    return ''.join(random.choice(chars) for _ in range(random.randint(0, maxLength)))
+
+GENERATORS = { # 'format': random -> value
+    'd': lambda random: random.randrange(-INT_LIMIT // 2, INT_LIMIT),
+    'i': lambda random: random.randrange(-INT_LIMIT // 2, INT_LIMIT),
+    'x': lambda random: random.randrange(-INT_LIMIT // 2, INT_LIMIT // 2),
+    'f': lambda random: random.uniform(-INT_LIMIT, INT_LIMIT) if random.randint(0, 1) else random.uniform(-1, 1),
+    's': lambda random: randomStr(random, STR_CHARS),
+    'h': lambda random: randomStr(random, HEX_CHARS)
+}
+
+def normalize(fmt, value):
+    return float(FORMATS['f'][0](value)) if fmt == 'f' else value
+
+def randomArgs(random, command, maxArgs = MAX_COMMAND_ARGS):
+    formats = list(command.formats)
+    if command.varArgs:
+        formats.extend(formats[-1:] * random.randint(0, maxArgs - len(formats)))
+    return (formats, tuple(GENERATORS[fmt](random) for fmt in formats))
+
+def fuzzFormats(random, iterations = ITERATIONS):
+    for (fmt, generator) in GENERATORS.items():
+        (encoder, decoder) = FORMATS[fmt]
+        for _ in range(iterations):
+            value = generator(random)
+            data = encoder(value)
+            assert decoder(data) == normalize(fmt, value), "%s: decoder(encoder(%r)) is %r" % (fmt, value, decoder(data))
+            assert encoder(decoder(data)) == data, "%s: encoder(decoder(%s)) is %s" % (fmt, data, encoder(decoder(data)))
+
+def fuzzCommands(random, iterations = ITERATIONS):
+    for command in Command.commands.values():
+        for _ in range(iterations):
+            (formats, args) = randomArgs(random, command)
+            try:
+                data = command.encode(*args)
+            except ValueError:
+                length = len(command.prefix) + sum(len(SEPARATOR + FORMATS[fmt][0](arg)) for (fmt, arg) in zip(formats, args))
+                assert length > MAX_COMMAND_LENGTH, "%s: encode(%s) failed" % (command.tag, ', '.join(repr(arg) for arg in args))
+                continue
+            expected = tuple(normalize(fmt, arg) for (fmt, arg) in zip(formats, args))
+            assert Command.decodeCommand(data) == (command.tag, expected), "decodeCommand(%s) is %r, not %r" % (data, Command.decodeCommand(data), (command.tag, expected))
+            assert Command.decodeCommand(data.upper() if command.tag.islower() else data.lower())[0] == command.tag, "Tag %s is case sensitive" % command.tag
+            assert command.decode(data) == expected
+
+def mutate(random, data):
+    data = list(data)
+    for _ in range(random.randint(1, 3)):
+        if not data:
+            break
+        position = random.randrange(len(data))
+        operation = random.randint(0, 3)
+        if operation == 0:
+            del data[position]
+        elif operation == 1:
+            data.insert(position, random.choice(FUZZ_CHARS))
+        elif operation == 2:
+            data[position] = random.choice(FUZZ_CHARS)
+        else:
+            del data[position:]
+    return ''.join(data)
+
+def fuzzGarbage(random, iterations = ITERATIONS):
+    commands = tuple(Command.commands.values())
+    for _ in range(iterations * len(commands)):
+        if random.randint(0, 1):
+            data = randomStr(random, FUZZ_CHARS, 40)
+        else:
+            command = random.choice(commands)
+            data = mutate(random, command.encode(*randomArgs(random, command, 10)[1]))
+        try:
+            (tag, args) = Command.decodeCommand(data)
+        except ValueError:
+            continue
+        assert tag is None or isinstance(tag, str), "decodeCommand(%s) returned tag %r" % (data, tag)
+        assert args is None or tag.lower() in Command.commands, "decodeCommand(%s) returned args for unknown tag %s" % (data, tag)
+
+def fuzz(seed = SEED, iterations = ITERATIONS):
+    random = Random(seed)
+    fuzzFormats(random, iterations)
+    fuzzCommands(random, iterations // 10 or 1)
+    fuzzGarbage(random, iterations // 10 or 1)
+
+def payloads(command, size):
+    fmt = command.formats[-1]
+    if fmt in ('s', 'h'):
+        width = (size - len(command.prefix) - 1) // (2 if fmt == 'h' else 1)
+        if command.varArgs:
+            count = min(MAX_COMMAND_ARGS, max(len(command.formats), size // 64))
+            width = max(1, width // count - 1)
+            return ('0' * width,) * count
+        return ('0' * width,)
+    return (INT_LIMIT // 2 - 1,) * min(MAX_COMMAND_ARGS, max(len(command.formats), (size - len(command.prefix)) // 11))
+
+def measure(function, args, duration):
+    n = 0
+    start = perf_counter()
+    end = start + duration
+    now = start
+    while now < end:
+        for _ in range(100):
+            function(*args)
+        n += 100
+        now = perf_counter()
+    return n / (now - start)
+
+def benchmark(duration = BENCHMARK_TIME, sizes = PAYLOAD_SIZES):
+    commands = (Command.getCommand(tag) for tag in ('rx', 'ffSet', 'pillData32', 'pillWrite32'))
+    print("%-12s %6s %12s %12s %12s %10s" % ("command", "length", "encode/s", "decode/s", "set decode/s", "decode MB/s"))
+    for command in commands:
+        lengths = set()
+        for size in sizes:
+            args = payloads(command, size)
+            data = command.encode(*args)
+            if len(data) in lengths:
+                continue
+            lengths.add(len(data))
+            encodeRate = measure(Command.encodeCommand, (command.tag,) + args, duration)
+            decodeRate = measure(Command.decodeCommand, (data,), duration)
+            setDecodeRate = measure(commandSet.decodeLine, (data,), duration)
+            print("%-12s %6d %12.0f %12.0f %12.0f %10.2f" % (command.tag, len(data), encodeRate, decodeRate, setDecodeRate, decodeRate * len(data) / 1e6))
+
+def main(args):
+    doFuzz = doBenchmark = False
+    iterations = ITERATIONS
+    seed = SEED
+    duration = BENCHMARK_TIME
+    (options, _parameters) = getopt(args, 'fbn:s:t:', ('fuzz', 'benchmark', 'iterations=', 'seed=', 'time='))
+    for (option, value) in options:
+        if option in ('-f', '--fuzz'):
+            doFuzz = True
+        elif option in ('-b', '--benchmark'):
+            doBenchmark = True
+        elif option in ('-n', '--iterations'):
+            iterations = int(value)
+        elif option in ('-s', '--seed'):
+            seed = int(value)
+        elif option in ('-t', '--time'):
+            duration = float(value)
+    if not doFuzz and not doBenchmark:
+        doFuzz = doBenchmark = True
+    if doFuzz:
+        fuzz(seed, iterations)
+        print("Fuzz OK: seed %d, %d iterations" % (seed, iterations))
+    if doBenchmark:
+        benchmark(duration)
+
+if __name__ == '__main__':
+    main(argv[1:])
@@ -6,9 +6,13 @@
 # See https://docs.google.com/document/d/1J2z4WCSR-WekH4tEe7bfqvjPJ0Hx7Ww-26ECBoLwl4s
 #
 from binascii import hexlify, unhexlify
+from collections import namedtuple
 from functools import partial
 from itertools import chain
+from logging import getLogger
 from re import compile as reCompile
+from threading import Lock
+from types import MappingProxyType
 
 INT_LIMIT = 2 ** 32
 
@@ -24,6 +28,9 @@ MAX_COMMAND_ARGS = 100
 
 MAX_COMMAND_LENGTH = 10240
 
+SCHEMA_VERSION = 'version'
+SCHEMA_EMPTY = '-'
+
 def nop(s):
     return s
 
@@ -34,13 +41,17 @@ def checkStr(s):
     return s
 
 def hexStr(s):
-    return hexlify(s).upper()
+    return hexlify(s.encode('latin-1')).decode().upper()
+
+def unhexStr(s):
+    return unhexlify(s).decode('latin-1')
 
 def formatStr(fmt, value):
     return fmt % value
 
 def hexInt(i):
-    assert -INT_LIMIT // 2 <= i < INT_LIMIT // 2
+    if not -INT_LIMIT // 2 <= i < INT_LIMIT // 2:
+        raise ValueError("Integer out of range: %d" % i)
     return '0x%X' % (i % INT_LIMIT)
 
 def parseInt(s):
@@ -57,26 +68,28 @@ FORMATS = { # 'format': (encoder, decoder)
     'x': (hexInt, parseInt),
     'f': (partial(formatStr, '%f'), float),
     's': (checkStr, nop),
-    'h': (hexStr, unhexlify),
+    'h': (hexStr, unhexStr),
     '*': (REPEAT, REPEAT)
 }
 
 class Command(object):
     commands = {}
 
-    def __init__(self, tag, args = None, reply = None):
+    def __init__(self, tag, args = None, reply = None, fields = None, commands = None):
         if not tag:
             raise ValueError("Bad tag: %r" % tag)
         if args and len(args) > MAX_COMMAND_ARGS:
             raise ValueError("Bad number of arguments for command %s, expected at most %d, found %d: %s" % (tag, MAX_COMMAND_ARGS, len(args), ' '.join(args)))
         self.tag = tag
         self.prefix = COMMAND_MARKER + self.tag
+        self.formats = []
         self.encoders = []
         self.decoders = []
         self.varArgs = False
         if args:
             try:
-                for (encoder, decoder) in (FORMATS[c.lower()] for c in args):
+                for c in args:
+                    (encoder, decoder) = FORMATS[c.lower()]
                     if self.varArgs:
                         raise ValueError("Repeat argument * may only be the last one")
                     if encoder == REPEAT:
@@ -84,20 +97,30 @@ class Command(object):
                             raise ValueError("Repeat argument * must be preceded by a conventional argument")
                         self.varArgs = True
                     else:
+                        self.formats.append(c.lower())
                         self.encoders.append(encoder)
                         self.decoders.append(decoder)
             except KeyError as e:
                 raise ValueError("Unknown format tag: %s" % e)
         self.reply = reply
-        if tag.lower() in self.commands:
+        if fields is None:
+            fields = tuple('arg%d' % i for i in range(len(self.formats)))
+        elif len(fields) != len(self.formats):
+            raise ValueError("Bad number of fields for command %s, expected %d, found %d: %s" % (tag, len(self.formats), len(fields), ' '.join(fields)))
+        self.Result = namedtuple('Result', fields)
+        if commands is None:
+            commands = self.commands
+        if tag.lower() in commands:
             raise ValueError("Duplicate command tag: %s" % tag)
-        self.commands[tag.lower()] = self
+        commands[tag.lower()] = self
 
     @classmethod
-    def linkReplies(cls):
-        for (tag, command) in cls.commands.items():
+    def linkReplies(cls, commands = None):
+        if commands is None:
+            commands = cls.commands
+        for (tag, command) in commands.items():
             if command.reply and not isinstance(command.reply, Command):
-                reply = cls.commands.get(command.reply.lower())
+                reply = commands.get(command.reply.lower())
                 if reply:
                     command.reply = reply
                 else:
@@ -146,6 +169,12 @@ class Command(object):
             raise ValueError("Bad tag %s, expected %s: %s" % (tag, self.tag, data))
         return args
 
+    def result(self, args):
+        if self.varArgs:
+            n = len(self.formats) - 1
+            return self.Result(*args[:n], args[n:]) # pylint: disable=E1102
+        return self.Result(*args) # pylint: disable=E1102
+
     @classmethod
     def decodeCommand(cls, data):
         data = str(data).strip()
@@ -163,12 +192,179 @@ class Command(object):
         assert cls.encodeCommand(tag, *args) == data, "encodeCommand(%s, %s) is %s, not %s" % (tag, ', '.join(repr(arg) for arg in args), cls.encodeCommand(tag, *args), data)
         assert cls.decodeCommand(data) == (tag, args), "decodeCommand(%s, %s) is %r, not %r" % (tag, data, cls.decodeCommand(data), (tag, args))
 
+    @classmethod
+    def testBadCommand(cls, tag, *args):
+        try:
+            cls.encodeCommand(tag, *args)
+        except ValueError:
+            return
+        assert False, "encodeCommand(%s, %s) didn't fail" % (tag, ', '.join(repr(arg) for arg in args))
+
+    @classmethod
+    def testBadData(cls, data):
+        try:
+            cls.decodeCommand(data)
+        except ValueError:
+            return
+        assert False, "decodeCommand(%s) didn't fail" % data
+
+class CommandSet(object):
+    def __init__(self, schema, version = None, commands = None):
+        self.version = version
+        self.commands = Command.commands if commands is None else commands
+        staged = {} # the registry is only changed when the whole schema is valid
+        own = tuple(Command(*row, commands = staged) for row in schema)
+        for tag in staged:
+            if tag in self.commands:
+                raise ValueError("Duplicate command tag: %s" % staged[tag].tag)
+        Command.linkReplies(dict(self.commands, **staged))
+        self.commands.update(staged)
+        self.byTag = MappingProxyType(dict((command.tag, command) for command in own))
+        self.dispatch = MappingProxyType(dict(chain(((command.tag.lower(), command) for command in own), self.byTag.items())))
+
+    @classmethod
+    def fromText(cls, lines, commands = None):
+        version = None
+        schema = []
+        for line in lines:
+            words = line.split('#', 1)[0].split()
+            if not words:
+                continue
+            if words[0] == SCHEMA_VERSION:
+                if len(words) != 2 or version is not None:
+                    raise ValueError("Bad schema version: %s" % line.strip())
+                version = words[1]
+                continue
+            if len(words) < 3:
+                raise ValueError("Bad schema line: %s" % line.strip())
+            (tag, args, reply) = (None if word == SCHEMA_EMPTY else word for word in words[:3])
+            schema.append((tag, args or '', reply, tuple(words[3:]) or None))
+        return cls(schema, version, commands)
+
+    @classmethod
+    def load(cls, fileName, commands = None):
+        with open(fileName, encoding = 'utf-8') as f:
+            return cls.fromText(f, commands)
+
+    def __getitem__(self, tag):
+        return self.byTag[tag]
+
+    def __iter__(self):
+        return iter(self.byTag.values())
+
+    def __len__(self):
+        return len(self.byTag)
+
+    def lookup(self, tag):
+        return self.dispatch.get(tag) or self.dispatch.get(tag.lower())
+
+    def getCommand(self, tag):
+        tag = tag.strip()
+        if not tag:
+            raise ValueError("Empty command tag")
+        if tag.startswith(COMMAND_MARKER):
+            tag = tag[len(COMMAND_MARKER):]
+        command = self.lookup(tag)
+        if not command:
+            raise ValueError("Unknown command tag: %s" % tag)
+        return command
+
+    def encodeCommand(self, tag, *args):
+        return self.getCommand(tag).encode(*args)
+
+    def decodeLine(self, data): # (command, tag, args), command and args are None for unknown tags, everything is None for non-commands
+        data = str(data).strip()
+        if not data.startswith(COMMAND_MARKER):
+            return (None, None, None)
+        words = SEPARATORS.split(data[len(COMMAND_MARKER):])
+        command = self.lookup(words[0])
+        if not command:
+            return (None, words[0].lower(), None)
+        return (command, command.tag, command.decodeArgs(words[1:]))
+
+    def decodeCommand(self, data):
+        (_command, tag, args) = self.decodeLine(data)
+        return (tag, args)
+
+    def decode(self, data):
+        (command, tag, args) = self.decodeLine(data)
+        return (command, tag, command.result(args) if command else None)
+
+class CommandDispatcher(object):
+    def __init__(self, commandSet, marshal = None, fallback = None):
+        self.commandSet = commandSet
+        self.marshal = marshal
+        self.fallback = fallback
+        self.handlers = {}
+        self.lock = Lock()
+        self.logger = getLogger('CommandDispatcher')
+
+    def subscribe(self, command, handler, direct = False):
+        with self.lock: # handler tuples are replaced, not modified, so dispatch() needs no lock
+            self.handlers[command] = self.handlers.get(command, ()) + ((handler, direct),)
+
+    def unsubscribe(self, command, handler):
+        with self.lock:
+            handlers = tuple(h for h in self.handlers.get(command, ()) if h[0] != handler)
+            if handlers:
+                self.handlers[command] = handlers
+            else:
+                self.handlers.pop(command, None)
+
+    def call(self, handler, args, direct): # a failing handler is logged, so it can't break the reader thread and the connection
+        try:
+            if direct or not self.marshal:
+                handler(*args)
+            else:
+                self.marshal(handler, args)
+        except Exception: # pylint: disable=W0703
+            self.logger.exception("Ошибка обработчика %s%r", getattr(handler, '__name__', handler), tuple(args))
+
+    def dispatch(self, data):
+        try:
+            (command, _tag, args) = self.commandSet.decodeLine(data)
+        except ValueError:
+            command = None
+        handlers = self.handlers.get(command) if command else None
+        if not handlers:
+            if self.fallback:
+                self.call(self.fallback, (data,), False)
+            return False
+        result = command.result(args)
+        for (handler, direct) in handlers:
+            self.call(handler, result, direct)
+        return True
+
+def logUnexpectedInput(logger, data): # CommandDispatcher fallback for input not taken by any subscribed handler
+    data = data.strip()
+    try:
+        (tag, args) = Command.decodeCommand(data)
+    except ValueError as e:
+        logger.warning("Ошибка в данных: %s: %s", e, data)
+        return
+    if args is not None: # unexpected valid command
+        logger.warning("Неожиданная команда: %s %s", tag, ' '.join(str(arg) for arg in args))
+    elif tag: # unknown command
+        logger.warning("Неизвестная команда %s: %s", tag, data)
+    else: # not a command
+        logger.warning("Неожиданные данные: %s", data)
+
 def testFormat(fmt, value, data):
     (encoder, decoder) = FORMATS[fmt]
     assert encoder(value) == data, "encoder(%r) is %s, not %s" % (value, encoder(value), data)
     assert decoder(data) == value, "decoder(%s) is %r, not %r" % (data, decoder(data), value)
 
-def testFormats(): # ToDo: Add negative tests
+def testBadFormat(fmt, value = None, data = None):
+    (encoder, decoder) = FORMATS[fmt]
+    for (function, arg) in ((encoder, value), (decoder, data)):
+        if arg is not None:
+            try:
+                function(arg)
+            except ValueError:
+                continue
+            assert False, "%s(%r) didn't fail" % (function, arg)
+
+def testFormats():
     testFormat('d', 0, '0')
     testFormat('d', -1, '-1')
     testFormat('d', 2 ** 32, '4294967296')
@@ -196,8 +392,27 @@ def testFormats(): # ToDo: Add negative tests
     testFormat('h', '', '')
     testFormat('h', 'a', '61')
     testFormat('h', '-aBc\xa8\xff', '2D614263A8FF')
+    testBadFormat('d', data = '')
+    testBadFormat('d', data = '1.5')
+    testBadFormat('d', data = '0x')
+    testBadFormat('x', 2 ** 31, '0xG')
+    testBadFormat('x', -2 ** 31 - 1)
+    testBadFormat('f', data = 'abc')
+    testBadFormat('s', ' ')
+    testBadFormat('s', 'a\nb')
+    testBadFormat('s', 'Я')
+    testBadFormat('h', data = '6')
+    testBadFormat('h', data = 'ZZ')
+    testBadFormat('h', data = 'Я0')
 
-def testCommands(): # ToDo: Add negative tests
+def testBadDefinition(*args):
+    try:
+        Command(*args)
+    except ValueError:
+        return
+    assert False, "Command(%s) didn't fail" % ', '.join(repr(arg) for arg in args)
+
+def testCommands():
     Command('0', 'dixfsh', '1')
     Command('1', 'xdsfih*', '2')
     Command('2', 'fdhisx', '3')
@@ -212,8 +427,116 @@ def testCommands(): # ToDo: Add negative tests
     Command.testCommand('4', '#4,0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15', 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 0xA, 11, 12, 13, 14, 15)
     Command.testCommand('4', '#4,0', 0)
     Command.testCommand('5', '#5')
+    testBadDefinition('')
+    testBadDefinition('0', 'd')
+    testBadDefinition('6', 'q')
+    testBadDefinition('7', '*')
+    testBadDefinition('8', 'd*d')
+    testBadDefinition('9', 'd' * (MAX_COMMAND_ARGS + 1))
+    Command.testBadCommand('0')
+    Command.testBadCommand('0', 0, -1, 2 ** 30, 1, 'a', 'a', 'a')
+    Command.testBadCommand('0', 0, -1, 2 ** 31, 1, 'a', 'a')
+    Command.testBadCommand('0', 0, -1, 2 ** 30, 1, 'a b', 'a')
+    Command.testBadCommand('4')
+    Command.testBadCommand('4', *range(MAX_COMMAND_ARGS + 1))
+    Command.testBadCommand('5', 0)
+    Command.testBadCommand('1', 0, -1, 'a' * MAX_COMMAND_LENGTH, 0, 0, 'a')
+    Command.testBadCommand('unknown')
+    Command.testBadCommand(' ')
+    Command.testBadData('#0')
+    Command.testBadData('#0,0,-1,0x40000000,1.000000,a')
+    Command.testBadData('#0,0,-1,0x40000000,x,a,61')
+    Command.testBadData('#0,0,-1,0x40000000,1.000000,a,6')
+    Command.testBadData('#5,0')
+    assert Command.decodeCommand('') == (None, None)
+    assert Command.decodeCommand('5') == (None, None)
+    assert Command.decodeCommand('#unknown,1') == ('unknown', None)
+    assert Command.decodeCommand(' #4 0 , 1 ') == ('4', (0, 1))
+    Command.commands.clear()
+
+def testCommandSets():
+    schema = (('ping', '', 'ack'), ('ack', 'd', None, ('status',)), ('data', 'xs*', None, ('address', 'words')))
+    shared = CommandSet(schema, 1)
+    assert shared.commands is Command.commands and len(shared) == 3 and shared.version == 1
+    assert shared['ping'].reply is shared['ack']
+    assert shared.lookup('PING') is shared.lookup('ping') is shared['ping']
+    assert shared.decodeCommand('#Ack,3') == ('ack', (3,))
+    assert shared.decodeCommand('#Pong,3') == ('pong', None)
+    assert shared.decodeCommand('ack') == (None, None)
+    (command, tag, result) = shared.decode('#data,0x10,a,b,c')
+    assert command is shared['data'] and tag == 'data' and result == (16, ('a', 'b', 'c')) and result.address == 16 and result.words == ('a', 'b', 'c')
+    assert shared.decode('#ack,0')[2].status == 0
+    variant = CommandSet.fromText('''
+        # Variant firmware
+        version 2
+        ping - pong
+        pong dd - major minor
+        ack d - # status
+    '''.splitlines(), {})
+    assert variant.version == '2' and variant.commands is not Command.commands and len(Command.commands) == 3
+    assert variant['ping'].reply is variant['pong'] and shared['ping'].reply is shared['ack']
+    assert variant.decode('#pong,1,2')[2].minor == 2
+    assert variant.decode('#ack,1')[2].arg0 == 1
+    assert variant.decode('#Data,1,a') == (None, 'data', None)
+    assert variant.decodeLine('data') == (None, None, None)
+    assert variant.encodeCommand('#pong', 1, 2) == '#pong,1,2'
+    for (text, commands) in (('version 1\nversion 2', {}), ('ping', {}), ('ping d - a b', {}), ('ping - pong', {}), ('ack d -', Command.commands),
+                             ('fresh d -\nbad q -', Command.commands), ('fresh d -\nack d -', Command.commands), ('fresh - missing', Command.commands)):
+        try:
+            CommandSet.fromText(text.splitlines(), commands)
+        except ValueError:
+            continue
+        assert False, "Bad schema didn't fail: %r" % text
+    assert 'fresh' not in Command.commands and len(Command.commands) == 3, "Bad schema left commands registered"
+    Command.commands.clear()
+
+def testDispatcher():
+    commandSet = CommandSet((('rx', 's'), ('node', 'ddd'), ('data', 'dd*'), ('ack', 'd')), None, {})
+    calls = []
+    marshalled = []
+    dispatcher = CommandDispatcher(commandSet, lambda handler, args: marshalled.append((handler, args)), calls.append)
+    dispatcher.subscribe(commandSet['rx'], lambda bits: calls.append(('rx', bits)))
+    dispatcher.subscribe(commandSet['node'], lambda *args: calls.append(('node',) + args), True)
+    dispatcher.subscribe(commandSet['data'], lambda address, words: calls.append(('data', address, words)), True)
+    assert dispatcher.dispatch('#node,1,2,3') and calls == [('node', 1, 2, 3)]
+    assert dispatcher.dispatch('#DATA,1,2,3') and calls[-1] == ('data', 1, (2, 3))
+    assert dispatcher.dispatch('#rx,101') and len(calls) == 2 and len(marshalled) == 1
+    (handler, args) = marshalled.pop()
+    handler(*args)
+    assert calls[-1] == ('rx', '101')
+    for data in ('#ack,0', '#node,1', '#unknown', 'garbage'):
+        assert not dispatcher.dispatch(data)
+        assert marshalled.pop() == (calls.append, (data,))
+    dispatcher.unsubscribe(commandSet['node'], calls.append)
+    assert dispatcher.dispatch('#node,1,2,3')
+    dispatcher.unsubscribe(commandSet['node'], dispatcher.handlers[commandSet['node']][0][0])
+    assert not dispatcher.dispatch('#node,1,2,3') and commandSet['node'] not in dispatcher.handlers
+    def failing(*_args):
+        raise ValueError("handler bug")
+    dispatcher.subscribe(commandSet['node'], failing, True)
+    dispatcher.subscribe(commandSet['node'], lambda *args: calls.append(('node',) + args), True)
+    dispatcher.logger.disabled = True
+    assert dispatcher.dispatch('#node,4,5,6') and calls[-1] == ('node', 4, 5, 6)
+    dispatcher.logger.disabled = False
+
+def testUnexpectedInput():
+    class Logger(object):
+        def __init__(self):
+            self.warnings = []
+        def warning(self, message, *args):
+            self.warnings.append(message % args)
+    logger = Logger()
+    Command('ack', 'd')
+    for data in ('#ack,1\n', '#ack,x', '#unknown,1', 'garbage '):
+        logUnexpectedInput(logger, data)
+    assert logger.warnings[0] == "Неожиданная команда: ack 1", logger.warnings
+    assert logger.warnings[1].startswith("Ошибка в данных: ") and logger.warnings[1].endswith(": #ack,x"), logger.warnings
+    assert logger.warnings[2:] == ["Неизвестная команда unknown: #unknown,1", "Неожиданные данные: garbage"], logger.warnings
     Command.commands.clear()
 
 if __name__ == '__main__':
     testFormats()
     testCommands()
+    testCommandSets()
+    testDispatcher()
+    testUnexpectedInput()
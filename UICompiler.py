@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+#
+# Qt Designer .ui files compiled to Python classes
+#
+# A .ui file is compiled once to ui_<name>.py next to it and the resulting
+# class is kept in memory, so creating a widget does not parse XML.
+# The compiled module is rebuilt when the .ui file modification time changes,
+# if it can't be written, the module is compiled in memory only.
+#
+from importlib.util import module_from_spec, spec_from_file_location
+from io import StringIO
+from os.path import basename, dirname, getmtime, join, splitext
+from types import ModuleType
+
+try:
+    from PyQt5.uic import compileUi
+except ImportError as ex:
+    raise ImportError("%s: %s\n\nPlease install PyQt5 v5.2.1 or later: http://riverbankcomputing.com/software/pyqt/download5\n" % (ex.__class__.__name__, ex))
+
+COMPILED_PREFIX = 'ui_'
+MTIME_FIELD = 'UI_MTIME'
+
+uiClasses = {} # uiFileName: (mtime, Ui_ class)
+
+def compiledFileName(uiFileName):
+    return join(dirname(uiFileName), '%s%s.py' % (COMPILED_PREFIX, splitext(basename(uiFileName))[0]))
+
+def compileUiText(uiFileName, mtime):
+    stream = StringIO()
+    compileUi(uiFileName, stream)
+    stream.write('\n%s = %r\n' % (MTIME_FIELD, mtime))
+    return stream.getvalue()
+
+def importFile(fileName):
+    spec = spec_from_file_location(splitext(basename(fileName))[0], fileName)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def loadModule(uiFileName, mtime):
+    pyFileName = compiledFileName(uiFileName)
+    try:
+        if getmtime(pyFileName) >= mtime:
+            module = importFile(pyFileName)
+            if getattr(module, MTIME_FIELD, None) == mtime:
+                return module
+    except (OSError, SyntaxError):
+        pass
+    text = compileUiText(uiFileName, mtime)
+    try:
+        with open(pyFileName, 'w', encoding = 'utf-8') as f:
+            f.write(text)
+    except OSError:
+        pass
+    module = ModuleType(splitext(basename(pyFileName))[0]) # Executing the text directly, as bytecode cache may be stale after a fast rewrite
+    exec(compile(text, pyFileName, 'exec'), module.__dict__) # pylint: disable=W0122
+    return module
+
+def getUiClass(uiFileName):
+    mtime = getmtime(uiFileName)
+    (cachedMtime, uiClass) = uiClasses.get(uiFileName, (None, None))
+    if cachedMtime != mtime:
+        module = loadModule(uiFileName, mtime)
+        uiClass = next(value for (name, value) in vars(module).items() if name.startswith('Ui_'))
+        uiClasses[uiFileName] = (mtime, uiClass)
+    return uiClass
+
+def loadUi(uiFileName, widget): # drop-in replacement for uic.loadUi(uiFileName, widget)
+    ui = getUiClass(uiFileName)()
+    ui.setupUi(widget)
+    for (name, value) in vars(ui).items():
+        setattr(widget, name, value)
+    return widget
+
+def compileUiFile(uiFileName):
+    mtime = getmtime(uiFileName)
+    text = compileUiText(uiFileName, mtime)
+    with open(compiledFileName(uiFileName), 'w', encoding = 'utf-8') as f:
+        f.write(text)
+    return len(text)